@@ -1,6 +1,111 @@
 """Rutas adicionales de la API"""
-from fastapi import APIRouter
+import os
+import re
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from app.services.metricas import registry
+from app.services.pdf_store import pdf_store
+from app.services.task_store import task_store
 
 router = APIRouter()
 
-# Rutas adicionales pueden agregarse aquí en el futuro
+CHUNK_SIZE = 64 * 1024
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple]:
+    """Interpreta un header Range de un solo rango; None si no es válido"""
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+
+    inicio, fin = match.group(1), match.group(2)
+    if not inicio:
+        # bytes=-N: los últimos N bytes
+        largo = int(fin)
+        if largo == 0:
+            return None
+        return max(size - largo, 0), size - 1
+
+    inicio = int(inicio)
+    fin = int(fin) if fin else size - 1
+    if inicio >= size or fin < inicio:
+        return None
+    return inicio, min(fin, size - 1)
+
+
+def _leer_rango(path: str, inicio: int, fin: int):
+    with open(path, "rb") as f:
+        f.seek(inicio)
+        restante = fin - inicio + 1
+        while restante > 0:
+            bloque = f.read(min(CHUNK_SIZE, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            yield bloque
+
+
+@router.get("/api/v1/tasks/{task_id}/pdf")
+async def descargar_pdf_tarea(task_id: str, request: Request):
+    """Descarga el PDF de una tarea completada (soporta ETag y Range)"""
+    task = task_store.obtener(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+
+    pdf = (task.get("result") or {}).get("pdf")
+    path = pdf_store.existe(task_id) if pdf else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="PDF no disponible")
+
+    size = os.path.getsize(path)
+    etag = f'"{pdf.get("sha256") or f"{task_id}-{size}"}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [v.strip() for v in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        rango = _parse_range(range_header, size)
+        if rango is None:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{size}"}
+            )
+
+        inicio, fin = rango
+        headers.update({
+            "Content-Range": f"bytes {inicio}-{fin}/{size}",
+            "Content-Length": str(fin - inicio + 1),
+            "Content-Disposition": f'attachment; filename="{pdf["filename"]}"',
+        })
+        return StreamingResponse(
+            _leer_rango(path, inicio, fin),
+            status_code=206,
+            media_type="application/pdf",
+            headers=headers
+        )
+
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=pdf["filename"],
+        headers=headers
+    )
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return Response(generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -10,7 +10,63 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     task_timeout: int = 300
+    phase_timeout: int = 120
     chrome_headless: bool = True
+    browser_profile: str = "full"
+    browser_blocked_urls: str = (
+        "*.png,*.jpg,*.jpeg,*.gif,*.svg,*.ico,*.woff,*.woff2,*.ttf,*.otf,"
+        "*analytics*,*googletagmanager*,*doubleclick*"
+    )
+    executor_mode: str = "thread"
+    max_workers: int = 2
+    queue_workers: int = 0
+    worker_memory_mb: int = 600
+    queue_poll_interval: float = 0.5
+    scheduler_priorities: str = "FACTURA,BOLETA,NOTA_CREDITO"
+    scheduler_max_per_ruc: int = 1
+    circuit_enabled: bool = True
+    circuit_mode: str = "hold"
+    circuit_window: int = 10
+    circuit_min_calls: int = 5
+    circuit_failure_rate: float = 0.5
+    circuit_slow_seconds: float = 20
+    circuit_open_seconds: float = 30
+    circuit_max_open_seconds: float = 600
+    driver_pool_enabled: bool = True
+    driver_pool_min: int = 1
+    driver_pool_max: int = 2
+    driver_pool_timeout: int = 60
+    driver_max_uses: int = 20
+    driver_max_rss_mb: int = 1024
+    session_cache_enabled: bool = True
+    session_cache_ttl: int = 900
+    session_cache_max_entries: int = 100
+    client_cache_enabled: bool = True
+    client_cache_ttl: int = 2592000
+    client_cache_max_entries: int = 5000
+    client_cache_path: str = "data/clientes.db"
+    client_cache_wait: float = 3
+    pdf_download_timeout: int = 30
+    pdf_storage_dir: str = "data/pdfs"
+    continuous_emission: bool = True
+    checkpoint_retries: bool = True
+    fast_product_entry: bool = False
+    fast_product_batch: int = 10
+    task_store_backend: str = "memory"
+    task_store_path: str = "data/tasks.db"
+    task_ttl: int = 86400
+    task_max_entries: int = 10000
+    task_max_bytes: int = 256 * 1024 * 1024
+    retention_sweep_interval: int = 60
+    timing_enabled: bool = True
+    idempotency_window: int = 86400
+    webhook_secret: str = ""
+    webhook_workers: int = 2
+    webhook_queue_size: int = 1000
+    webhook_max_attempts: int = 5
+    webhook_backoff: float = 2.0
+    webhook_timeout: int = 10
+    webhook_allow_private: bool = False
     
     class Config:
         env_file = ".env"
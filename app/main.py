@@ -1,17 +1,40 @@
 """Punto de entrada FastAPI"""
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+from fastapi import FastAPI, BackgroundTasks, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
+from typing import Optional
 import uuid
+import asyncio
+import hashlib
+import json
 from datetime import datetime
 import time
 
 from app.schemas import (
-    EmisionRequest, TaskResponse, StatusResponse, HealthResponse, NotaCreditoRequest
+    EmisionRequest, TaskResponse, StatusResponse, HealthResponse, NotaCreditoRequest,
+    TaskListResponse, BatchEmisionRequest, BatchResponse, BatchItemStatus
 )
 from app.config import settings
 from app.utils.logger import logger
 from app.api.routes import router as downloads_router
+from app.services.executor import scraper_executor
+from app.services.task_store import (
+    task_store, nueva_tarea, redactar_credenciales, clave_idempotencia, ESTADOS_FINALES
+)
+from app.services.retention import retention_sweeper
+from app.services.pdf_store import pdf_store
+from app.services.session_cache import clave_credenciales
+from app.services.clientes_cache import clientes_cache
+from app.utils.driver_pool import driver_pool
+from app.services import metricas
+from app.services.webhooks import webhook_dispatcher
+from app.services.eventos import eventos_tareas
+from app.services.planificador import planificador
+from app.services.circuito import circuito_portal
+from app.services.cola_trabajos import (
+    ObservadorCola, estado_workers, posiciones_cola, registrar_resultado, verificar_repositorio
+)
+from app.utils import cancelacion
 
 app = FastAPI(
     title=settings.app_name,
@@ -28,16 +51,54 @@ app.add_middleware(
         "https://frontend-factura-movil.vercel.app/"
     ],
     allow_credentials=True,
-    allow_methods=["GET", "POST"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Content-Type", "Authorization", "Idempotency-Key"],
+    expose_headers=["Idempotent-Replayed"],
 )
 
-# Almacenamiento temporal de tareas
-tasks_storage: Dict[str, dict] = {}
+app.include_router(downloads_router)
+
+# Los PDF se eliminan junto con su tarea; los nunca asociados, tras una hora
+retention_sweeper.on_evict(pdf_store.eliminar)
+retention_sweeper.on_sweep(lambda: pdf_store.purgar_huerfanos(3600))
+retention_sweeper.on_sweep(clientes_cache.purgar)
+
+# Segundos extra que la API espera a un worker antes de darlo por colgado
+MARGEN_TIMEOUT = 15
+
+# Espera máxima de una consulta de estado con ?wait= y frecuencia del keep-alive del stream SSE
+MAX_ESPERA_ESTADO = 60
+INTERVALO_KEEPALIVE = 15
 
 # Tiempo de inicio del servidor
 start_time = time.time()
 
+@app.on_event("startup")
+async def startup():
+    """Inicia el pool de workers de scraping y precalienta los drivers"""
+    if scraper_executor.mode == "queue":
+        # Los trabajos los ejecuta worker.py; la API publica lo que este escribe en el repositorio
+        verificar_repositorio()
+        observador_cola.start()
+    scraper_executor.start()
+    
+    # En modo process cada worker mantiene su propio pool de drivers
+    if scraper_executor.mode == "thread":
+        asyncio.get_running_loop().run_in_executor(None, driver_pool.calentar)
+    
+    retention_sweeper.start()
+    webhook_dispatcher.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Detiene el pool de workers de scraping y cierra los drivers"""
+    await retention_sweeper.stop()
+    await observador_cola.stop()
+    await webhook_dispatcher.stop()
+    scraper_executor.shutdown(wait=False)
+    driver_pool.cerrar()
+    task_store.cerrar()
+
 @app.get("/")
 async def root():
     """Endpoint raíz"""
@@ -50,56 +111,143 @@ async def root():
 @app.get("/api/v1/health", response_model=HealthResponse)
 async def health_check():
     """Health check del servicio"""
-    active_tasks = len([t for t in tasks_storage.values() if t["status"] == "processing"])
     uptime = time.time() - start_time
+    retencion = retention_sweeper.estadisticas()
+    
+    if scraper_executor.mode == "queue":
+        # El circuito y los navegadores viven en los procesos de worker.py, que publican su estado
+        circuito = estado_workers()
+        activos = task_store.contar_por_estado().get("processing", 0)
+        selenium_listo = circuito["live_workers"] > 0
+    else:
+        circuito = circuito_portal.estadisticas()
+        activos = scraper_executor.activos
+        selenium_listo = _selenium_listo()
     
     return HealthResponse(
-        status="healthy",
+        status="healthy" if circuito["state"] == "closed" else "degraded",
         version=settings.version,
-        selenium_ready=True,
-        active_tasks=active_tasks,
-        uptime_seconds=uptime
+        selenium_ready=selenium_listo,
+        active_tasks=activos,
+        uptime_seconds=uptime,
+        retained_tasks=retencion["entradas"],
+        retained_bytes=retencion["bytes"],
+        portal_circuit=circuito
     )
 
+def _selenium_listo() -> bool:
+    """True si hay drivers de Chrome vivos o si se crean bajo demanda"""
+    if scraper_executor.mode != "thread" or not driver_pool.enabled:
+        return True
+    return driver_pool.total > 0
+
 @app.post("/api/v1/emitir", response_model=TaskResponse, status_code=202)
 async def emitir_comprobante(
     request: EmisionRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
 ):
     """Envía un comprobante a SUNAT de forma asíncrona"""
-    task_id = str(uuid.uuid4())
-    
-    # Guardar tarea en storage
-    tasks_storage[task_id] = {
-        "task_id": task_id,
-        "status": "pending",
-        "data": request.model_dump(),
-        "created_at": datetime.utcnow().isoformat(),
-        "started_at": None,
-        "completed_at": None,
-        "result": None
-    }
+    data = request.model_dump()
+    await _validar_callbacks(data.get("callback_url"))
+    
+    # Guardar tarea en el repositorio; un reintento recibe la tarea ya existente
+    task, creada = _crear_tarea(data, idempotency_key, response)
+    if not creada:
+        return _tarea_repetida(task)
     
     # Agregar tarea en background
-    background_tasks.add_task(process_emission, task_id, request.model_dump())
+    _programar(background_tasks, process_emission, task["task_id"], data)
     
-    logger.info(f"Tarea {task_id} creada para {request.tipo_documento}")
+    logger.info(f"Tarea {task['task_id']} creada para {request.tipo_documento}")
     
     return TaskResponse(
-        task_id=task_id,
+        task_id=task["task_id"],
         status="pending",
         message="Comprobante en cola para procesamiento",
-        created_at=tasks_storage[task_id]["created_at"]
+        created_at=task["created_at"]
     )
 
-@app.get("/api/v1/status/{task_id}", response_model=StatusResponse)
-async def get_task_status(task_id: str):
-    """Consulta el estado de una emisión"""
-    if task_id not in tasks_storage:
-        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+def _programar(background_tasks: BackgroundTasks, func, *args) -> None:
+    """Ejecuta el trabajo en este proceso; en modo queue la tarea pendiente ya es el trabajo encolado"""
+    if scraper_executor.mode != "queue":
+        background_tasks.add_task(func, *args)
+
+def _huella(data: dict) -> str:
+    """Hash del contenido de una solicitud, sin la contraseña"""
+    contenido = json.dumps(redactar_credenciales(data), sort_keys=True, default=str)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+async def _validar_callbacks(*urls: Optional[str]) -> None:
+    """Rechaza con 422 las callback_url que apuntan a direcciones internas o no resuelven"""
+    for url in {u for u in urls if u}:
+        try:
+            await asyncio.to_thread(webhook_dispatcher.validar_destino, url)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except OSError as e:
+            raise HTTPException(status_code=422, detail=f"No se pudo resolver el host de la callback_url: {e}")
+
+def _registrar_tarea(data: dict, clave: Optional[str], batch_id: Optional[str] = None,
+                     batch_index: Optional[int] = None) -> tuple:
+    """Crea la tarea o retorna la existente con la misma clave de idempotencia: (tarea, creada)"""
+    # Solo los workers de modo queue leen la contraseña del repositorio; los demás modos la reciben en memoria
+    guardada = data if scraper_executor.mode == "queue" else redactar_credenciales(data)
+    task, creada = task_store.crear_o_reutilizar(
+        nueva_tarea(str(uuid.uuid4()), guardada, batch_id=batch_id, batch_index=batch_index, idempotency_key=clave),
+        settings.idempotency_window
+    )
+    if creada:
+        metricas.tarea_encolada(task["task_id"])
+        return task, True
     
-    task = tasks_storage[task_id]
+    if _huella(task["data"]) != _huella(data):
+        raise HTTPException(
+            status_code=409,
+            detail=f"El comprobante o la Idempotency-Key ya corresponden a la tarea {task['task_id']} con otro contenido"
+        )
     
+    metricas.solicitud_repetida()
+    logger.info(f"Solicitud repetida, se reutiliza la tarea {task['task_id']} ({task['status']})")
+    return task, False
+
+def _crear_tarea(data: dict, idempotency_key: Optional[str], response: Response) -> tuple:
+    """Crea la tarea o, si la solicitud repite una anterior, retorna la existente: (tarea, creada)"""
+    task, creada = _registrar_tarea(data, clave_idempotencia(data, idempotency_key))
+    if not creada:
+        response.status_code = 200
+        response.headers["Idempotent-Replayed"] = "true"
+    return task, creada
+
+def _descartar_tareas(tasks: list, detalle: str) -> None:
+    """Cancela tareas recién creadas que no se llegaron a programar"""
+    for task in tasks:
+        if task_store.transicionar(
+            task["task_id"], ["pending"], "cancelled",
+            data=redactar_credenciales(task["data"]),
+            result=cancelacion.resultado_interrumpido("cancelled", detalle),
+            completed_at=datetime.utcnow().isoformat()
+        ):
+            metricas.tarea_iniciada(task["task_id"])
+
+def _tarea_repetida(task: dict) -> TaskResponse:
+    """Respuesta para una solicitud que reutiliza una tarea existente"""
+    return TaskResponse(
+        task_id=task["task_id"],
+        status=task["status"],
+        message="Solicitud repetida: se retorna la tarea existente",
+        created_at=task["created_at"]
+    )
+
+def _posicion_en_cola(task_id: str) -> Optional[int]:
+    """En modo queue la cola la reparten los workers desde el repositorio, no el planificador de la API"""
+    if scraper_executor.mode == "queue":
+        return posiciones_cola.posicion(task_id)
+    return planificador.posicion(task_id)
+
+def _status_response(task: dict) -> StatusResponse:
+    """Construye la respuesta de estado de una tarea"""
     duration = None
     if task["started_at"] and task["completed_at"]:
         start = datetime.fromisoformat(task["started_at"])
@@ -109,12 +257,258 @@ async def get_task_status(task_id: str):
     return StatusResponse(
         task_id=task["task_id"],
         status=task["status"],
+        phase=eventos_tareas.fase(task["task_id"]) if task["status"] == "processing" else None,
+        queue_position=_posicion_en_cola(task["task_id"]) if task["status"] == "pending" else None,
         result=task["result"],
         started_at=task["started_at"],
         completed_at=task["completed_at"],
         duration_seconds=duration
     )
 
+@app.post("/api/v1/emitir/batch", response_model=BatchResponse, status_code=202)
+async def emitir_lote(
+    request: BatchEmisionRequest,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
+):
+    """Envía un lote de comprobantes; los de las mismas credenciales comparten sesión"""
+    await _validar_callbacks(*(item.callback_url for item in request.items))
+    
+    # Un comprobante repetido dentro del mismo lote se emitiría dos veces con claves distintas
+    vistos = {}
+    for index, item in enumerate(request.items):
+        clave = clave_idempotencia(item.model_dump())
+        if clave is None:
+            continue
+        if clave in vistos:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Los items {vistos[clave]} y {index} del lote son el mismo comprobante "
+                       f"{item.resumen.serie}-{item.resumen.numero}"
+            )
+        vistos[clave] = index
+    
+    batch_id = str(uuid.uuid4())
+    tareas = []
+    creadas = []
+    datos = {}
+    
+    try:
+        for index, item in enumerate(request.items):
+            data = item.model_dump()
+            # Cada item se deduplica como una emisión individual: por comprobante o por
+            # Idempotency-Key del lote y posición, así un lote reenviado no vuelve a emitir
+            clave = clave_idempotencia(data, f"{idempotency_key}:{index}" if idempotency_key else None)
+            task, creada = _registrar_tarea(data, clave, batch_id=batch_id, batch_index=index)
+            tareas.append(task)
+            if creada:
+                creadas.append(task)
+                datos[task["task_id"]] = data
+    except HTTPException:
+        _descartar_tareas(creadas, "Lote rechazado: un item repite otro comprobante con distinto contenido")
+        raise
+    
+    grupos = {}
+    for task in creadas:
+        data = datos[task["task_id"]]
+        grupos.setdefault(clave_credenciales(data["credenciales"]), []).append((task["task_id"], data))
+    
+    for grupo in grupos.values():
+        _programar(background_tasks, process_batch_group, grupo)
+    
+    if not creadas:
+        lotes = {task["batch_id"] for task in tareas}
+        if len(lotes) == 1 and None not in lotes:
+            # Reenvío del mismo lote: se responde con el lote original
+            batch_id = lotes.pop()
+        response.status_code = 200
+        response.headers["Idempotent-Replayed"] = "true"
+    
+    logger.info(
+        f"Lote {batch_id} creado: {len(creadas)} de {len(request.items)} comprobantes nuevos "
+        f"en {len(grupos)} sesiones"
+    )
+    
+    return _batch_response(batch_id, tareas)
+
+@app.get("/api/v1/batch/{batch_id}", response_model=BatchResponse)
+async def get_batch_status(batch_id: str):
+    """Consulta el estado agregado y por comprobante de un lote"""
+    tasks = task_store.listar_lote(batch_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    
+    return _batch_response(batch_id, tasks)
+
+def _batch_response(batch_id: str, tasks: list) -> BatchResponse:
+    """Construye la respuesta agregada de un lote"""
+    counts = {}
+    for task in tasks:
+        counts[task["status"]] = counts.get(task["status"], 0) + 1
+    
+    if set(counts) == {"pending"}:
+        status = "pending"
+    elif counts.get("pending") or counts.get("processing"):
+        status = "processing"
+    elif set(counts) == {"completed"}:
+        status = "completed"
+    elif set(counts) == {"failed"}:
+        status = "failed"
+    else:
+        status = "partial"
+    
+    items = []
+    for task in tasks:
+        resumen = task["data"].get("resumen") or {}
+        items.append(BatchItemStatus(
+            task_id=task["task_id"],
+            status=task["status"],
+            serie=resumen.get("serie"),
+            numero=resumen.get("numero"),
+            result=task["result"]
+        ))
+    
+    return BatchResponse(
+        batch_id=batch_id,
+        status=status,
+        total=len(tasks),
+        counts=counts,
+        items=items
+    )
+
+@app.get("/api/v1/status/{task_id}", response_model=StatusResponse)
+async def get_task_status(task_id: str, wait: int = Query(default=0, ge=0, le=MAX_ESPERA_ESTADO)):
+    """Consulta el estado de una emisión; con wait espera hasta esos segundos un cambio de estado o fase"""
+    # La suscripción va antes de la lectura para no perder un cambio ocurrido entre ambas
+    async with eventos_tareas.suscribir(task_id) as cola:
+        task = task_store.obtener(task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="Tarea no encontrada")
+        if not wait or task["status"] in ESTADOS_FINALES:
+            return _status_response(task)
+        
+        try:
+            await asyncio.wait_for(cola.get(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+    
+    task = task_store.obtener(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    return _status_response(task)
+
+@app.get("/api/v1/status/{task_id}/stream")
+async def stream_task_status(task_id: str, request: Request):
+    """Envía por Server-Sent Events el estado de la tarea en cada cambio de estado o de fase"""
+    if task_store.obtener(task_id) is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    return StreamingResponse(
+        _eventos_estado(task_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _evento_sse(evento: str, respuesta: StatusResponse) -> str:
+    return f"event: {evento}\ndata: {respuesta.model_dump_json()}\n\n"
+
+async def _eventos_estado(task_id: str, request: Request):
+    """Genera los eventos SSE de una tarea hasta que finaliza o el cliente se desconecta"""
+    async with eventos_tareas.suscribir(task_id) as cola:
+        task = task_store.obtener(task_id)
+        if task is None:
+            return
+        yield _evento_sse("status", _status_response(task))
+        
+        while task["status"] not in ESTADOS_FINALES:
+            try:
+                evento = await asyncio.wait_for(cola.get(), timeout=INTERVALO_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            
+            task = task_store.obtener(task_id)
+            if task is None:
+                return
+            respuesta = _status_response(task)
+            if evento["tipo"] == "fase" and task["status"] == "processing":
+                # Cada evento reporta su propia fase aunque ya se haya completado la siguiente
+                yield _evento_sse("phase", respuesta.model_copy(update={"phase": evento["fase"]}))
+            else:
+                yield _evento_sse("status", respuesta)
+
+@app.get("/api/v1/tasks", response_model=TaskListResponse)
+async def list_tasks(
+    status: Optional[str] = None,
+    id_remitente: Optional[str] = None,
+    serie: Optional[str] = None,
+    numero: Optional[str] = None,
+    limit: int = 100
+):
+    """Lista tareas filtrando por estado, remitente o serie/número"""
+    tasks = task_store.listar(
+        status=status,
+        id_remitente=id_remitente,
+        serie=serie,
+        numero=numero,
+        limit=min(max(limit, 1), 500)
+    )
+    return TaskListResponse(
+        tasks=[_status_response(t) for t in tasks],
+        total=len(tasks)
+    )
+
+@app.delete("/api/v1/tasks/{task_id}", response_model=StatusResponse)
+async def cancel_task(task_id: str):
+    """Cancela una tarea pendiente o en proceso"""
+    task = task_store.obtener(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    
+    detalle = "Tarea cancelada por el cliente"
+    if task["status"] == "processing":
+        motivo = _motivo_no_cancelable(task, detalle)
+        if motivo is not None:
+            raise HTTPException(status_code=409, detail=f"La tarea ya no se puede cancelar: {motivo}")
+    
+    cancelada = task_store.transicionar(
+        task_id, ["pending", "processing"], "cancelled",
+        data=redactar_credenciales(task["data"]),
+        result=cancelacion.resultado_interrumpido("cancelled", detalle),
+        completed_at=datetime.utcnow().isoformat()
+    )
+    if not cancelada:
+        task = task_store.obtener(task_id) or task
+        raise HTTPException(status_code=409, detail=f"La tarea ya finalizó con estado {task['status']}")
+    
+    if task["status"] == "pending":
+        planificador.retirar(task_id)
+        metricas.tarea_iniciada(task_id)
+    metricas.tarea_finalizada(task["data"].get("tipo_documento", "NOTA_CREDITO"), "cancelled", None)
+    
+    logger.info(f"Tarea {task_id} cancelada")
+    eventos_tareas.publicar_estado(task_id, "cancelled", final=True)
+    task = task_store.obtener(task_id)
+    _notificar(task)
+    return _status_response(task)
+
+def _motivo_no_cancelable(task: dict, detalle: str) -> Optional[str]:
+    """Detiene una tarea en proceso; retorna por qué no se puede o None si se detuvo"""
+    if scraper_executor.mode == "process":
+        return "en modo process el trabajo en curso no se puede detener desde la API"
+    if scraper_executor.mode == "queue":
+        # El worker.py que la ejecuta detecta la cancelación en el repositorio y la aplica
+        # o, si llegó tarde, devuelve la tarea a processing para conservar su resultado
+        if task.get("fase") in cancelacion.FASES_EMITIDAS:
+            return "la emisión ya se confirmó en SUNAT"
+        if task.get("batch_id") and task.get("fase"):
+            return "el comprobante ya está en proceso dentro de su lote"
+        return None
+    return cancelacion.cancelar_tarea(task["task_id"], detalle)
+
 @app.post("/api/v1/validate")
 async def validate_comprobante(request: EmisionRequest):
     """Valida datos antes de enviar (sin ejecutar scraping)"""
@@ -139,105 +533,208 @@ async def validate_comprobante(request: EmisionRequest):
         if not request.cliente.ruc:
             errors.append("Factura requiere RUC del cliente")
     
+    # Razón social que el portal resolvió antes para el documento del cliente
+    numero = request.cliente.ruc if request.tipo_documento == "FACTURA" else request.cliente.dni
+    razon_social = clientes_cache.obtener(numero) if numero else None
+    if numero and razon_social is None:
+        warnings.append(f"Documento {numero} no consultado aún: SUNAT resolverá la razón social al emitir")
+    elif razon_social and request.cliente.nombre and \
+            request.cliente.nombre.strip().upper() != razon_social.upper():
+        warnings.append(
+            f"El nombre '{request.cliente.nombre}' no coincide con la razón social registrada '{razon_social}'"
+        )
+    
     return {
         "valid": len(errors) == 0,
         "errors": errors,
-        "warnings": warnings
+        "warnings": warnings,
+        "razon_social": razon_social
     }
 
 @app.post("/api/v1/nota-credito", response_model=TaskResponse, status_code=202)
 async def emitir_nota_credito(
     request: NotaCreditoRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    response: Response,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")
 ):
     """Emite una nota de crédito en SUNAT de forma asíncrona"""
-    task_id = str(uuid.uuid4())
-    
-    tasks_storage[task_id] = {
-        "task_id": task_id,
-        "status": "pending",
-        "data": request.model_dump(),
-        "created_at": datetime.utcnow().isoformat(),
-        "started_at": None,
-        "completed_at": None,
-        "result": None
-    }
+    data = request.model_dump()
+    await _validar_callbacks(data.get("callback_url"))
+    
+    task, creada = _crear_tarea(data, idempotency_key, response)
+    if not creada:
+        return _tarea_repetida(task)
     
-    background_tasks.add_task(process_nota_credito, task_id, request.model_dump())
+    _programar(background_tasks, process_nota_credito, task["task_id"], data)
     
-    logger.info(f"Tarea {task_id} creada para NOTA_CREDITO - Boleta: {request.numero_boleta}")
+    logger.info(f"Tarea {task['task_id']} creada para NOTA_CREDITO - Boleta: {request.numero_boleta}")
     
     return TaskResponse(
-        task_id=task_id,
+        task_id=task["task_id"],
         status="pending",
         message="Nota de crédito en cola para procesamiento",
-        created_at=tasks_storage[task_id]["created_at"]
+        created_at=task["created_at"]
     )
 
 async def process_emission(task_id: str, data: dict):
     """Procesa la emisión del comprobante con Selenium"""
-    try:
-        # Actualizar estado
-        tasks_storage[task_id]["status"] = "processing"
-        tasks_storage[task_id]["started_at"] = datetime.utcnow().isoformat()
-        
-        logger.info(f"Procesando tarea {task_id}")
+    from app.services.scraper_service import send_billing_sunat
+    await _ejecutar_tarea(task_id, send_billing_sunat, data)
+
+async def process_nota_credito(task_id: str, data: dict):
+    """Procesa la emisión de nota de crédito con Selenium"""
+    from app.services.nota_credito import send_nota_credito_sunat
+    await _ejecutar_tarea(task_id, send_nota_credito_sunat, data)
+
+async def process_batch_group(tareas: list):
+    """Procesa en una sola sesión y un solo turno los comprobantes de un lote con las mismas credenciales"""
+    from app.services.scraper_service import send_billing_batch_sunat
+    
+    ruc = _ruc(tareas[0][1])
+    tipo = min((data["tipo_documento"] for _, data in tareas), key=planificador.clase)
+    async with planificador.turno([task_id for task_id, _ in tareas], ruc, tipo):
+        inicio = datetime.utcnow().isoformat()
+        for task_id, _ in tareas:
+            metricas.tarea_iniciada(task_id)
+        tareas = [
+            (task_id, data) for task_id, data in tareas
+            if task_store.transicionar(task_id, ["pending"], "processing", started_at=inicio)
+        ]
+        if not tareas:
+            return
+        for task_id, _ in tareas:
+            eventos_tareas.publicar_estado(task_id, "processing")
         
-        # Importar y ejecutar scraper
-        from app.services.scraper_service import send_billing_sunat
-        result = send_billing_sunat(data)
+        # Con el portal caído (modo fail) el lote falla sin lanzar Chrome
+        rechazo = circuito_portal.rechazar()
+        if rechazo is not None:
+            for task_id, data in tareas:
+                _finalizar_tarea(task_id, data, rechazo)
+            return
         
-        # Actualizar resultado
-        if result.get("success"):
-            tasks_storage[task_id]["status"] = "completed"
-            tasks_storage[task_id]["result"] = result
-        else:
-            tasks_storage[task_id]["status"] = "failed"
-            tasks_storage[task_id]["result"] = result
+        def on_item(index: int, result: dict) -> None:
+            task_id, data = tareas[index]
+            _finalizar_tarea(task_id, data, result)
         
-        tasks_storage[task_id]["completed_at"] = datetime.utcnow().isoformat()
+        # En modo process el callback no cruza el límite del proceso: se registra al final
+        callback = on_item if scraper_executor.mode == "thread" else None
         
-        logger.info(f"Tarea {task_id} completada con estado: {tasks_storage[task_id]['status']}")
+        ids = [task_id for task_id, _ in tareas]
+        timeout = settings.task_timeout * len(tareas)
+        try:
+            resultados = await asyncio.wait_for(
+                scraper_executor.run(
+                    cancelacion.ejecutar_controlado, ids, timeout,
+                    send_billing_batch_sunat, [data for _, data in tareas], callback
+                ),
+                timeout=timeout + MARGEN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            resultados = [_interrumpir_por_timeout(ids, timeout)] * len(tareas)
+        except Exception as e:
+            logger.error(f"Error en lote: {str(e)}")
+            resultados = [{"success": False, "error": str(e)}] * len(tareas)
         
-    except Exception as e:
-        logger.error(f"Error en tarea {task_id}: {str(e)}")
-        tasks_storage[task_id]["status"] = "failed"
-        tasks_storage[task_id]["completed_at"] = datetime.utcnow().isoformat()
-        tasks_storage[task_id]["result"] = {
-            "success": False,
-            "error": str(e)
-        }
+        for index, result in enumerate(resultados):
+            task_id, data = tareas[index]
+            # Si el callback ya la finalizó, la transición desde processing no aplica
+            _finalizar_tarea(task_id, data, result)
 
-async def process_nota_credito(task_id: str, data: dict):
-    """Procesa la emisión de nota de crédito con Selenium"""
-    try:
-        tasks_storage[task_id]["status"] = "processing"
-        tasks_storage[task_id]["started_at"] = datetime.utcnow().isoformat()
+def _ruc(data: dict) -> str:
+    return (data.get("credenciales") or {}).get("ruc") or ""
+
+async def _ejecutar_tarea(task_id: str, func, data: dict):
+    """Espera su turno en el planificador, ejecuta el scraper en el pool de workers y registra el resultado"""
+    tipo = data.get("tipo_documento", "NOTA_CREDITO")
+    async with planificador.turno([task_id], _ruc(data), tipo) as concedido:
+        # Una tarea cancelada mientras esperaba su turno ya no se ejecuta
+        if not concedido:
+            return
         
-        logger.info(f"Procesando nota de crédito {task_id}")
+        metricas.tarea_iniciada(task_id)
         
-        from app.services.nota_credito import send_nota_credito_sunat
-        result = send_nota_credito_sunat(data)
+        # La transición es atómica: si otro worker ya tomó la tarea, no se repite
+        if not task_store.transicionar(
+            task_id, ["pending"], "processing", started_at=datetime.utcnow().isoformat()
+        ):
+            logger.warning(f"Tarea {task_id} ya no está pendiente, se omite")
+            return
+        eventos_tareas.publicar_estado(task_id, "processing")
         
-        if result.get("success"):
-            tasks_storage[task_id]["status"] = "completed"
-            tasks_storage[task_id]["result"] = result
-        else:
-            tasks_storage[task_id]["status"] = "failed"
-            tasks_storage[task_id]["result"] = result
+        rechazo = circuito_portal.rechazar()
+        if rechazo is not None:
+            _finalizar_tarea(task_id, data, rechazo)
+            return
         
-        tasks_storage[task_id]["completed_at"] = datetime.utcnow().isoformat()
+        try:
+            logger.info(f"Procesando tarea {task_id}")
+            result = await asyncio.wait_for(
+                scraper_executor.run(
+                    cancelacion.ejecutar_controlado, [task_id], settings.task_timeout, func, data
+                ),
+                timeout=settings.task_timeout + MARGEN_TIMEOUT
+            )
         
-        logger.info(f"Tarea {task_id} completada con estado: {tasks_storage[task_id]['status']}")
+        except asyncio.TimeoutError:
+            result = _interrumpir_por_timeout([task_id], settings.task_timeout)
+        except Exception as e:
+            logger.error(f"Error en tarea {task_id}: {str(e)}")
+            result = {
+                "success": False,
+                "error": str(e)
+            }
         
-    except Exception as e:
-        logger.error(f"Error en tarea {task_id}: {str(e)}")
-        tasks_storage[task_id]["status"] = "failed"
-        tasks_storage[task_id]["completed_at"] = datetime.utcnow().isoformat()
-        tasks_storage[task_id]["result"] = {
-            "success": False,
-            "error": str(e)
-        }
+        _finalizar_tarea(task_id, data, result)
+
+def _interrumpir_por_timeout(task_ids: list, timeout: float) -> dict:
+    """Corta desde la API un trabajo que no respetó su propio plazo"""
+    detalle = f"Tiempo límite de la tarea excedido ({timeout:g}s)"
+    for task_id in task_ids:
+        cancelacion.cancelar(task_id, "timeout", detalle)
+    return cancelacion.resultado_interrumpido("timeout", detalle)
+
+def _finalizar_tarea(task_id: str, data: dict, result: dict) -> bool:
+    """Registra el resultado de una tarea en proceso; False si ya estaba finalizada"""
+    status = registrar_resultado(task_id, data, result)
+    if status is None:
+        return False
+    
+    metricas.tarea_finalizada(data.get("tipo_documento", "NOTA_CREDITO"), status, result.get("tiempos"))
+    eventos_tareas.publicar_estado(task_id, status, final=True)
+    _notificar(task_store.obtener(task_id))
+    return True
+
+def _cambio_en_cola(task: dict, anterior: Optional[tuple]) -> None:
+    """Publica en la API lo que un proceso de worker.py hizo con una tarea"""
+    task_id, status = task["task_id"], task["status"]
+    if status == "pending":
+        return
+    # Sale de la cola una sola vez aunque el worker la haya tomado y terminado entre dos revisiones
+    metricas.tarea_iniciada(task_id)
+    
+    if status == "processing":
+        if anterior is None or anterior[0] != "processing":
+            eventos_tareas.publicar_estado(task_id, "processing")
+        if task.get("fase"):
+            eventos_tareas.publicar_fase([task_id], task["fase"])
+    elif status in ESTADOS_FINALES and status != "cancelled":
+        # Las cancelaciones ya las publicó el endpoint que las hizo
+        result = task["result"] or {}
+        metricas.tarea_finalizada(task["data"].get("tipo_documento", "NOTA_CREDITO"), status, result.get("tiempos"))
+        eventos_tareas.publicar_estado(task_id, status, final=True)
+        _notificar(task)
+
+observador_cola = ObservadorCola(_cambio_en_cola, settings.queue_poll_interval)
+
+def _notificar(task: Optional[dict]) -> None:
+    """Envía el estado final de la tarea a su callback_url, si la tiene"""
+    if task is None or not task["data"].get("callback_url"):
+        return
+    
+    payload = _status_response(task).model_dump()
+    payload["batch_id"] = task.get("batch_id")
+    webhook_dispatcher.encolar(task["data"]["callback_url"], f"task.{task['status']}", payload)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,8 +1,11 @@
 """Schemas de request/response"""
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
+# URL http(s) que recibe el resultado de la tarea al finalizar
+URL_CALLBACK = r"^https?://[^\s/$.?#][^\s]*$"
+
 class Cliente(BaseModel):
     nombre: Optional[str] = None
     dni: Optional[str] = None
@@ -37,6 +40,7 @@ class EmisionRequest(BaseModel):
     fecha: str
     id_remitente: str
     credenciales: Credenciales
+    callback_url: Optional[str] = Field(default=None, pattern=URL_CALLBACK, max_length=2048)
     
     #validaremos la fecha en formato dd/mm/yyyy
     @classmethod
@@ -53,6 +57,9 @@ class EmisionRequest(BaseModel):
             raise ValueError("La fecha debe estar en formato dd/mm/yyyy")
         return v
 
+class BatchEmisionRequest(BaseModel):
+    items: List[EmisionRequest] = Field(min_length=1, max_length=500)
+
 class TaskResponse(BaseModel):
     task_id: str
     status: str
@@ -62,17 +69,40 @@ class TaskResponse(BaseModel):
 class StatusResponse(BaseModel):
     task_id: str
     status: str
+    phase: Optional[str] = None
+    queue_position: Optional[int] = None
     result: Optional[dict] = None
     started_at: Optional[str] = None
     completed_at: Optional[str] = None
     duration_seconds: Optional[float] = None
 
+class TaskListResponse(BaseModel):
+    tasks: List[StatusResponse]
+    total: int
+
+class BatchItemStatus(BaseModel):
+    task_id: str
+    status: str
+    serie: Optional[str] = None
+    numero: Optional[str] = None
+    result: Optional[dict] = None
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    counts: Dict[str, int]
+    items: List[BatchItemStatus]
+
 class HealthResponse(BaseModel):
     status: str
     version: str
     selenium_ready: bool
     active_tasks: int
     uptime_seconds: Optional[float] = None
+    retained_tasks: Optional[int] = None
+    retained_bytes: Optional[int] = None
+    portal_circuit: Optional[dict] = None
 
 class NotaCreditoRequest(BaseModel):
     fecha_emision: str
@@ -80,6 +110,7 @@ class NotaCreditoRequest(BaseModel):
     numero_boleta: str
     sustento: str
     credenciales: Credenciales
+    callback_url: Optional[str] = Field(default=None, pattern=URL_CALLBACK, max_length=2048)
     
     @classmethod
     def __get_validators__(cls):
@@ -0,0 +1,195 @@
+"""Circuit breaker del portal SUNAT: deja de lanzar trabajos mientras el portal falla"""
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+ESTADOS = ("closed", "open", "half_open")
+MODOS = ("hold", "fail")
+
+# Fases que dependen solo de la disponibilidad del portal (no de los datos del comprobante)
+FASES_PORTAL = ("login", "navegacion")
+
+
+class CircuitoPortal:
+    """Estado de salud del portal a partir del resultado de los últimos trabajos.
+
+    Cuenta como falla un error o timeout en login/navegación y también un login/navegación
+    más lento que umbral_lentitud. Con suficientes llamadas y una tasa de fallas sobre el
+    umbral se abre; tras la espera pasa a half_open y deja pasar un solo trabajo de prueba
+    (sonda). Si la sonda falla vuelve a abrirse con el doble de espera, hasta espera_max.
+    """
+
+    def __init__(
+        self,
+        ventana: int = 10,
+        min_llamadas: int = 5,
+        umbral_fallas: float = 0.5,
+        umbral_lentitud: float = 20,
+        espera: float = 30,
+        espera_max: float = 600,
+        modo: str = "hold",
+        enabled: bool = True
+    ):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de circuit breaker no soportado: {modo}")
+
+        self.ventana = ventana
+        self.min_llamadas = min_llamadas
+        self.umbral_fallas = umbral_fallas
+        self.umbral_lentitud = umbral_lentitud
+        self.espera = espera
+        self.espera_max = espera_max
+        self.modo = modo
+        self.enabled = enabled
+        self._estado = "closed"
+        self._resultados: deque = deque(maxlen=ventana)
+        self._espera_actual = espera
+        self._abierto_hasta = 0.0
+        self._sonda_desde: Optional[float] = None
+        self._lock = threading.Lock()
+        self.aperturas = 0
+        self.rechazados = 0
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            return self._estado_actual()
+
+    def _estado_actual(self) -> str:
+        """Estado considerando el vencimiento de la espera (requiere el lock)"""
+        if self._estado == "open" and time.monotonic() >= self._abierto_hasta:
+            self._estado = "half_open"
+            self._sonda_desde = None
+            logger.info("Circuit breaker del portal en half_open: se enviará un trabajo de prueba")
+        return self._estado
+
+    def clasificar(self, result: dict) -> Optional[bool]:
+        """True si el resultado indica un portal degradado, False si sano, None si no aporta información"""
+        # Una clave SOL errada es un problema de ese cliente: no debe frenar las emisiones de otros RUC
+        if result.get("interrumpida") == "cancelled" or result.get("credenciales_rechazadas"):
+            return None
+        if not result.get("success") and result.get("fase") in FASES_PORTAL:
+            return True
+
+        tiempos = result.get("tiempos") or {}
+        latencias = [tiempos[f] for f in FASES_PORTAL if f in tiempos]
+        if latencias:
+            return max(latencias) > self.umbral_lentitud
+        # Sin tiempos, un éxito igual demuestra que el portal respondió
+        return False if result.get("success") else None
+
+    def registrar(self, result: dict) -> None:
+        """Alimenta el circuito con el resultado de un trabajo finalizado"""
+        if not self.enabled:
+            return
+        falla = self.clasificar(result)
+
+        with self._lock:
+            estado = self._estado_actual()
+            if estado == "half_open" and self._sonda_desde is not None:
+                self._sonda_desde = None
+                if falla:
+                    self._abrir(min(self._espera_actual * 2, self.espera_max), "la sonda falló")
+                elif falla is False:
+                    self._cerrar()
+                return
+
+            if falla is None or estado != "closed":
+                return
+            self._resultados.append(falla)
+            llamadas = len(self._resultados)
+            tasa = sum(self._resultados) / llamadas
+            if llamadas >= self.min_llamadas and tasa >= self.umbral_fallas:
+                self._abrir(self.espera, f"{tasa:.0%} de fallas en los últimos {llamadas} trabajos")
+
+    def _abrir(self, espera: float, motivo: str) -> None:
+        self._estado = "open"
+        self._espera_actual = espera
+        self._abierto_hasta = time.monotonic() + espera
+        self._resultados.clear()
+        self.aperturas += 1
+        logger.warning(f"Circuit breaker del portal abierto por {espera:g}s: {motivo}")
+
+    def _cerrar(self) -> None:
+        self._estado = "closed"
+        self._espera_actual = self.espera
+        self._resultados.clear()
+        logger.info("Circuit breaker del portal cerrado: el portal respondió")
+
+    def permitir(self) -> bool:
+        """True si un trabajo puede usar el portal ahora; en half_open reserva la única sonda"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            estado = self._estado_actual()
+            if estado == "closed":
+                return True
+            if estado == "open":
+                return False
+            # Una sonda que nunca reportó (p. ej. cancelada antes de empezar) se reemplaza
+            ahora = time.monotonic()
+            if self._sonda_desde is None or ahora - self._sonda_desde > settings.task_timeout:
+                self._sonda_desde = ahora
+                return True
+            return False
+
+    def espera_restante(self) -> float:
+        """Segundos hasta que pueda pasar otro trabajo: fin de la apertura o vencimiento de la sonda"""
+        with self._lock:
+            estado = self._estado_actual()
+            ahora = time.monotonic()
+            if estado == "open":
+                return max(self._abierto_hasta - ahora, 0.0)
+            if estado == "half_open" and self._sonda_desde is not None:
+                return max(self._sonda_desde + settings.task_timeout - ahora, 0.0)
+            return 0.0
+
+    def puerta(self) -> Optional[float]:
+        """Para el planificador en modo hold: None si puede despachar, o segundos a esperar"""
+        if self.modo != "hold" or self.permitir():
+            return None
+        return self.espera_restante()
+
+    def rechazar(self) -> Optional[dict]:
+        """Para el modo fail: resultado de error inmediato si el portal está abierto"""
+        if self.modo != "fail" or self.permitir():
+            return None
+        self.rechazados += 1
+        return {
+            "success": False,
+            "error": f"Portal SUNAT no disponible (circuit breaker abierto, reintente en {self.espera_restante():.0f}s)",
+            "circuito": "open"
+        }
+
+    def estadisticas(self) -> dict:
+        """Estado para /api/v1/health"""
+        with self._lock:
+            estado = self._estado_actual()
+            llamadas = len(self._resultados)
+            return {
+                "state": estado,
+                "mode": self.modo,
+                "recent_calls": llamadas,
+                "failure_rate": round(sum(self._resultados) / llamadas, 3) if llamadas else 0.0,
+                "retry_in_seconds": round(max(self._abierto_hasta - time.monotonic(), 0.0), 1)
+                if estado == "open" else None,
+                "opened_total": self.aperturas,
+                "rejected_total": self.rechazados,
+            }
+
+
+circuito_portal = CircuitoPortal(
+    ventana=settings.circuit_window,
+    min_llamadas=settings.circuit_min_calls,
+    umbral_fallas=settings.circuit_failure_rate,
+    umbral_lentitud=settings.circuit_slow_seconds,
+    espera=settings.circuit_open_seconds,
+    espera_max=settings.circuit_max_open_seconds,
+    modo=settings.circuit_mode,
+    enabled=settings.circuit_enabled
+)
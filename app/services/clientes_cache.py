@@ -0,0 +1,149 @@
+"""Caché de la razón social resuelta por el portal para cada DNI/RUC"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+class ClientesCache:
+    """Razón social por número de documento: LRU en memoria y, con path, persistencia SQLite con TTL"""
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS clientes (
+            numero TEXT PRIMARY KEY,
+            razon_social TEXT NOT NULL,
+            guardado REAL NOT NULL
+        );
+    """
+
+    def __init__(self, ttl: int = 2592000, max_entries: int = 5000, path: str = "", enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._lock_archivo = threading.Lock()
+        self._preparado = False
+        self.hits = 0
+        self.misses = 0
+
+    def _preparar(self) -> None:
+        """Crea el archivo y el esquema en el primer uso: importar el módulo no toca el disco"""
+        with self._lock_archivo:
+            if self._preparado:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(self.ESQUEMA)
+            finally:
+                conn.close()
+            self._preparado = True
+            logger.info(f"Caché de clientes SQLite: {self.path}")
+
+    def _conexion(self) -> sqlite3.Connection:
+        """Una conexión por hilo, como el repositorio de tareas"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._preparar()
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _recordar(self, numero: str, guardado: float, razon_social: str) -> None:
+        """Agrega la entrada a la LRU en memoria (requiere el lock)"""
+        self._entries[numero] = (guardado, razon_social)
+        self._entries.move_to_end(numero)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def obtener(self, numero: str) -> Optional[str]:
+        """Razón social vigente del documento o None"""
+        if not self.enabled or not numero:
+            return None
+
+        numero = numero.strip()
+        ahora = time.time()
+        with self._lock:
+            entry = self._entries.get(numero)
+            if entry is not None:
+                if ahora - entry[0] <= self.ttl:
+                    self._entries.move_to_end(numero)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[numero]
+
+        row = None
+        if self.path:
+            try:
+                row = self._conexion().execute(
+                    "SELECT guardado, razon_social FROM clientes WHERE numero = ? AND guardado >= ?",
+                    (numero, ahora - self.ttl)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo leer la caché de clientes: {e}")
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self._recordar(numero, row[0], row[1])
+            self.hits += 1
+            return row[1]
+
+    def guardar(self, numero: str, razon_social: str) -> None:
+        """Guarda la razón social que el portal resolvió para el documento"""
+        razon_social = (razon_social or "").strip()
+        if not self.enabled or not numero or not razon_social:
+            return
+
+        numero = numero.strip()
+        ahora = time.time()
+        with self._lock:
+            self._recordar(numero, ahora, razon_social)
+
+        if self.path:
+            try:
+                self._conexion().execute(
+                    "INSERT INTO clientes (numero, razon_social, guardado) VALUES (?, ?, ?) "
+                    "ON CONFLICT(numero) DO UPDATE SET razon_social = excluded.razon_social, "
+                    "guardado = excluded.guardado",
+                    (numero, razon_social, ahora)
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo guardar en la caché de clientes: {e}")
+
+    def purgar(self) -> int:
+        """Elimina de SQLite las entradas vencidas; retorna cuántas eliminó"""
+        if not self.enabled or not self.path:
+            return 0
+        cursor = self._conexion().execute("DELETE FROM clientes WHERE guardado < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def estadisticas(self) -> dict:
+        """Resumen del estado de la caché"""
+        with self._lock:
+            return {
+                "habilitado": self.enabled,
+                "persistente": bool(self.path),
+                "entradas": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+clientes_cache = ClientesCache(
+    ttl=settings.client_cache_ttl,
+    max_entries=settings.client_cache_max_entries,
+    path=settings.client_cache_path,
+    enabled=settings.client_cache_enabled
+)
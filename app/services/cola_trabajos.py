@@ -0,0 +1,396 @@
+"""Cola de trabajos compartida entre la API y los procesos de worker.py (EXECUTOR_MODE=queue)"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+from app.config import settings
+from app.services.circuito import ESTADOS as ESTADOS_CIRCUITO, circuito_portal
+from app.services.eventos import eventos_tareas
+from app.services.pdf_store import pdf_store
+from app.services.planificador import planificador
+from app.services.task_store import ColaCompartida, redactar_credenciales, task_store
+from app.utils import cancelacion
+from app.utils.driver_pool import driver_pool
+from app.utils.logger import logger
+
+
+# Cada cuánto un worker renueva sus tareas en proceso y tras cuánto silencio se lo da por caído
+INTERVALO_LATIDO = 15
+VENCIMIENTO_LATIDO = 60
+
+# El observador relee unos segundos hacia atrás: dos procesos pueden confirmar fuera de orden
+VENTANA_CAMBIOS = 5
+MAX_VISTOS = 10000
+
+
+def _hace(segundos: float) -> str:
+    return (datetime.utcnow() - timedelta(seconds=segundos)).isoformat()
+
+
+def calcular_workers(configurados: int = 0) -> int:
+    """Procesos de worker: los configurados o, con 0, los que permiten los núcleos y la memoria libre"""
+    if configurados > 0:
+        return configurados
+    por_nucleos = os.cpu_count() or 1
+    por_memoria = psutil.virtual_memory().available // (settings.worker_memory_mb * 1024 * 1024)
+    return max(min(por_nucleos, por_memoria), 1)
+
+
+def verificar_repositorio() -> None:
+    """La cola vive en el repositorio de tareas: debe ser SQLite para compartirse entre procesos"""
+    if not isinstance(task_store, ColaCompartida):
+        raise RuntimeError("EXECUTOR_MODE=queue requiere TASK_STORE_BACKEND=sqlite")
+
+
+def estado_workers() -> dict:
+    """Para /api/v1/health en la API: circuito de cada worker vivo y el peor de ellos como estado.
+
+    Cada worker alimenta su propio circuit breaker; sin workers vivos el estado es unknown.
+    """
+    workers = task_store.listar_workers(_hace(VENCIMIENTO_LATIDO))
+    # closed < half_open < open
+    gravedad = {"closed": 0, "half_open": 1, "open": 2}
+    estados = [w["circuito"]["state"] for w in workers if w["circuito"]["state"] in ESTADOS_CIRCUITO]
+    return {
+        "state": max(estados, key=gravedad.get) if estados else "unknown",
+        "mode": settings.circuit_mode,
+        "live_workers": len(workers),
+        "workers": {w["worker"]: {**w["circuito"], "active_tasks": w["en_curso"]} for w in workers},
+    }
+
+
+def estado_final(result: dict) -> str:
+    """Estado con que termina una tarea según su resultado"""
+    if result.get("interrumpida") in cancelacion.MOTIVOS:
+        return result["interrumpida"]
+    return "completed" if result.get("success") else "failed"
+
+
+def registrar_resultado(task_id: str, data: dict, result: dict) -> Optional[str]:
+    """Guarda el resultado de una tarea en proceso y alimenta el circuito; retorna su estado final
+    o None si ya estaba finalizada (p. ej. cancelada mientras corría)"""
+    task = task_store.obtener(task_id)
+    if task is None or task["status"] != "processing":
+        return None
+
+    status = estado_final(result)
+
+    # El PDF queda en disco; en el resultado solo se guarda su metadata
+    if result.get("pdf") and result["pdf"].get("blob_id"):
+        result = {**result, "pdf": pdf_store.asociar(task_id, result["pdf"])}
+
+    # La contraseña no se conserva una vez finalizada la tarea
+    finalizada = task_store.transicionar(
+        task_id, ["processing"], status,
+        data=redactar_credenciales(data),
+        result=result,
+        completed_at=datetime.utcnow().isoformat()
+    )
+    if not finalizada:
+        return None
+
+    # Los rechazos del propio circuito no aportan información del portal
+    if "circuito" not in result:
+        circuito_portal.registrar(result)
+    logger.info(f"Tarea {task_id} completada con estado: {status}")
+    return status
+
+
+class ObservadorCola:
+    """En la API: detecta en el repositorio los cambios que escriben los workers y los entrega a al_cambiar"""
+
+    def __init__(self, al_cambiar: Callable[[dict, Optional[tuple]], None], intervalo: float = 0.5):
+        self.al_cambiar = al_cambiar
+        self.intervalo = intervalo
+        self._desde = datetime.utcnow().isoformat()
+        # Último (estado, fase) entregado por tarea, para no repetir los releídos
+        self._vistos: "OrderedDict[str, tuple]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def revisar(self) -> int:
+        """Entrega los cambios nuevos; retorna cuántos entregó"""
+        cambios = task_store.cambios_desde(
+            (datetime.fromisoformat(self._desde) - timedelta(seconds=VENTANA_CAMBIOS)).isoformat()
+        )
+        entregados = 0
+        for task in cambios:
+            actual = (task["status"], task.get("fase"))
+            anterior = self._vistos.get(task["task_id"])
+            if anterior == actual:
+                continue
+            self._vistos[task["task_id"]] = actual
+            self._vistos.move_to_end(task["task_id"])
+            while len(self._vistos) > MAX_VISTOS:
+                self._vistos.popitem(last=False)
+            try:
+                self.al_cambiar(task, anterior)
+                entregados += 1
+            except Exception as e:
+                logger.error(f"Error publicando el cambio de la tarea {task['task_id']}: {e}")
+        if cambios:
+            self._desde = max(self._desde, cambios[-1]["updated_at"])
+        return entregados
+
+    async def _ciclo(self) -> None:
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                self.revisar()
+            except Exception as e:
+                logger.error(f"Error leyendo la cola de trabajos: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._ciclo())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class PosicionesCola:
+    """En la API: posición en la cola de las tareas pendientes, con las mismas reglas con que los
+    workers toman trabajos; se recalcula como máximo una vez cada `vigencia` segundos"""
+
+    def __init__(self, vigencia: float = 0.5):
+        self.vigencia = vigencia
+        self._posiciones: Dict[str, int] = {}
+        self._calculadas = 0.0
+        self._lock = threading.Lock()
+
+    def posicion(self, task_id: str) -> Optional[int]:
+        with self._lock:
+            if time.monotonic() - self._calculadas >= self.vigencia:
+                self._posiciones = task_store.posiciones_pendientes(planificador.clase, planificador.max_por_ruc)
+                self._calculadas = time.monotonic()
+            return self._posiciones.get(task_id)
+
+
+posiciones_cola = PosicionesCola(settings.queue_poll_interval)
+
+
+class WorkerCola:
+    """Proceso de worker: toma trabajos del repositorio, ejecuta el scraper y escribe el resultado"""
+
+    def __init__(self, numero: int):
+        self.numero = numero
+        self.nombre = f"{socket.gethostname()}:{numero}"
+        self.detenido = False
+        self._en_curso: List[str] = []
+        self._lock = threading.Lock()
+
+    def detener(self) -> None:
+        """Pide terminar tras el trabajo en curso; solo marca un flag, apto para un handler de señal"""
+        self.detenido = True
+
+    def _esperar(self, segundos: float) -> None:
+        limite = time.monotonic() + segundos
+        while not self.detenido and time.monotonic() < limite:
+            time.sleep(min(0.1, max(limite - time.monotonic(), 0)))
+
+    def ejecutar(self) -> None:
+        """Procesa trabajos hasta que se llame a detener (termina el trabajo en curso)"""
+        verificar_repositorio()
+        # Las fases quedan en el repositorio para que la API las publique
+        eventos_tareas.observar_fases(task_store.registrar_fase)
+        driver_pool.calentar()
+        threading.Thread(target=self._vigia, name="vigia-cola", daemon=True).start()
+        logger.info(f"Worker {self.numero} (pid {os.getpid()}) esperando trabajos")
+
+        padre = os.getppid()
+        try:
+            # Si el supervisor muere sin avisar, el worker no sigue tomando trabajos por su cuenta
+            while not self.detenido and os.getppid() == padre:
+                # En modo hold el circuito abierto deja los trabajos en la cola
+                if circuito_portal.enabled and circuito_portal.modo == "hold" and circuito_portal.estado == "open":
+                    self._esperar(min(circuito_portal.espera_restante(), 5))
+                    continue
+
+                tareas = task_store.tomar_siguiente(planificador.clase, planificador.max_por_ruc)
+                if not tareas:
+                    self._esperar(settings.queue_poll_interval)
+                    continue
+                self._procesar(tareas)
+        finally:
+            driver_pool.cerrar()
+            task_store.cerrar()
+            logger.info(f"Worker {self.numero} detenido")
+
+    def _procesar(self, tareas: List[dict]) -> None:
+        ids = [t["task_id"] for t in tareas]
+        logger.info(f"Worker {self.numero} procesando {', '.join(ids)}")
+        with self._lock:
+            self._en_curso = ids
+
+        try:
+            if circuito_portal.modo == "hold":
+                # En half_open este trabajo es la sonda del circuito
+                circuito_portal.permitir()
+            rechazo = circuito_portal.rechazar()
+            if rechazo is not None:
+                resultados = [rechazo] * len(tareas)
+            else:
+                resultados = self._ejecutar(tareas)
+        except Exception as e:
+            logger.error(f"Error en el trabajo {', '.join(ids)}: {e}")
+            resultados = [{"success": False, "error": str(e)}] * len(tareas)
+        finally:
+            with self._lock:
+                self._en_curso = []
+
+        # Si el callback del lote ya la finalizó, la transición desde processing no aplica
+        for tarea, result in zip(tareas, resultados):
+            registrar_resultado(tarea["task_id"], tarea["data"], result)
+        self._reportar()
+
+    def _reportar(self) -> None:
+        """Publica en el repositorio el circuito y las tareas en curso de este worker"""
+        with self._lock:
+            en_curso = len(self._en_curso)
+        try:
+            task_store.publicar_worker(self.nombre, {
+                "pid": os.getpid(),
+                "en_curso": en_curso,
+                "circuito": circuito_portal.estadisticas(),
+            })
+        except Exception as e:
+            logger.warning(f"Worker {self.numero}: no se pudo publicar su estado: {e}")
+
+    def _ejecutar(self, tareas: List[dict]) -> List[dict]:
+        from app.services.nota_credito import send_nota_credito_sunat
+        from app.services.scraper_service import send_billing_batch_sunat, send_billing_sunat
+
+        ids = [t["task_id"] for t in tareas]
+        if tareas[0]["batch_id"]:
+            def on_item(index: int, result: dict) -> None:
+                registrar_resultado(tareas[index]["task_id"], tareas[index]["data"], result)
+
+            return cancelacion.ejecutar_controlado(
+                ids, settings.task_timeout * len(tareas),
+                send_billing_batch_sunat, [t["data"] for t in tareas], on_item
+            )
+
+        data = tareas[0]["data"]
+        if data.get("tipo_documento", "NOTA_CREDITO") == "NOTA_CREDITO":
+            func = send_nota_credito_sunat
+        else:
+            func = send_billing_sunat
+        return [cancelacion.ejecutar_controlado(ids, settings.task_timeout, func, data)]
+
+    def _aplicar_cancelacion(self, task_id: str) -> None:
+        """Detiene una tarea cancelada en la API; si ya no se podía, la devuelve a processing
+        para que se registre su resultado real"""
+        motivo = cancelacion.cancelar_tarea(task_id, "Tarea cancelada por el cliente")
+        if motivo is None:
+            return
+        if task_store.transicionar(task_id, ["cancelled"], "processing", result=None, completed_at=None):
+            logger.warning(f"Worker {self.numero}: la cancelación de {task_id} llegó tarde ({motivo}), sigue en proceso")
+
+    def _vigia(self) -> None:
+        """Aplica las cancelaciones hechas en la API, renueva el latido de las tareas en curso
+        y publica el estado del worker"""
+        ultimo_latido = 0.0
+        aplicadas: set = set()
+        while True:
+            with self._lock:
+                ids = list(self._en_curso)
+            try:
+                aplicadas.intersection_update(ids)
+                for task_id in ids:
+                    if task_id not in aplicadas:
+                        task = task_store.obtener(task_id)
+                        if task is not None and task["status"] == "cancelled":
+                            self._aplicar_cancelacion(task_id)
+                            aplicadas.add(task_id)
+                if time.monotonic() - ultimo_latido >= INTERVALO_LATIDO:
+                    if ids:
+                        task_store.latido(ids)
+                    self._reportar()
+                    ultimo_latido = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Worker {self.numero}: error revisando las tareas en curso: {e}")
+            time.sleep(1)
+
+
+def recuperar_huerfanas() -> int:
+    """Da por vencidas las tareas en proceso cuyo worker dejó de dar latidos; retorna cuántas"""
+    detalle = "El worker que ejecutaba la tarea dejó de responder"
+    vencidas = 0
+    for task in task_store.en_proceso_sin_cambios(_hace(VENCIMIENTO_LATIDO)):
+        result = cancelacion.resultado_interrumpido("timeout", detalle, task.get("fase"))
+        if registrar_resultado(task["task_id"], task["data"], result):
+            vencidas += 1
+    if vencidas:
+        logger.warning(f"{vencidas} tareas de workers caídos marcadas como timeout")
+    return vencidas
+
+
+def _proceso_worker(numero: int) -> None:
+    worker = WorkerCola(numero)
+    # Ctrl+C llega a todo el grupo de procesos: el supervisor decide cuándo detenerse y envía SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.detener())
+    worker.ejecutar()
+
+
+def supervisar(cantidad: int) -> None:
+    """Lanza los procesos worker, reinicia los que terminan y se detiene con SIGINT/SIGTERM"""
+    verificar_repositorio()
+    # spawn: cada worker arranca limpio, sin hilos ni conexiones heredadas. No se comparten
+    # locks entre procesos: un worker terminado a la fuerza no puede dejar a otro bloqueado
+    contexto = multiprocessing.get_context("spawn")
+    procesos = {}
+
+    def lanzar(numero: int) -> None:
+        proceso = contexto.Process(target=_proceso_worker, args=(numero,), name=f"worker-{numero}")
+        proceso.start()
+        procesos[numero] = proceso
+
+    # Los handlers solo anotan la señal; la detención ocurre en el ciclo principal
+    senales = []
+    signal.signal(signal.SIGINT, lambda signum, frame: senales.append(signum))
+    signal.signal(signal.SIGTERM, lambda signum, frame: senales.append(signum))
+
+    for numero in range(cantidad):
+        lanzar(numero)
+    logger.info(f"{cantidad} workers iniciados sobre {settings.task_store_path}")
+
+    ultima_revision = 0.0
+    while not senales:
+        time.sleep(1)
+        for numero, proceso in list(procesos.items()):
+            if not proceso.is_alive() and not senales:
+                # Sus tareas quedan en processing hasta que recuperar_huerfanas las venza
+                logger.error(f"Worker {numero} terminó con código {proceso.exitcode}, se reinicia")
+                lanzar(numero)
+        if time.monotonic() - ultima_revision >= INTERVALO_LATIDO:
+            ultima_revision = time.monotonic()
+            try:
+                recuperar_huerfanas()
+            except Exception as e:
+                logger.error(f"Error revisando tareas huérfanas: {e}")
+
+    logger.info("Deteniendo workers: se termina el trabajo en curso")
+    for proceso in procesos.values():
+        proceso.terminate()
+    limite = time.monotonic() + settings.task_timeout
+    for proceso in procesos.values():
+        proceso.join(timeout=max(limite - time.monotonic(), 0))
+        if proceso.is_alive():
+            logger.warning(f"{proceso.name} no terminó a tiempo, se fuerza su cierre")
+            proceso.kill()
+            proceso.join(timeout=10)
@@ -0,0 +1,100 @@
+"""Publicación en proceso de los cambios de estado y de fase de las tareas"""
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.utils.logger import logger
+
+
+# Tareas en curso cuyo progreso se recuerda; las finalizadas se olvidan al publicar su estado final
+MAX_PROGRESO = 10000
+
+# Eventos que un suscriptor lento puede acumular antes de perder los siguientes
+MAX_EVENTOS_SUSCRIPTOR = 100
+
+
+class EventosTareas:
+    """Pub/sub de eventos por task_id: los workers publican desde cualquier hilo, los endpoints esperan"""
+
+    def __init__(self, max_progreso: int = MAX_PROGRESO):
+        self.max_progreso = max_progreso
+        self._suscriptores: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._progreso: "OrderedDict[str, str]" = OrderedDict()
+        self._observadores: List[Callable[[str, str], None]] = []
+        self._lock = threading.Lock()
+
+    def observar_fases(self, callback: Callable[[str, str], None]) -> None:
+        """Registra una función que recibe (task_id, fase) en cada fase completada"""
+        self._observadores.append(callback)
+
+    def publicar_estado(self, task_id: str, status: str, final: bool = False) -> None:
+        """Notifica un cambio de estado de la tarea"""
+        with self._lock:
+            if final:
+                self._progreso.pop(task_id, None)
+        self._publicar(task_id, {"tipo": "estado", "status": status})
+
+    def publicar_fase(self, task_ids: Iterable[str], fase: str) -> None:
+        """Notifica que las tareas completaron una fase; las repeticiones de la misma fase se omiten"""
+        for task_id in task_ids:
+            with self._lock:
+                if self._progreso.get(task_id) == fase:
+                    continue
+                self._progreso[task_id] = fase
+                self._progreso.move_to_end(task_id)
+                while len(self._progreso) > self.max_progreso:
+                    self._progreso.popitem(last=False)
+            self._publicar(task_id, {"tipo": "fase", "fase": fase})
+            for callback in self._observadores:
+                try:
+                    callback(task_id, fase)
+                except Exception as e:
+                    logger.error(f"Error registrando la fase de {task_id}: {e}")
+
+    def fase(self, task_id: str) -> Optional[str]:
+        """Última fase completada por una tarea en curso"""
+        with self._lock:
+            return self._progreso.get(task_id)
+
+    def _publicar(self, task_id: str, evento: dict) -> None:
+        with self._lock:
+            suscriptores = list(self._suscriptores.get(task_id, ()))
+        for loop, cola in suscriptores:
+            try:
+                loop.call_soon_threadsafe(self._entregar, cola, evento)
+            except RuntimeError:
+                # El event loop del suscriptor ya se cerró
+                continue
+
+    @staticmethod
+    def _entregar(cola: asyncio.Queue, evento: dict) -> None:
+        try:
+            cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            logger.warning(f"Suscriptor lento, se descarta el evento {evento}")
+
+    @asynccontextmanager
+    async def suscribir(self, task_id: str) -> AsyncIterator[asyncio.Queue]:
+        """Cola con los eventos de la tarea publicados mientras dure el bloque"""
+        suscriptor = (asyncio.get_running_loop(), asyncio.Queue(maxsize=MAX_EVENTOS_SUSCRIPTOR))
+        with self._lock:
+            self._suscriptores.setdefault(task_id, set()).add(suscriptor)
+        try:
+            yield suscriptor[1]
+        finally:
+            with self._lock:
+                suscriptores = self._suscriptores.get(task_id)
+                if suscriptores is not None:
+                    suscriptores.discard(suscriptor)
+                    if not suscriptores:
+                        del self._suscriptores[task_id]
+
+    def suscriptores(self) -> int:
+        """Cantidad de conexiones esperando eventos"""
+        with self._lock:
+            return sum(len(s) for s in self._suscriptores.values())
+
+
+eventos_tareas = EventosTareas()
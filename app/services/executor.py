@@ -0,0 +1,144 @@
+"""Pool de ejecución para trabajos de scraping fuera del event loop"""
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+# queue: la API solo encola en el repositorio SQLite y los trabajos corren en worker.py
+MODOS_EJECUCION = ("thread", "process", "queue")
+
+
+class ScraperExecutor:
+    """Ejecuta las funciones bloqueantes de Selenium en un pool acotado de workers"""
+
+    def __init__(self, mode: str = "thread", max_workers: int = 2):
+        if mode not in MODOS_EJECUCION:
+            raise ValueError(f"Modo de ejecución no soportado: {mode}")
+        if max_workers < 1:
+            raise ValueError("max_workers debe ser mayor o igual a 1")
+
+        self.mode = mode
+        self.max_workers = max_workers
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._activos = 0
+        # Trabajos que siguen ocupando un worker aunque quien los esperaba ya desistió (timeout)
+        self._abandonados = 0
+        self._al_liberar: List[Callable[[], None]] = []
+
+    def start(self) -> None:
+        """Crea el pool de workers si aún no existe"""
+        with self._lock:
+            if self._executor is not None or self.mode == "queue":
+                return
+
+            if self.mode == "process":
+                # spawn evita heredar los hilos de uvicorn en el proceso hijo
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="scraper"
+                )
+
+            logger.info(f"Pool de ejecución iniciado: {self.mode} con {self.max_workers} workers")
+
+    def _reiniciar(self, roto: Executor) -> None:
+        """Reemplaza un pool de procesos roto (un worker murió) por uno nuevo"""
+        with self._lock:
+            if self._executor is not roto:
+                return
+            self._executor = None
+        logger.error("Un proceso del pool de ejecución terminó abruptamente; se recrea el pool")
+        roto.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def al_liberar(self, callback: Callable[[], None]) -> None:
+        """Registra una función que se llama (en el event loop) cuando termina un trabajo abandonado"""
+        self._al_liberar.append(callback)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Detiene el pool de workers"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info("Pool de ejecución detenido")
+
+    @property
+    def activos(self) -> int:
+        """Cantidad de trabajos ejecutándose en este momento (incluye los abandonados)"""
+        return self._activos
+
+    @property
+    def abandonados(self) -> int:
+        """Trabajos que siguen en un worker aunque ya nadie espera su resultado"""
+        return self._abandonados
+
+    @property
+    def disponibles(self) -> int:
+        """Cantidad de workers libres"""
+        return max(self.max_workers - self._activos, 0)
+
+    def _enviar(self, func: Callable[..., Any], args: tuple) -> Future:
+        """Envía el trabajo al pool; si el pool de procesos está roto lo recrea y reintenta una vez"""
+        executor = self._executor
+        try:
+            return executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._reiniciar(executor)
+            return self._executor.submit(func, *args)
+
+    async def run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """Ejecuta func(*args) en el pool sin bloquear el event loop"""
+        if self.mode == "queue":
+            raise RuntimeError("En modo queue los trabajos los ejecuta worker.py, no la API")
+        if self._executor is None:
+            self.start()
+
+        loop = asyncio.get_running_loop()
+        futuro = self._enviar(func, args)
+        executor = self._executor
+        estado = {"abandonado": False}
+        with self._lock:
+            self._activos += 1
+        
+        def terminado(_: Future) -> None:
+            # El worker solo queda libre cuando el trabajo termina de verdad, no cuando se deja de esperar
+            with self._lock:
+                self._activos -= 1
+                if estado["abandonado"]:
+                    self._abandonados -= 1
+            if estado["abandonado"]:
+                for callback in self._al_liberar:
+                    loop.call_soon_threadsafe(callback)
+        
+        try:
+            return await asyncio.wrap_future(futuro, loop=loop)
+        except asyncio.CancelledError:
+            with self._lock:
+                if not futuro.done():
+                    estado["abandonado"] = True
+                    self._abandonados += 1
+            raise
+        except BrokenProcessPool:
+            self._reiniciar(executor)
+            raise
+        finally:
+            futuro.add_done_callback(terminado)
+
+
+scraper_executor = ScraperExecutor(
+    mode=settings.executor_mode,
+    max_workers=settings.max_workers
+)
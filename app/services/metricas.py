@@ -0,0 +1,190 @@
+"""Métricas Prometheus del servicio de emisión"""
+import threading
+import time
+from typing import Dict, Optional
+
+import psutil
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+from app.services.circuito import ESTADOS as ESTADOS_CIRCUITO, circuito_portal
+from app.services.clientes_cache import clientes_cache
+from app.services.executor import scraper_executor
+from app.services.planificador import planificador
+from app.services.session_cache import session_cache
+from app.services.webhooks import webhook_dispatcher
+from app.utils.driver_pool import driver_pool
+from app.utils.tiempos import BUCKETS, registro_tiempos
+
+
+registry = CollectorRegistry()
+
+EMISIONES = Counter(
+    "sunat_emisiones",
+    "Tareas finalizadas por tipo de documento y resultado",
+    ["tipo", "resultado"],
+    registry=registry
+)
+
+ESPERA_COLA = Histogram(
+    "sunat_espera_cola_segundos",
+    "Tiempo entre la creación de una tarea y su inicio en un worker",
+    buckets=BUCKETS,
+    registry=registry
+)
+
+SOLICITUDES_REPETIDAS = Counter(
+    "sunat_solicitudes_repetidas",
+    "Solicitudes de emisión resueltas con una tarea existente (idempotencia)",
+    registry=registry
+)
+
+TAREAS_PENDIENTES = Gauge(
+    "sunat_tareas_pendientes",
+    "Tareas en cola esperando un worker",
+    registry=registry
+)
+
+# Momento de encolado de cada tarea pendiente, para medir la espera sin consultar el repositorio
+_encoladas: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def tarea_encolada(task_id: str) -> None:
+    """Registra una tarea recién creada"""
+    with _lock:
+        _encoladas[task_id] = time.monotonic()
+    TAREAS_PENDIENTES.inc()
+
+
+def tarea_iniciada(task_id: str) -> None:
+    """Registra que una tarea salió de la cola (al iniciar o al descartarse)"""
+    with _lock:
+        encolada = _encoladas.pop(task_id, None)
+    if encolada is not None:
+        TAREAS_PENDIENTES.dec()
+        ESPERA_COLA.observe(time.monotonic() - encolada)
+
+
+def solicitud_repetida() -> None:
+    """Registra una solicitud deduplicada por idempotencia"""
+    SOLICITUDES_REPETIDAS.inc()
+
+
+def tarea_finalizada(tipo: str, status: str, tiempos: Optional[dict]) -> None:
+    """Registra el resultado y los tiempos por fase de una tarea"""
+    EMISIONES.labels(tipo=tipo, resultado=status).inc()
+    registro_tiempos.observar(tipo, tiempos)
+
+
+def procesos_chrome() -> tuple:
+    """Cantidad y RSS total (bytes) de los procesos chromedriver/Chrome descendientes de la API"""
+    cantidad = 0
+    rss = 0
+    try:
+        hijos = psutil.Process().children(recursive=True)
+    except psutil.Error:
+        return 0, 0
+
+    for proceso in hijos:
+        try:
+            if "chrom" not in proceso.name().lower():
+                continue
+            rss += proceso.memory_info().rss
+            cantidad += 1
+        except psutil.Error:
+            continue
+    return cantidad, rss
+
+
+class _ColectorEstado:
+    """Métricas leídas al momento del scrape desde contadores ya mantenidos por cada componente"""
+
+    def collect(self):
+        fases = HistogramMetricFamily(
+            "sunat_fase_segundos",
+            "Duración de cada fase de los trabajos de scraping",
+            labels=["tipo", "fase"]
+        )
+        for (tipo, fase), histograma in sorted(registro_tiempos.histogramas().items()):
+            fases.add_metric(
+                [tipo, fase],
+                [(floatToGoString(limite), conteo) for limite, conteo in histograma.acumulado()],
+                histograma.suma
+            )
+        yield fases
+
+        workers = GaugeMetricFamily("sunat_workers", "Workers de scraping", labels=["estado"])
+        workers.add_metric(["activos"], scraper_executor.activos)
+        workers.add_metric(["disponibles"], scraper_executor.disponibles)
+        yield workers
+
+        planificacion = planificador.estadisticas()
+        en_espera = GaugeMetricFamily(
+            "sunat_planificador_en_espera", "Trabajos esperando turno por clase de prioridad", labels=["clase"]
+        )
+        for clase, cantidad in planificacion["esperando"].items():
+            en_espera.add_metric([clase], cantidad)
+        yield en_espera
+
+        estado = circuito_portal.estado
+        circuito = GaugeMetricFamily(
+            "sunat_circuito_portal", "Estado del circuit breaker del portal (1 = actual)", labels=["estado"]
+        )
+        for nombre in ESTADOS_CIRCUITO:
+            circuito.add_metric([nombre], 1 if nombre == estado else 0)
+        yield circuito
+
+        # En modo process cada worker tiene su propio pool y caché: aquí solo se ve el de la API
+        pool = driver_pool.estadisticas()
+        drivers = GaugeMetricFamily("sunat_driver_pool_drivers", "Drivers del pool", labels=["estado"])
+        drivers.add_metric(["libres"], pool["libres"])
+        drivers.add_metric(["en_uso"], pool["en_uso"])
+        drivers.add_metric(["max"], pool["max"])
+        yield drivers
+
+        reciclados = CounterMetricFamily("sunat_driver_pool_reciclados", "Drivers reciclados por el pool")
+        reciclados.add_metric([], pool["reciclados"])
+        yield reciclados
+
+        cache = session_cache.estadisticas()
+        consultas = CounterMetricFamily(
+            "sunat_session_cache_consultas", "Consultas a la caché de sesiones", labels=["resultado"]
+        )
+        consultas.add_metric(["hit"], cache["hits"])
+        consultas.add_metric(["miss"], cache["misses"])
+        yield consultas
+
+        clientes = clientes_cache.estadisticas()
+        consultas_clientes = CounterMetricFamily(
+            "sunat_clientes_cache_consultas", "Consultas a la caché de razón social por DNI/RUC", labels=["resultado"]
+        )
+        consultas_clientes.add_metric(["hit"], clientes["hits"])
+        consultas_clientes.add_metric(["miss"], clientes["misses"])
+        yield consultas_clientes
+
+        webhooks = webhook_dispatcher.estadisticas()
+        entregas = CounterMetricFamily(
+            "sunat_webhooks", "Notificaciones a callback_url por resultado", labels=["resultado"]
+        )
+        for resultado in ("entregadas", "fallidas", "descartadas", "reintentos"):
+            entregas.add_metric([resultado], webhooks[resultado])
+        yield entregas
+
+        cola = GaugeMetricFamily("sunat_webhooks_pendientes", "Notificaciones por entregar", labels=["estado"])
+        cola.add_metric(["en_cola"], webhooks["en_cola"])
+        cola.add_metric(["esperando_reintento"], webhooks["esperando_reintento"])
+        yield cola
+
+        cantidad, rss = procesos_chrome()
+        procesos = GaugeMetricFamily("sunat_chrome_procesos", "Procesos chromedriver/Chrome vivos")
+        procesos.add_metric([], cantidad)
+        yield procesos
+
+        memoria = GaugeMetricFamily("sunat_chrome_rss_bytes", "Memoria residente total de los procesos de Chrome")
+        memoria.add_metric([], rss)
+        yield memoria
+
+
+registry.register(_ColectorEstado())
@@ -1,5 +1,4 @@
 """Servicio de scraping para Notas de Crédito en SUNAT"""
-import os
 import time
 from datetime import datetime
 
@@ -9,9 +8,10 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
 from app.utils.logger import logger
-from app.services.scraper_service import iniciar_sesion, descargar_pdf
-from app.utils.selenium_utils import configurar_driver
-from app.config import settings
+from app.services.scraper_service import CredencialesRechazadas, iniciar_sesion, descargar_pdf
+from app.utils import cancelacion
+from app.utils.driver_pool import driver_pool
+from app.utils.tiempos import fase, fase_fallida, medir_trabajo
 
 
 class NotaCreditoError(Exception):
@@ -45,6 +45,7 @@ def extraer_numero_boleta(numero_completo: str) -> str:
     return numero_completo
 
 
+@fase("navegacion")
 def navegar_a_emision_nota_credito(driver) -> None:
     """Navega al formulario de emisión de nota de crédito"""
     campo_busqueda = WebDriverWait(driver, 20).until(
@@ -66,6 +67,7 @@ def navegar_a_emision_nota_credito(driver) -> None:
     logger.info("Cambio a iframe realizado")
 
 
+@fase("formulario")
 def ingresar_fecha_emision(driver, fecha: str) -> None:
     """Ingresa la fecha de emisión de la nota de crédito"""
     input_fecha = WebDriverWait(driver, 20).until(
@@ -77,6 +79,7 @@ def ingresar_fecha_emision(driver, fecha: str) -> None:
     logger.info(f"Fecha de emisión ingresada: {fecha}")
 
 
+@fase("formulario")
 def seleccionar_motivo_nota_credito(driver, tipo_nota: str) -> None:
     """Selecciona el motivo de la nota de crédito"""
     texto_motivo = MOTIVOS_NOTA_CREDITO.get(tipo_nota, "Devolucion Total")
@@ -92,6 +95,7 @@ def seleccionar_motivo_nota_credito(driver, tipo_nota: str) -> None:
     time.sleep(2)
 
 
+@fase("formulario")
 def ingresar_numero_boleta(driver, numero_boleta: str) -> None:
     """Ingresa el número de la boleta a anular"""
     input_numero_boleta = WebDriverWait(driver, 30).until(
@@ -105,6 +109,7 @@ def ingresar_numero_boleta(driver, numero_boleta: str) -> None:
     logger.info(f"Número de boleta ingresado: {numero_solo}")
 
 
+@fase("formulario")
 def ingresar_sustento(driver, sustento: str) -> None:
     """Ingresa el sustento de la nota de crédito"""
     input_sustento = WebDriverWait(driver, 20).until(
@@ -138,6 +143,7 @@ def emitir_nota_credito(driver, data: dict) -> None:
 
 
 
+@fase("emision")
 def completar_emision_nota_credito(driver) -> bool:
     """Completa el proceso de emisión de la nota de crédito"""
     try:
@@ -156,11 +162,14 @@ def completar_emision_nota_credito(driver) -> bool:
         confirmar_button = WebDriverWait(driver, 20).until(
             EC.element_to_be_clickable((By.ID, "dlgBtnAceptarConfirm_label"))
         )
+        cancelacion.confirmar_emision()
         confirmar_button.click()
         
         logger.info("Nota de crédito emitida correctamente")
         return True
         
+    except cancelacion.TrabajoCancelado:
+        raise
     except Exception as e:
         logger.error(f"Error al completar emisión de nota de crédito: {e}")
         raise EmissionNotaCreditoError(f"No se pudo completar la emisión: {e}")
@@ -169,56 +178,57 @@ def completar_emision_nota_credito(driver) -> bool:
 
 def send_nota_credito_sunat(data: dict) -> dict:
     """Función principal para enviar nota de crédito a SUNAT"""
-    driver = None
-    try:
-        logger.info("Iniciando proceso de emisión de nota de crédito")
-        
-        download_dir = os.path.join(os.getcwd(), "downloads")
-        driver = configurar_driver(headless=settings.chrome_headless, download_dir=download_dir)
-        
-        iniciar_sesion(driver, data["credenciales"])
-        emitir_nota_credito(driver, data)
-        completar_emision_nota_credito(driver)
-        
-        pdf_data = None
+    with medir_trabajo() as tiempos:
         try:
-            pdf_data = descargar_pdf(
-                driver,
-                "NOTA_CREDITO",
-                data["credenciales"]["ruc"],
-                download_dir
-            )
+            logger.info("Iniciando proceso de emisión de nota de crédito")
+            
+            with driver_pool.driver() as driver:
+                download_dir = driver.download_dir
+                
+                iniciar_sesion(driver, data["credenciales"])
+                emitir_nota_credito(driver, data)
+                completar_emision_nota_credito(driver)
+                
+                pdf_data = None
+                try:
+                    pdf_data = descargar_pdf(
+                        driver,
+                        "NOTA_CREDITO",
+                        data["credenciales"]["ruc"],
+                        download_dir
+                    )
+                except Exception as e:
+                    logger.warning(f"No se pudo descargar el PDF: {e}")
+            
+            logger.info("Proceso completado exitosamente")
+            
+            result = {
+                "success": True,
+                "message": "Nota de crédito emitida correctamente",
+                "numero_boleta": data["numero_boleta"],
+                "fecha_emision": data["fecha_emision"],
+                "tipo_nota": data.get("tipo_nota", "01")
+            }
+            
+            if pdf_data:
+                result["pdf"] = pdf_data
+                logger.info(f"PDF incluido en respuesta: {pdf_data['filename']}")
+            else:
+                logger.warning("PDF no disponible en la respuesta")
+            
         except Exception as e:
-            logger.warning(f"No se pudo descargar el PDF: {e}")
-        
-        logger.info("Proceso completado exitosamente")
-        
-        result = {
-            "success": True,
-            "message": "Nota de crédito emitida correctamente",
-            "numero_boleta": data["numero_boleta"],
-            "fecha_emision": data["fecha_emision"],
-            "tipo_nota": data.get("tipo_nota", "01")
-        }
-        
-        if pdf_data:
-            result["pdf"] = pdf_data
-            logger.info(f"PDF incluido en respuesta: {pdf_data['filename']}")
-        else:
-            logger.warning("PDF no disponible en la respuesta")
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Error en emisión de nota de crédito: {str(e)}", exc_info=True)
-        return {
-            "success": False,
-            "error": str(e)
-        }
-    finally:
-        if driver:
-            driver.quit()
-            logger.info("Driver cerrado")
+            logger.error(f"Error en emisión de nota de crédito: {str(e)}", exc_info=True)
+            result = {
+                "success": False,
+                "error": str(e),
+                "fase": fase_fallida(e)
+            }
+            if isinstance(e, CredencialesRechazadas):
+                result["credenciales_rechazadas"] = True
+    
+    if tiempos is not None:
+        result["tiempos"] = tiempos
+    return result
 
 
 
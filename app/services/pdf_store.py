@@ -0,0 +1,89 @@
+"""Almacenamiento en disco de los PDF emitidos"""
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from typing import Iterable, Optional
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+PREFIJO_BLOB = "blob-"
+
+
+class PdfStore:
+    """Guarda los PDF como archivos y expone solo su metadata en el resultado de la tarea"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = os.path.abspath(base_dir)
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def guardar(self, origen: str, filename: str, **metadata) -> dict:
+        """Mueve un PDF descargado al almacenamiento y retorna su metadata"""
+        blob_id = f"{PREFIJO_BLOB}{uuid.uuid4().hex}"
+        destino = os.path.join(self.base_dir, f"{blob_id}.pdf")
+
+        sha256 = hashlib.sha256()
+        with open(origen, "rb") as f:
+            for bloque in iter(lambda: f.read(64 * 1024), b""):
+                sha256.update(bloque)
+
+        shutil.move(origen, destino)
+
+        return {
+            "filename": filename,
+            "size": os.path.getsize(destino),
+            "mime_type": "application/pdf",
+            "sha256": sha256.hexdigest(),
+            "blob_id": blob_id,
+            **metadata
+        }
+
+    def asociar(self, task_id: str, pdf: dict) -> dict:
+        """Asocia un PDF guardado a su tarea y retorna la metadata pública"""
+        origen = os.path.join(self.base_dir, f"{pdf['blob_id']}.pdf")
+        os.replace(origen, self.ruta(task_id))
+
+        publico = {k: v for k, v in pdf.items() if k != "blob_id"}
+        publico["url"] = f"/api/v1/tasks/{task_id}/pdf"
+        return publico
+
+    def ruta(self, task_id: str) -> str:
+        """Ruta del PDF asociado a una tarea"""
+        return os.path.join(self.base_dir, f"{task_id}.pdf")
+
+    def existe(self, task_id: str) -> Optional[str]:
+        """Ruta del PDF de la tarea si existe"""
+        ruta = self.ruta(task_id)
+        return ruta if os.path.isfile(ruta) else None
+
+    def eliminar(self, task_ids: Iterable[str]) -> None:
+        """Elimina los PDF de las tareas indicadas"""
+        for task_id in task_ids:
+            try:
+                os.remove(self.ruta(task_id))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar PDF de {task_id}: {e}")
+
+    def purgar_huerfanos(self, max_age: int) -> int:
+        """Elimina PDF guardados que nunca se asociaron a una tarea"""
+        limite = time.time() - max_age
+        eliminados = 0
+        for nombre in os.listdir(self.base_dir):
+            if not nombre.startswith(PREFIJO_BLOB):
+                continue
+            ruta = os.path.join(self.base_dir, nombre)
+            try:
+                if os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+                    eliminados += 1
+            except OSError:
+                continue
+        return eliminados
+
+
+pdf_store = PdfStore(settings.pdf_storage_dir)
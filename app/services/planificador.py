@@ -0,0 +1,221 @@
+"""Planificación de los trabajos de scraping: prioridad por tipo, equidad entre RUC y límite por RUC"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence
+
+from app.config import settings
+from app.services.circuito import circuito_portal
+from app.services.executor import scraper_executor
+from app.utils.logger import logger
+
+
+class _Turno:
+    """Trabajo esperando (o usando) un worker"""
+
+    def __init__(self, task_ids: List[str], ruc: str, clase: int, futuro: asyncio.Future):
+        self.task_ids = task_ids
+        self.ruc = ruc
+        self.clase = clase
+        self.futuro = futuro
+
+
+class Planificador:
+    """Reparte los workers entre los trabajos en espera.
+
+    Las clases de prioridad se atienden en orden estricto; dentro de una clase, los RUC
+    se turnan (round-robin) y ninguno supera max_por_ruc trabajos simultáneos (0 = sin límite).
+    """
+
+    def __init__(
+        self,
+        prioridades: Sequence[str],
+        max_por_ruc: int,
+        capacidad: Callable[[], int],
+        puerta: Optional[Callable[[], Optional[float]]] = None
+    ):
+        self.prioridades = [p.strip().upper() for p in prioridades if p.strip()]
+        self.max_por_ruc = max_por_ruc
+        self.capacidad = capacidad
+        # Retorna None si se puede despachar o los segundos a esperar (p. ej. circuit breaker abierto)
+        self.puerta = puerta
+        self._reintento: Optional[asyncio.TimerHandle] = None
+        # Una cola por clase; el orden del OrderedDict es el turno de cada RUC
+        self._colas: List["OrderedDict[str, Deque[_Turno]]"] = [
+            OrderedDict() for _ in range(len(self.prioridades) + 1)
+        ]
+        self._por_tarea: Dict[str, _Turno] = {}
+        self._en_curso: Dict[str, int] = {}
+        self._total_en_curso = 0
+        self._lock = threading.Lock()
+
+    def clase(self, tipo_documento: str) -> int:
+        """Clase de prioridad de un tipo de documento (0 es la más alta); los no listados van al final"""
+        try:
+            return self.prioridades.index(tipo_documento.upper())
+        except ValueError:
+            return len(self.prioridades)
+
+    @asynccontextmanager
+    async def turno(self, task_ids: List[str], ruc: str, tipo_documento: str) -> AsyncIterator[bool]:
+        """Espera un worker para el trabajo; entrega False si sus tareas se retiraron antes de empezar"""
+        turno = _Turno(list(task_ids), ruc or "", self.clase(tipo_documento),
+                       asyncio.get_running_loop().create_future())
+        with self._lock:
+            self._colas[turno.clase].setdefault(turno.ruc, deque()).append(turno)
+            for task_id in turno.task_ids:
+                self._por_tarea[task_id] = turno
+        self._despachar()
+
+        try:
+            concedido = await turno.futuro
+        except asyncio.CancelledError:
+            with self._lock:
+                self._quitar(turno)
+                concedido = turno.futuro.done() and not turno.futuro.cancelled() and turno.futuro.result()
+            if concedido:
+                self._liberar(turno)
+            raise
+
+        if not concedido:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self._liberar(turno)
+
+    def retirar(self, task_id: str) -> bool:
+        """Saca de la espera una tarea individual (p. ej. cancelada); True si aún no había empezado"""
+        with self._lock:
+            turno = self._por_tarea.get(task_id)
+            if turno is None or turno.futuro.done() or len(turno.task_ids) > 1:
+                return False
+            self._quitar(turno)
+        turno.futuro.set_result(False)
+        return True
+
+    def posicion(self, task_id: str) -> Optional[int]:
+        """Posición estimada (1 = la siguiente en tomar un worker) o None si no está esperando.
+
+        Considera la prioridad y el round-robin entre RUC; los límites por RUC solo pueden adelantarla.
+        """
+        with self._lock:
+            turno = self._por_tarea.get(task_id)
+            if turno is None or turno.futuro.done():
+                return None
+
+            posicion = sum(len(cola) for colas in self._colas[:turno.clase] for cola in colas.values())
+            colas = self._colas[turno.clase]
+            indice = colas[turno.ruc].index(turno)
+            antes = True
+            for ruc, cola in colas.items():
+                if ruc == turno.ruc:
+                    antes = False
+                    continue
+                # Los RUC que van antes en el turno avanzan una vuelta más
+                posicion += min(len(cola), indice + 1 if antes else indice)
+            return posicion + indice + 1
+
+    def _quitar(self, turno: _Turno) -> None:
+        """Elimina el turno de la espera y del índice (requiere el lock)"""
+        cola = self._colas[turno.clase].get(turno.ruc)
+        if cola is not None and turno in cola:
+            cola.remove(turno)
+            if not cola:
+                del self._colas[turno.clase][turno.ruc]
+        for task_id in turno.task_ids:
+            if self._por_tarea.get(task_id) is turno:
+                del self._por_tarea[task_id]
+
+    def _siguiente(self) -> Optional[_Turno]:
+        """Saca el próximo turno elegible (requiere el lock)"""
+        for colas in self._colas:
+            for ruc in list(colas):
+                if self.max_por_ruc and self._en_curso.get(ruc, 0) >= self.max_por_ruc:
+                    continue
+                cola = colas[ruc]
+                turno = cola.popleft()
+                if cola:
+                    colas.move_to_end(ruc)
+                else:
+                    del colas[ruc]
+                return turno
+        return None
+
+    def _despachar(self) -> None:
+        """Concede workers libres a los turnos elegibles"""
+        concedidos = []
+        espera = None
+        with self._lock:
+            while self._total_en_curso < self.capacidad():
+                turno = self._siguiente()
+                if turno is None:
+                    break
+                if turno.futuro.done():
+                    continue
+                espera = self.puerta() if self.puerta is not None else None
+                if espera is not None:
+                    # El turno conserva su lugar hasta que la puerta vuelva a abrir
+                    colas = self._colas[turno.clase]
+                    colas.setdefault(turno.ruc, deque()).appendleft(turno)
+                    colas.move_to_end(turno.ruc, last=False)
+                    break
+                self._en_curso[turno.ruc] = self._en_curso.get(turno.ruc, 0) + 1
+                self._total_en_curso += 1
+                for task_id in turno.task_ids:
+                    self._por_tarea.pop(task_id, None)
+                concedidos.append(turno)
+
+        for turno in concedidos:
+            turno.futuro.set_result(True)
+        if espera:
+            self._programar(espera)
+
+    def reanudar(self) -> None:
+        """Vuelve a despachar cuando se libera un worker fuera de un turno (p. ej. un trabajo abandonado)"""
+        try:
+            self._despachar()
+        except Exception as e:
+            logger.error(f"Error despachando trabajos: {e}")
+
+    def _programar(self, espera: float) -> None:
+        """Vuelve a despachar cuando vence la espera de la puerta"""
+        if self._reintento is not None:
+            self._reintento.cancel()
+        self._reintento = asyncio.get_running_loop().call_later(espera, self._despachar)
+
+    def _liberar(self, turno: _Turno) -> None:
+        with self._lock:
+            self._en_curso[turno.ruc] -= 1
+            if not self._en_curso[turno.ruc]:
+                del self._en_curso[turno.ruc]
+            self._total_en_curso -= 1
+        try:
+            self._despachar()
+        except Exception as e:
+            logger.error(f"Error despachando trabajos: {e}")
+
+    def estadisticas(self) -> dict:
+        """Turnos en espera por clase y trabajos en curso por RUC"""
+        with self._lock:
+            esperando = {
+                (self.prioridades[i] if i < len(self.prioridades) else "OTROS"): sum(len(c) for c in colas.values())
+                for i, colas in enumerate(self._colas)
+            }
+            return {
+                "esperando": esperando,
+                "en_curso": self._total_en_curso,
+                "en_curso_por_ruc": dict(self._en_curso),
+            }
+
+
+planificador = Planificador(
+    prioridades=settings.scheduler_priorities.split(","),
+    max_por_ruc=settings.scheduler_max_per_ruc,
+    # Un trabajo que superó su plazo pero sigue en su worker (p. ej. en modo process) ocupa un lugar
+    capacidad=lambda: scraper_executor.max_workers - scraper_executor.abandonados,
+    puerta=circuito_portal.puerta
+)
+scraper_executor.al_liberar(planificador.reanudar)
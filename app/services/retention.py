@@ -0,0 +1,95 @@
+"""Política de retención de tareas finalizadas"""
+import asyncio
+from typing import Callable, List, Optional
+
+from app.config import settings
+from app.services.task_store import TaskRepository, task_store
+from app.utils.logger import logger
+
+
+class RetentionSweeper:
+    """Purga periódicamente las tareas finalizadas según TTL, cantidad y bytes"""
+
+    def __init__(
+        self,
+        store: TaskRepository,
+        ttl: int,
+        max_entries: int,
+        max_bytes: int,
+        interval: int = 60
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._on_evict: List[Callable[[List[str]], None]] = []
+        self._on_sweep: List[Callable[[], None]] = []
+        self.eliminadas_total = 0
+
+    def on_evict(self, callback: Callable[[List[str]], None]) -> None:
+        """Registra una función que recibe los task_id eliminados en cada barrido"""
+        self._on_evict.append(callback)
+
+    def on_sweep(self, callback: Callable[[], None]) -> None:
+        """Registra una tarea de limpieza adicional a ejecutar en cada barrido"""
+        self._on_sweep.append(callback)
+
+    def barrer(self) -> List[str]:
+        """Ejecuta un barrido de retención (bloqueante)"""
+        for callback in self._on_sweep:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error en limpieza de retención: {e}")
+
+        eliminadas = self.store.purgar(self.ttl, self.max_entries, self.max_bytes)
+        if eliminadas:
+            self.eliminadas_total += len(eliminadas)
+            logger.info(f"Retención: {len(eliminadas)} tareas eliminadas")
+            for callback in self._on_evict:
+                try:
+                    callback(eliminadas)
+                except Exception as e:
+                    logger.error(f"Error en callback de retención: {e}")
+        return eliminadas
+
+    def estadisticas(self) -> dict:
+        """Tareas y bytes retenidos actualmente"""
+        stats = self.store.estadisticas()
+        stats["eliminadas_total"] = self.eliminadas_total
+        return stats
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await loop.run_in_executor(None, self.barrer)
+            except Exception as e:
+                logger.error(f"Error en barrido de retención: {e}")
+
+    def start(self) -> None:
+        """Inicia el barrido periódico en el event loop actual"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Detiene el barrido periódico"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+retention_sweeper = RetentionSweeper(
+    task_store,
+    ttl=settings.task_ttl,
+    max_entries=settings.task_max_entries,
+    max_bytes=settings.task_max_bytes,
+    interval=settings.retention_sweep_interval
+)
@@ -1,14 +1,22 @@
 """Servicio de scraping para SUNAT"""
 import os
 import time
-import base64
+import shutil
 from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
 
-from app.utils.selenium_utils import configurar_driver
+from app.utils.driver_pool import driver_pool
+from app.utils.selenium_utils import esperar_descarga
+from app.utils.tiempos import fase, fase_fallida, medir_trabajo
+from app.utils import cancelacion
+from app.services.session_cache import session_cache
+from app.services.clientes_cache import clientes_cache
+from app.services.pdf_store import pdf_store
 from app.utils.logger import logger
 from app.config import settings
 
@@ -23,6 +31,16 @@ class LoginError(SunatScraperError):
     pass
 
 
+class CredencialesRechazadas(LoginError):
+    """El portal rechazó el RUC, usuario o clave SOL (no es una falla del portal)"""
+    pass
+
+
+class FormError(SunatScraperError):
+    """Error al abrir el formulario o cargar su cabecera"""
+    pass
+
+
 class ProductAdditionError(SunatScraperError):
     """Error al agregar producto"""
     pass
@@ -38,8 +56,54 @@ class PDFDownloadError(SunatScraperError):
     pass
 
 
+def restaurar_sesion(driver, credenciales: dict) -> bool:
+    """Restaura una sesión en caché; retorna False si no existe o expiró"""
+    cookies = session_cache.obtener(credenciales)
+    if not cookies:
+        return False
+    
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+        driver.get(settings.sunat_url)
+        
+        WebDriverWait(driver, 10).until(
+            lambda d: d.find_elements(By.ID, "txtBusca") or d.find_elements(By.ID, "txtRuc")
+        )
+        if driver.find_elements(By.ID, "txtBusca"):
+            logger.info("Sesión restaurada desde caché")
+            return True
+        
+        logger.info("Sesión en caché expirada, se inicia sesión nuevamente")
+    except Exception as e:
+        logger.warning(f"No se pudo restaurar la sesión en caché: {e}")
+    
+    session_cache.invalidar(credenciales)
+    return False
+
+
+# Textos con que el portal explica un login rechazado (se comparan en minúsculas)
+MENSAJES_RECHAZO_LOGIN = ("incorrect", "inválid", "invalid", "no existe", "bloquead")
+
+
+def mensaje_rechazo_login(driver) -> Optional[str]:
+    """Mensaje de rechazo si el portal volvió al formulario de login explicando que las credenciales no son válidas"""
+    if not driver.find_elements(By.ID, "txtRuc"):
+        return None
+    texto = driver.find_element(By.TAG_NAME, "body").text
+    for linea in texto.splitlines():
+        if any(m in linea.lower() for m in MENSAJES_RECHAZO_LOGIN):
+            return linea.strip()
+    return None
+
+
+@fase("login")
 def iniciar_sesion(driver, credenciales: dict) -> None:
     """Iniciar sesión en SUNAT"""
+    driver.formulario_actual = None
+    
+    if restaurar_sesion(driver, credenciales):
+        return
+    
     try:
         driver.get(settings.sunat_url)
         
@@ -56,53 +120,82 @@ def iniciar_sesion(driver, credenciales: dict) -> None:
         login_button = driver.find_element(By.ID, "btnAceptar")
         login_button.click()
         
+        WebDriverWait(driver, 20).until(
+            lambda d: d.find_elements(By.ID, "txtBusca") or (
+                EC.staleness_of(login_button)(d) and mensaje_rechazo_login(d)
+            )
+        )
+        if not driver.find_elements(By.ID, "txtBusca"):
+            # Reintentar con la misma clave solo acerca el bloqueo de la cuenta SOL
+            raise CredencialesRechazadas(f"SUNAT rechazó las credenciales SOL: {mensaje_rechazo_login(driver)}")
+        
         logger.info("Sesión iniciada correctamente")
+    except CredencialesRechazadas as e:
+        logger.error(f"Error al iniciar sesión: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error al iniciar sesión: {e}")
         raise LoginError(f"No se pudo iniciar sesión: {e}")
+    
+    try:
+        cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        session_cache.guardar(credenciales, cookies)
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la sesión en caché: {e}")
+
+
+def _abrir_dialogo_item(driver, tipo_documento: str) -> None:
+    """Abre el diálogo de un nuevo item y marca el tipo Bien"""
+    WebDriverWait(driver, 20).until(
+        EC.invisibility_of_element_located((By.ID, "waitMessage_underlay"))
+    )
+    
+    button_id = "boleta.addItemButton" if tipo_documento == "BOLETA" else "factura.addItemButton_label"
+    boton_adicionar = WebDriverWait(driver, 20).until(
+        EC.element_to_be_clickable((By.ID, button_id))
+    )
+    boton_adicionar.click()
+    
+    radio_button = WebDriverWait(driver, 20).until(
+        EC.element_to_be_clickable((By.XPATH, "//input[@id='item.subTipoTI01']"))
+    )
+    radio_button.click()
+
+
+def _llenar_dialogo_item(driver, producto: dict) -> None:
+    """Completa campo por campo el diálogo de item ya abierto y lo acepta"""
+    campo_cantidad = driver.find_element(By.XPATH, "//input[@name='cantidad']")
+    campo_cantidad.clear()
+    campo_cantidad.send_keys(str(producto["cantidad"]))
+    
+    unidad_input = driver.find_element(By.ID, "item.unidadMedida")
+    unidad_input.clear()
+    unidad_input.send_keys(producto["unidad_medida"])
+    
+    descripcion_input = driver.find_element(By.ID, "item.descripcion")
+    descripcion_input.clear()
+    descripcion_input.send_keys(producto["descripcion"])
+    
+    precio_input = driver.find_element(By.ID, "item.precioUnitario")
+    precio_input.clear()
+    precio_formateado = "{:.4f}".format(float(producto["precio_base"]))
+    precio_input.send_keys(precio_formateado)
+    
+    # La entrada rápida pudo haberlo marcado antes de caer a este camino
+    igv_checkbox = driver.find_element(By.ID, "item.subTipoTB01")
+    if producto["igv"] == 0 and not igv_checkbox.is_selected():
+        igv_checkbox.click()
+    
+    boton_aceptar = driver.find_element(By.ID, "item.botonAceptar_label")
+    boton_aceptar.click()
 
 
+@fase("productos")
 def agregar_producto(driver, producto: dict, tipo_documento: str) -> None:
     """Agregar producto al formulario"""
     try:
-        WebDriverWait(driver, 20).until(
-            EC.invisibility_of_element_located((By.ID, "waitMessage_underlay"))
-        )
-        
-        button_id = "boleta.addItemButton" if tipo_documento == "BOLETA" else "factura.addItemButton_label"
-        boton_adicionar = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.ID, button_id))
-        )
-        boton_adicionar.click()
-        
-        radio_button = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.XPATH, "//input[@id='item.subTipoTI01']"))
-        )
-        radio_button.click()
-        
-        campo_cantidad = driver.find_element(By.XPATH, "//input[@name='cantidad']")
-        campo_cantidad.clear()
-        campo_cantidad.send_keys(str(producto["cantidad"]))
-        
-        unidad_input = driver.find_element(By.ID, "item.unidadMedida")
-        unidad_input.clear()
-        unidad_input.send_keys(producto["unidad_medida"])
-        
-        descripcion_input = driver.find_element(By.ID, "item.descripcion")
-        descripcion_input.clear()
-        descripcion_input.send_keys(producto["descripcion"])
-        
-        precio_input = driver.find_element(By.ID, "item.precioUnitario")
-        precio_input.clear()
-        precio_formateado = "{:.4f}".format(float(producto["precio_base"]))
-        precio_input.send_keys(precio_formateado)
-        
-        if producto["igv"] == 0:
-            igv_checkbox = driver.find_element(By.ID, "item.subTipoTB01")
-            igv_checkbox.click()
-        
-        boton_aceptar = driver.find_element(By.ID, "item.botonAceptar_label")
-        boton_aceptar.click()
+        _abrir_dialogo_item(driver, tipo_documento)
+        _llenar_dialogo_item(driver, producto)
         
         logger.info(f"Producto '{producto['descripcion']}' agregado correctamente")
     except Exception as e:
@@ -110,6 +203,191 @@ def agregar_producto(driver, producto: dict, tipo_documento: str) -> None:
         raise ProductAdditionError(f"No se pudo agregar producto: {e}")
 
 
+@fase("productos")
+def completar_producto(driver, producto: dict) -> None:
+    """Completa campo por campo un item cuyo diálogo dejó abierto la entrada rápida"""
+    try:
+        _llenar_dialogo_item(driver, producto)
+        logger.info(f"Producto '{producto['descripcion']}' agregado correctamente")
+    except Exception as e:
+        logger.error(f"Error al agregar producto: {e}")
+        raise ProductAdditionError(f"No se pudo agregar producto: {e}")
+
+
+# Llena en el navegador los diálogos de varios items seguidos, con los mismos eventos que un usuario.
+# Con Dojo cargado asigna los valores a través del widget (set), lo que dispara sus onChange;
+# si no, asigna el valor del input y emite input/keyup/change/blur. Retorna cuántos items aceptó
+# y, si se detuvo, en qué paso: "abrir" (diálogo cerrado) o "verificacion"/"aceptar" (diálogo abierto).
+SCRIPT_AGREGAR_PRODUCTOS = r"""
+var productos = arguments[0], botonAgregar = arguments[1], listo = arguments[arguments.length - 1];
+var ESPERA = 20000, fin = Date.now() + arguments[2], i = 0, registro = null;
+try {
+  registro = (window.dijit && dijit.byId) ? dijit : (window.require ? require("dijit/registry") : null);
+} catch (e) {}
+
+function mostrado(el) {
+  if (!el) { return false; }
+  var estilo = window.getComputedStyle(el);
+  return estilo.display !== "none" && estilo.visibility !== "hidden" && el.getClientRects().length > 0;
+}
+function esperar(condicion, ok, vencido) {
+  // Al vencer el plazo del lote se reporta lo agregado antes de que venza el timeout del script
+  var limite = Math.min(Date.now() + ESPERA, fin);
+  (function revisar() {
+    var cumple = false;
+    try { cumple = condicion(); } catch (e) {}
+    if (cumple) { ok(); } else if (Date.now() > limite) { vencido(); } else { setTimeout(revisar, 50); }
+  })();
+}
+function widget(el) {
+  var w = registro && registro.getEnclosingWidget ? registro.getEnclosingWidget(el) : null;
+  return w && (w.focusNode === el || w.textbox === el) ? w : null;
+}
+function esLista(w) { return /FilteringSelect|ComboBox/.test(w.declaredClass || ""); }
+function asignar(el, valor, numerico) {
+  var w = widget(el);
+  if (w) {
+    if (esLista(w)) { w.set("displayedValue", valor); } else { w.set("value", numerico ? parseFloat(valor) : valor); }
+    return;
+  }
+  el.focus();
+  el.value = valor;
+  ["input", "keyup", "change", "blur"].forEach(function (tipo) {
+    el.dispatchEvent(new Event(tipo, {bubbles: true}));
+  });
+}
+function leer(el) {
+  var w = widget(el);
+  if (w) { return String(esLista(w) ? w.get("displayedValue") : w.get("value")); }
+  return el.value;
+}
+function coincide(esperado, leido, numerico) {
+  if (numerico) { return Math.abs(parseFloat(leido) - parseFloat(esperado)) < 1e-6; }
+  return String(leido).trim().toUpperCase() === String(esperado).trim().toUpperCase();
+}
+function fallo(paso, error) { listo({agregados: i, paso: paso, error: String(error)}); }
+
+function siguiente() {
+  if (i >= productos.length) { return listo({agregados: i}); }
+  var p = productos[i], boton, radio;
+  esperar(function () { return !mostrado(document.getElementById("waitMessage_underlay")); }, function () {
+    esperar(function () { boton = document.getElementById(botonAgregar); return mostrado(boton); }, function () {
+      boton.click();
+      esperar(function () {
+        radio = document.getElementById("item.subTipoTI01");
+        return mostrado(radio) && !radio.disabled;
+      }, function () {
+        radio.click();
+        var campos = [
+          ["cantidad", document.querySelector("input[name='cantidad']"), p.cantidad, true],
+          ["unidad", document.getElementById("item.unidadMedida"), p.unidad_medida, false],
+          ["descripcion", document.getElementById("item.descripcion"), p.descripcion, false],
+          ["precio", document.getElementById("item.precioUnitario"), p.precio, true]
+        ];
+        try {
+          campos.forEach(function (c) { asignar(c[1], c[2], c[3]); });
+        } catch (e) { return fallo("verificacion", e); }
+        for (var k = 0; k < campos.length; k++) {
+          var leido = leer(campos[k][1]);
+          if (!coincide(campos[k][2], leido, campos[k][3])) {
+            return fallo("verificacion", campos[k][0] + " quedó en '" + leido + "'");
+          }
+        }
+        var inafecto = document.getElementById("item.subTipoTB01");
+        if (p.inafecto && !inafecto.checked) { inafecto.click(); }
+        document.getElementById("item.botonAceptar_label").click();
+        // El portal cierra el diálogo solo si aceptó el item
+        esperar(function () { return !mostrado(radio); }, function () { i++; siguiente(); }, function () {
+          fallo("aceptar", "El diálogo del item no se cerró");
+        });
+      }, function () { fallo("abrir", "El diálogo del item no se abrió"); });
+    }, function () { fallo("abrir", "Botón Adicionar no disponible"); });
+  }, function () { fallo("abrir", "El portal sigue ocupado"); });
+}
+siguiente();
+"""
+
+
+# Plazo por item del script rápido y holgura hasta el timeout de Selenium y el de la fase
+SEGUNDOS_POR_ITEM_RAPIDO = 20
+MARGEN_SCRIPT_RAPIDO = 10
+
+
+def _tamano_lote_rapido() -> int:
+    """Items por lote: el script debe terminar antes de que el vigilante interrumpa la fase"""
+    maximo = (settings.phase_timeout - 2 * MARGEN_SCRIPT_RAPIDO) // SEGUNDOS_POR_ITEM_RAPIDO
+    return max(min(settings.fast_product_batch, maximo), 1)
+
+
+@fase("productos")
+def _agregar_lote_rapido(driver, productos: List[dict], tipo_documento: str) -> dict:
+    """Agrega varios items con una sola llamada a execute_async_script"""
+    button_id = "boleta.addItemButton" if tipo_documento == "BOLETA" else "factura.addItemButton_label"
+    items = [
+        {
+            "cantidad": str(producto["cantidad"]),
+            "unidad_medida": producto["unidad_medida"],
+            "descripcion": producto["descripcion"],
+            "precio": "{:.4f}".format(float(producto["precio_base"])),
+            "inafecto": producto["igv"] == 0,
+        }
+        for producto in productos
+    ]
+    plazo = max(min(SEGUNDOS_POR_ITEM_RAPIDO * len(items), settings.phase_timeout - 2 * MARGEN_SCRIPT_RAPIDO), 1)
+    anterior = None
+    try:
+        # El driver vuelve al pool: su timeout de scripts se restaura al terminar
+        anterior = driver.timeouts.script
+        driver.set_script_timeout(plazo + MARGEN_SCRIPT_RAPIDO)
+        estado = driver.execute_async_script(SCRIPT_AGREGAR_PRODUCTOS, items, button_id, plazo * 1000)
+    except Exception as e:
+        # No se sabe qué items quedaron agregados: el reintento reabre el formulario
+        raise ProductAdditionError(f"Entrada rápida interrumpida: {e}")
+    finally:
+        if anterior is not None:
+            try:
+                driver.set_script_timeout(anterior)
+            except Exception:
+                # El navegador pudo ser terminado por una cancelación
+                pass
+    if not estado:
+        raise ProductAdditionError("Entrada rápida interrumpida: el script no retornó estado")
+    return estado
+
+
+def agregar_productos(driver, productos: List[dict], tipo_documento: str) -> None:
+    """Agrega los productos; en modo rápido llena varios diálogos por ida y vuelta al navegador"""
+    pendientes = list(productos)
+    rapido = settings.fast_product_entry
+    lote = _tamano_lote_rapido()
+    
+    while pendientes and rapido:
+        actual, pendientes = pendientes[:lote], pendientes[lote:]
+        estado = _agregar_lote_rapido(driver, actual, tipo_documento)
+        agregados = estado.get("agregados", 0)
+        if agregados >= len(actual):
+            logger.info(f"{agregados} productos agregados en un lote")
+            continue
+        
+        # Si un item no se verifica, el resto del documento sigue por el camino campo por campo
+        rapido = False
+        producto = actual[agregados]
+        logger.warning(
+            f"Entrada rápida detenida en '{producto['descripcion']}' ({estado.get('paso')}): "
+            f"{estado.get('error')}; se continúa campo por campo"
+        )
+        if estado.get("paso") in ("verificacion", "aceptar"):
+            # El diálogo del item sigue abierto
+            completar_producto(driver, producto)
+        else:
+            agregar_producto(driver, producto, tipo_documento)
+        pendientes = actual[agregados + 1:] + pendientes
+    
+    for producto in pendientes:
+        agregar_producto(driver, producto, tipo_documento)
+
+
+@fase("emision")
 def completar_emision(driver, tipo_documento: str = "BOLETA") -> bool:
     """Completa el proceso de emisión del comprobante en SUNAT"""
     try:
@@ -141,11 +419,16 @@ def completar_emision(driver, tipo_documento: str = "BOLETA") -> bool:
         confirmar_button = WebDriverWait(driver, 20).until(
             EC.element_to_be_clickable((By.ID, "dlgBtnAceptarConfirm_label"))
         )
+        # Desde este clic el comprobante puede haberse emitido aunque luego falle la espera
+        cancelacion.confirmar_emision()
+        driver.emision_enviada = True
         confirmar_button.click()
         logger.info("Emisión definitiva confirmada")
         
         return True
         
+    except cancelacion.TrabajoCancelado:
+        raise
     except Exception as e:
         logger.error(f"Error al completar emisión: {e}")
         raise EmissionError(f"No se pudo completar la emisión: {e}")
@@ -177,18 +460,26 @@ def construir_nombre_pdf(tipo_documento: str, numero_comprobante: str, ruc: str)
     return f"{prefijo}{numero_comprobante}{ruc}.pdf"
 
 
+@fase("pdf")
 def descargar_pdf(driver, tipo_documento: str, ruc: str, download_dir: str = None) -> dict:
-    """Descarga el PDF del comprobante emitido y retorna su información en Base64"""
+    """Descarga el PDF del comprobante emitido al almacenamiento de PDF y retorna su metadata"""
     try:
         logger.info("Iniciando descarga de PDF")
         
         if not download_dir:
-            download_dir = os.path.join(os.getcwd(), "downloads")
+            download_dir = getattr(driver, "download_dir", None) or os.path.join(os.getcwd(), "downloads")
         
         os.makedirs(download_dir, exist_ok=True)
         
         numero_comprobante = obtener_numero_comprobante(driver)
         
+        pdf_filename = construir_nombre_pdf(tipo_documento, numero_comprobante, ruc)
+        pdf_file = os.path.join(download_dir, pdf_filename)
+        
+        # Evitar confundir un archivo previo con la descarga actual
+        if os.path.exists(pdf_file):
+            os.remove(pdf_file)
+        
         button_id = "dijit_form_Button_3_label" if tipo_documento == "NOTA_CREDITO" else "dijit_form_Button_2_label"
         descargar_button = WebDriverWait(driver, 10).until(
             EC.element_to_be_clickable((By.ID, button_id))
@@ -196,39 +487,78 @@ def descargar_pdf(driver, tipo_documento: str, ruc: str, download_dir: str = Non
         descargar_button.click()
         logger.info("Botón de descarga presionado")
         
-        time.sleep(5)
-        
-        pdf_filename = construir_nombre_pdf(tipo_documento, numero_comprobante, ruc)
-        pdf_file = os.path.join(download_dir, pdf_filename)
-        
-        if not os.path.exists(pdf_file):
+        if not esperar_descarga(download_dir, pdf_filename, timeout=settings.pdf_download_timeout,
+                                esperar=cancelacion.esperar):
             logger.error(f"PDF no encontrado: {pdf_filename}")
             raise PDFDownloadError(f"No se encontró el archivo PDF: {pdf_filename}")
         
         logger.info(f"PDF encontrado: {pdf_filename}")
         
-        with open(pdf_file, 'rb') as f:
-            pdf_content = f.read()
-            pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
-        
-        file_size = len(pdf_content)
-        file_name = os.path.basename(pdf_file)
+        pdf_data = pdf_store.guardar(
+            pdf_file,
+            pdf_filename,
+            numero_comprobante=numero_comprobante
+        )
         
-        logger.info(f"PDF procesado correctamente: {file_name} ({file_size} bytes)")
+        logger.info(f"PDF procesado correctamente: {pdf_filename} ({pdf_data['size']} bytes)")
         
-        return {
-            "filename": file_name,
-            "content": pdf_base64,
-            "size": file_size,
-            "mime_type": "application/pdf",
-            "numero_comprobante": numero_comprobante
-        }
+        return pdf_data
         
+    except cancelacion.TrabajoCancelado:
+        raise
     except Exception as e:
         logger.error(f"Error al descargar PDF: {e}")
         raise PDFDownloadError(f"No se pudo descargar el PDF: {e}")
 
 
+# Pausa tras completar la razón social desde la caché, para detectar una consulta tardía del portal
+ASENTAMIENTO_RAZON_SOCIAL = 1.5
+
+# Completa el campo solo si sigue vacío; si el portal ya lo llenó retorna su valor
+SCRIPT_COMPLETAR_RAZON_SOCIAL = r"""
+var campo = arguments[0], valor = arguments[1];
+if (campo.value.trim()) { return campo.value.trim(); }
+campo.value = valor;
+["input", "change"].forEach(function (tipo) { campo.dispatchEvent(new Event(tipo, {bubbles: true})); });
+return null;
+"""
+
+
+def esperar_razon_social(driver, numero: str) -> None:
+    """Espera que el portal resuelva la razón social del DNI/RUC; si está en caché la espera es corta"""
+    conocida = clientes_cache.obtener(numero)
+    espera = settings.client_cache_wait if conocida else 20
+    
+    def razon_social(d):
+        return d.find_element(By.ID, "inicio.razonSocial").get_attribute("value").strip()
+    
+    try:
+        resuelta = WebDriverWait(driver, espera, poll_frequency=0.1).until(razon_social)
+    except TimeoutException:
+        if conocida is None:
+            raise
+        # El portal tarda en consultar el documento: se usa la razón social que resolvió antes.
+        # Se asigna en una sola operación (como lo hace el portal) y solo si el campo sigue vacío,
+        # para que una respuesta tardía reemplace el valor en vez de mezclarse con lo tecleado
+        input_razon = driver.find_element(By.ID, "inicio.razonSocial")
+        previa = driver.execute_script(SCRIPT_COMPLETAR_RAZON_SOCIAL, input_razon, conocida)
+        
+        cancelacion.esperar(ASENTAMIENTO_RAZON_SOCIAL)
+        resuelta = previa or razon_social(driver)
+        if resuelta == conocida:
+            logger.info(f"Razón social de {numero} tomada de la caché")
+            return
+        
+        # El portal respondió después de todo: su valor prevalece sobre la caché
+        if not resuelta:
+            resuelta = WebDriverWait(driver, 20, poll_frequency=0.1).until(razon_social)
+        logger.info(f"Razón social de {numero} resuelta por el portal tras completarla desde la caché")
+    
+    if resuelta != conocida:
+        clientes_cache.guardar(numero, resuelta)
+
+
+@fase("cliente")
 def configurar_cliente_boleta(driver, cliente: dict) -> None:
     """Configura los datos del cliente para una boleta"""
     input_tipo = driver.find_element(By.ID, "inicio.tipoDocumento")
@@ -242,9 +572,7 @@ def configurar_cliente_boleta(driver, cliente: dict) -> None:
         input_dni.send_keys(cliente["dni"])
         input_dni.send_keys(Keys.TAB)
         
-        WebDriverWait(driver, 20).until(
-            lambda d: d.find_element(By.ID, "inicio.razonSocial").get_attribute("value").strip() != ""
-        )
+        esperar_razon_social(driver, cliente["dni"])
         logger.info("Cliente con DNI configurado")
     else:
         input_tipo.send_keys("SIN DOCUMENTO")
@@ -255,6 +583,7 @@ def configurar_cliente_boleta(driver, cliente: dict) -> None:
         logger.info("Cliente sin documento configurado")
 
 
+@fase("cliente")
 def configurar_cliente_factura(driver, cliente: dict) -> None:
     """Configura los datos del cliente para una factura"""
     input_ruc = WebDriverWait(driver, 20).until(
@@ -263,9 +592,7 @@ def configurar_cliente_factura(driver, cliente: dict) -> None:
     input_ruc.send_keys(cliente["ruc"])
     input_ruc.send_keys(Keys.TAB)
     
-    WebDriverWait(driver, 20).until(
-        lambda d: d.find_element(By.ID, "inicio.razonSocial").get_attribute("value").strip() != ""
-    )
+    esperar_razon_social(driver, cliente["ruc"])
     logger.info("Cliente con RUC configurado")
 
 
@@ -283,148 +610,359 @@ def validar_total(driver, total_esperado: float, tipo_documento: str) -> None:
     logger.info(f"Total validado correctamente: S/ {actual_value}")
 
 
-def emitir_boleta(driver, data: dict) -> None:
-    """Emitir boleta en SUNAT"""
+# Texto del menú y campo inicial del formulario de cada tipo de documento
+FORMULARIOS = {
+    "BOLETA": ("Emitir Boleta de Venta", "inicio.tipoDocumento"),
+    "FACTURA": ("Emitir Factura", "inicio.numeroDocumento"),
+}
+
+
+def abrir_formulario(driver, tipo_documento: str) -> None:
+    """Abre el formulario de emisión desde el menú de SUNAT"""
+    texto_menu, campo_inicial = FORMULARIOS[tipo_documento]
+    
+    driver.switch_to.default_content()
+    driver.formulario_actual = None
+    
+    campo_busqueda = WebDriverWait(driver, 20).until(
+        EC.presence_of_element_located((By.ID, "txtBusca"))
+    )
+    campo_busqueda.clear()
+    campo_busqueda.send_keys(tipo_documento)
+    
+    emitir_button = WebDriverWait(driver, 20).until(
+        EC.element_to_be_clickable((By.XPATH, f"//span[contains(text(), '{texto_menu}')]"))
+    )
+    emitir_button.click()
+    
+    WebDriverWait(driver, 20).until(
+        EC.frame_to_be_available_and_switch_to_it((By.ID, "iframeApplication"))
+    )
+    
+    # Esperar a que el iframe esté completamente cargado
+    WebDriverWait(driver, 20).until(
+        EC.presence_of_element_located((By.ID, campo_inicial))
+    )
+    
+    driver.formulario_actual = tipo_documento
+    logger.info(f"Formulario de {tipo_documento} abierto desde el menú")
+
+
+def reiniciar_formulario(driver, tipo_documento: str) -> bool:
+    """Recarga el formulario ya abierto dentro del iframe para emitir otro documento"""
+    if getattr(driver, "formulario_actual", None) != tipo_documento:
+        return False
+    
+    _, campo_inicial = FORMULARIOS[tipo_documento]
     try:
-        cliente = data["cliente"]
-        
-        campo_busqueda = WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.ID, "txtBusca"))
-        )
-        campo_busqueda.send_keys("BOLETA")
-        
-        emitir_button = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Emitir Boleta de Venta')]"))
-        )
-        emitir_button.click()
+        driver.switch_to.default_content()
+        driver.switch_to.frame("iframeApplication")
         
+        # La marca desaparece cuando el documento del iframe termina de recargarse
+        driver.execute_script("window.__formularioAnterior = true; window.location.reload();")
         WebDriverWait(driver, 20).until(
-            EC.frame_to_be_available_and_switch_to_it((By.ID, "iframeApplication"))
+            lambda d: d.execute_script(
+                "return window.__formularioAnterior === undefined && document.readyState === 'complete'"
+            )
         )
-        
-        configurar_cliente_boleta(driver, cliente)
-        
-        boton_continuar = driver.find_element(By.ID, "inicio.botonGrabarDocumento_label")
-        boton_continuar.click()
-        
-        input_fecha = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.ID, "boleta.fechaEmision"))
+        WebDriverWait(driver, 20).until(
+            EC.presence_of_element_located((By.ID, campo_inicial))
         )
-        input_fecha.clear()
-        input_fecha.send_keys(data["fecha"])
         
-        for producto in data["productos"]:
-            agregar_producto(driver, producto, "BOLETA")
-        
-        time.sleep(1)
-        validar_total(driver, float(data["resumen"]["total"]), "boleta")
-        
-        logger.info("Boleta cargada correctamente")
+        logger.info(f"Formulario de {tipo_documento} reiniciado sin volver al menú")
+        return True
     except Exception as e:
-        logger.error(f"Error al emitir boleta: {e}")
-        raise
+        logger.warning(f"No se pudo reiniciar el formulario, se vuelve al menú: {e}")
+        driver.formulario_actual = None
+        return False
+
+
+@fase("navegacion")
+def preparar_formulario(driver, tipo_documento: str) -> None:
+    """Deja el driver en un formulario de emisión vacío, reutilizando el actual si es posible"""
+    driver.emision_enviada = False
+    if settings.continuous_emission and reiniciar_formulario(driver, tipo_documento):
+        return
+    abrir_formulario(driver, tipo_documento)
 
 
-def emitir_factura(driver, data: dict) -> None:
-    """Emitir factura en SUNAT"""
+def cargar_cabecera(driver, data: dict) -> None:
+    """Abre un formulario vacío y completa cliente y fecha"""
+    tipo_documento = data["tipo_documento"]
+    if tipo_documento not in FORMULARIOS:
+        raise ValueError(f"Tipo de documento no soportado: {tipo_documento}")
+    
     try:
-        cliente = data["cliente"]
-        
-        campo_busqueda = WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.ID, "txtBusca"))
-        )
-        campo_busqueda.send_keys("FACTURA")
+        preparar_formulario(driver, tipo_documento)
         
-        emitir_button = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.XPATH, "//span[contains(text(), 'Emitir Factura')]"))
-        )
-        emitir_button.click()
-        
-        WebDriverWait(driver, 20).until(
-            EC.frame_to_be_available_and_switch_to_it((By.ID, "iframeApplication"))
-        )
-        
-        # Esperar a que el iframe esté completamente cargado
-        WebDriverWait(driver, 20).until(
-            EC.presence_of_element_located((By.ID, "inicio.numeroDocumento"))
-        )
-        
-        configurar_cliente_factura(driver, cliente)
-        
-        boton_continuar = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.ID, "inicio.botonGrabarDocumento_label"))
-        )
+        if tipo_documento == "BOLETA":
+            configurar_cliente_boleta(driver, data["cliente"])
+            boton_continuar = driver.find_element(By.ID, "inicio.botonGrabarDocumento_label")
+        else:
+            configurar_cliente_factura(driver, data["cliente"])
+            boton_continuar = WebDriverWait(driver, 20).until(
+                EC.element_to_be_clickable((By.ID, "inicio.botonGrabarDocumento_label"))
+            )
         boton_continuar.click()
         
         input_fecha = WebDriverWait(driver, 20).until(
-            EC.element_to_be_clickable((By.ID, "factura.fechaEmision"))
+            EC.element_to_be_clickable((By.ID, f"{tipo_documento.lower()}.fechaEmision"))
         )
         input_fecha.clear()
         input_fecha.send_keys(data["fecha"])
-        
-        for producto in data["productos"]:
-            agregar_producto(driver, producto, "FACTURA")
-        
-        time.sleep(1)
-        validar_total(driver, float(data["resumen"]["total"]), "factura")
-        
-        logger.info("Factura cargada correctamente")
     except Exception as e:
-        logger.error(f"Error al emitir factura: {e}")
-        raise
+        logger.error(f"Error al cargar el formulario de {tipo_documento}: {e}")
+        error = FormError(f"No se pudo cargar el formulario: {e}")
+        # Conserva la fase (navegación o cliente) en que falló para el circuit breaker
+        error.fase = fase_fallida(e)
+        raise error from e
 
 
-def send_billing_sunat(data: dict) -> dict:
-    """Función principal para enviar comprobante a SUNAT"""
-    driver = None
-    try:
+def cargar_productos(driver, data: dict) -> None:
+    """Agrega los productos y valida el total calculado por SUNAT"""
+    tipo_documento = data["tipo_documento"]
+    
+    agregar_productos(driver, data["productos"], tipo_documento)
+    
+    time.sleep(1)
+    validar_total(driver, float(data["resumen"]["total"]), tipo_documento.lower())
+    
+    logger.info(f"{tipo_documento.capitalize()} cargada correctamente")
+
+
+# Puntos de control de una emisión, en orden
+CHECKPOINTS = ("logged_in", "form_open", "products_added", "emitted", "pdf_fetched")
+
+
+class PoliticaReintento:
+    """Reintentos permitidos para una clase de error y punto de control desde el que se reanuda"""
+
+    def __init__(self, reintentos: int, espera: float, reanudar_desde: Optional[str]):
+        self.reintentos = reintentos
+        self.espera = espera
+        self.reanudar_desde = reanudar_desde
+
+
+# Un formulario a medio llenar no se puede reanudar: se vuelve a abrir desde la sesión iniciada.
+# LoginError cubre solo fallas transitorias (timeouts, página que no cargó); CredencialesRechazadas
+# no se reintenta: cada intento con una clave errada acerca el bloqueo de la cuenta SOL
+POLITICAS_REINTENTO = {
+    LoginError: PoliticaReintento(reintentos=2, espera=3, reanudar_desde=None),
+    FormError: PoliticaReintento(reintentos=1, espera=2, reanudar_desde="logged_in"),
+    ProductAdditionError: PoliticaReintento(reintentos=1, espera=2, reanudar_desde="logged_in"),
+    EmissionError: PoliticaReintento(reintentos=1, espera=2, reanudar_desde="logged_in"),
+    PDFDownloadError: PoliticaReintento(reintentos=2, espera=2, reanudar_desde="emitted"),
+}
+
+
+class EmisionComprobante:
+    """Máquina de estados de una emisión: avanza por los puntos de control y ante un error
+    reintentable se reanuda desde el último punto seguro en el mismo navegador"""
+
+    def __init__(self, driver, data: dict, checkpoint: Optional[str] = None):
+        self.driver = driver
+        self.data = data
+        self.checkpoint = checkpoint
+        self.pdf_data = None
+        self.pdf_error: Optional[str] = None
+        self.reintentos: Dict[str, int] = {}
+
+    def alcanzado(self, checkpoint: str) -> bool:
+        return self.checkpoint is not None and CHECKPOINTS.index(self.checkpoint) >= CHECKPOINTS.index(checkpoint)
+
+    def _avanzar(self, checkpoint: str) -> None:
+        self.checkpoint = checkpoint
+        logger.info(f"Punto de control alcanzado: {checkpoint}")
+
+    def _ejecutar_pasos(self) -> None:
+        driver, data = self.driver, self.data
         tipo_documento = data["tipo_documento"]
-        logger.info(f"Iniciando proceso de emisión de {tipo_documento}")
-        
-        download_dir = os.path.join(os.getcwd(), "downloads")
-        driver = configurar_driver(headless=settings.chrome_headless, download_dir=download_dir)
-        
-        iniciar_sesion(driver, data["credenciales"])
-        
-        if tipo_documento == "BOLETA":
-            emitir_boleta(driver, data)
-            completar_emision(driver, "BOLETA")
-        elif tipo_documento == "FACTURA":
-            emitir_factura(driver, data)
-            completar_emision(driver, "FACTURA")
-        else:
-            raise ValueError(f"Tipo de documento no soportado: {tipo_documento}")
-        
-        pdf_data = descargar_pdf(driver, tipo_documento, data["credenciales"]["ruc"], download_dir)
-        
-        logger.info("Proceso completado exitosamente")
         
+        if not self.alcanzado("logged_in"):
+            iniciar_sesion(driver, data["credenciales"])
+            self._avanzar("logged_in")
+        
+        if not self.alcanzado("form_open"):
+            cargar_cabecera(driver, data)
+            self._avanzar("form_open")
+        
+        if not self.alcanzado("products_added"):
+            cargar_productos(driver, data)
+            self._avanzar("products_added")
+        
+        if not self.alcanzado("emitted"):
+            completar_emision(driver, tipo_documento)
+            self._avanzar("emitted")
+        
+        if not self.alcanzado("pdf_fetched"):
+            self.pdf_data = descargar_pdf(driver, tipo_documento, data["credenciales"]["ruc"])
+            self._avanzar("pdf_fetched")
+
+    def _politica(self, error: Exception) -> Optional[PoliticaReintento]:
+        """Política aplicable al error o None si no se debe reintentar"""
+        if isinstance(error, CredencialesRechazadas):
+            return None
+        politica = POLITICAS_REINTENTO.get(type(error))
+        if politica is None or not settings.checkpoint_retries:
+            return None
+        if self.reintentos.get(type(error).__name__, 0) >= politica.reintentos:
+            return None
+        
+        control = cancelacion.actual()
+        if control is not None and control.motivo is not None:
+            return None
+        
+        # Tras confirmar la emisión, repetirla podría duplicar el comprobante
+        if isinstance(error, EmissionError) and getattr(self.driver, "emision_enviada", False):
+            logger.warning("La emisión ya se había confirmado, no se reintenta para no duplicarla")
+            return None
+        return politica
+
+    def ejecutar(self) -> dict:
+        """Ejecuta los pasos pendientes con reintentos; retorna el resultado o lanza el último error"""
+        while True:
+            try:
+                self._ejecutar_pasos()
+                return self.resultado()
+            except SunatScraperError as e:
+                politica = self._politica(e)
+                if politica is None:
+                    if isinstance(e, PDFDownloadError) and self.alcanzado("emitted"):
+                        # El comprobante ya existe en SUNAT: se reporta la emisión sin PDF
+                        self.pdf_error = str(e)
+                        return self.resultado()
+                    e.checkpoint = self.checkpoint
+                    e.reintentos = dict(self.reintentos)
+                    e.emision_enviada = getattr(self.driver, "emision_enviada", False)
+                    raise
+                
+                nombre = type(e).__name__
+                self.reintentos[nombre] = self.reintentos.get(nombre, 0) + 1
+                if politica.reanudar_desde is None:
+                    self.checkpoint = None
+                elif self.alcanzado(politica.reanudar_desde):
+                    self.checkpoint = politica.reanudar_desde
+                
+                espera = politica.espera * self.reintentos[nombre]
+                logger.warning(
+                    f"{nombre}: reintento {self.reintentos[nombre]}/{politica.reintentos} "
+                    f"desde {self.checkpoint or 'el inicio'} en {espera:g}s"
+                )
+                # Una cancelación o timeout durante la espera termina el trabajo sin otro paso
+                cancelacion.esperar(espera)
+
+    def resultado(self) -> dict:
+        data = self.data
+        tipo_documento = data["tipo_documento"]
         result = {
             "success": True,
             "message": f"{tipo_documento} emitida correctamente",
             "serie": data["resumen"]["serie"],
             "numero": data["resumen"]["numero"],
-            "total": data["resumen"]["total"]
+            "total": data["resumen"]["total"],
+            "checkpoint": self.checkpoint
         }
+        if self.reintentos:
+            result["reintentos"] = dict(self.reintentos)
         
-        if pdf_data:
-            result["pdf"] = pdf_data
-            logger.info(f"PDF incluido en respuesta: {pdf_data['filename']}")
+        if self.pdf_data:
+            result["pdf"] = self.pdf_data
+            logger.info(f"PDF incluido en respuesta: {self.pdf_data['filename']}")
         else:
+            result["pdf_error"] = self.pdf_error
             logger.warning("PDF no disponible en la respuesta")
         
         return result
-        
-    except Exception as e:
-        logger.error(f"Error en emisión: {str(e)}", exc_info=True)
-        return {
-            "success": False,
-            "error": str(e)
-        }
-    finally:
-        if driver:
-            driver.quit()
-            logger.info("Driver cerrado")
+
+
+def resultado_error(error: Exception) -> dict:
+    """Resultado de una emisión fallida con la fase y el último punto de control alcanzados"""
+    result = {
+        "success": False,
+        "error": str(error),
+        "fase": fase_fallida(error),
+        "checkpoint": getattr(error, "checkpoint", None)
+    }
+    if getattr(error, "reintentos", None):
+        result["reintentos"] = error.reintentos
+    if isinstance(error, CredencialesRechazadas):
+        result["credenciales_rechazadas"] = True
+    if getattr(error, "emision_enviada", False):
+        result["emision_enviada"] = True
+        result["error"] = f"{error} (la emisión puede haberse registrado en SUNAT; verifique antes de reenviar)"
+    return result
+
+
+def send_billing_sunat(data: dict) -> dict:
+    """Función principal para enviar comprobante a SUNAT"""
+    with medir_trabajo() as tiempos:
+        try:
+            logger.info(f"Iniciando proceso de emisión de {data['tipo_documento']}")
+            
+            with driver_pool.driver() as driver:
+                result = EmisionComprobante(driver, data).ejecutar()
+            
+            logger.info("Proceso completado exitosamente")
+            
+        except Exception as e:
+            logger.error(f"Error en emisión: {str(e)}", exc_info=True)
+            result = resultado_error(e)
+    
+    if tiempos is not None:
+        result["tiempos"] = tiempos
+    return result
+
+
+def send_billing_batch_sunat(items: List[dict], on_item: Optional[Callable[[int, dict], None]] = None) -> List[dict]:
+    """Emite en secuencia varios comprobantes de las mismas credenciales con una sola sesión"""
+    resultados = []
+    
+    def registrar(index: int, result: dict) -> None:
+        resultados.append(result)
+        if on_item:
+            on_item(index, result)
+    
+    with medir_trabajo() as sesion:
+        try:
+            logger.info(f"Iniciando lote de {len(items)} comprobantes")
+            
+            with driver_pool.driver() as driver:
+                iniciar_sesion(driver, items[0]["credenciales"])
+                
+                control = cancelacion.actual()
+                for index, data in enumerate(items):
+                    # Un comprobante cancelado antes de su turno no se emite; el lote sigue
+                    if control is not None and not control.iniciar_item(index):
+                        registrar(index, cancelacion.resultado_interrumpido("cancelled", "Tarea cancelada por el cliente"))
+                        continue
+                    with medir_trabajo() as tiempos:
+                        try:
+                            # En modo continuo el siguiente comprobante reutiliza el formulario del iframe
+                            result = EmisionComprobante(driver, data, checkpoint="logged_in").ejecutar()
+                        except Exception as e:
+                            logger.error(f"Error en comprobante {index + 1} del lote: {str(e)}")
+                            result = resultado_error(e)
+                            # Recargar el menú descarta el formulario a medio llenar
+                            driver.switch_to.default_content()
+                            driver.formulario_actual = None
+                            driver.get(settings.sunat_url)
+                    
+                    if tiempos is not None:
+                        # El driver y el login de la sesión se cargan al primer comprobante
+                        if index == 0:
+                            tiempos.update({k: round(v, 3) for k, v in sesion.items()})
+                        result["tiempos"] = tiempos
+                    
+                    registrar(index, result)
+            
+            logger.info("Lote completado")
+            
+        except Exception as e:
+            logger.error(f"Error en lote: {str(e)}", exc_info=True)
+            for index in range(len(resultados), len(items)):
+                registrar(index, resultado_error(e))
+    
+    return resultados
 
 
 if __name__ == "__main__":
@@ -465,7 +1003,6 @@ if __name__ == "__main__":
     logger.info(f"Resultado: {result}")
 
     if result.get("success") and result.get("pdf"):
-        pdf_bytes = base64.b64decode(result["pdf"]["content"])
-        with open("./comprobante.pdf", "wb") as f:
-            f.write(pdf_bytes)
-            logger.info("PDF guardado en ./comprobante.pdf")
+        blob = os.path.join(pdf_store.base_dir, f"{result['pdf']['blob_id']}.pdf")
+        shutil.move(blob, "./comprobante.pdf")
+        logger.info("PDF guardado en ./comprobante.pdf")
@@ -0,0 +1,103 @@
+"""Caché de sesiones autenticadas de SUNAT por credencial"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+# Campos aceptados por Network.setCookies del protocolo DevTools
+CAMPOS_COOKIE = (
+    "name", "value", "domain", "path", "secure", "httpOnly",
+    "sameSite", "expires", "priority", "sourceScheme", "sourcePort"
+)
+
+
+def clave_credenciales(credenciales: dict) -> Tuple[str, str, str]:
+    """Clave de caché: RUC, usuario y hash de la contraseña (nunca en claro)"""
+    password_hash = hashlib.sha256(credenciales["password"].encode("utf-8")).hexdigest()
+    return credenciales["ruc"], credenciales["usuario"], password_hash
+
+
+def limpiar_cookies(cookies: List[dict]) -> List[dict]:
+    """Convierte cookies de Network.getAllCookies al formato de Network.setCookies"""
+    limpias = []
+    for cookie in cookies:
+        limpia = {k: v for k, v in cookie.items() if k in CAMPOS_COOKIE}
+        if cookie.get("session") or limpia.get("expires", -1) < 0:
+            limpia.pop("expires", None)
+        limpias.append(limpia)
+    return limpias
+
+
+class SessionCache:
+    """Cookie jars de sesiones iniciadas con expiración por TTL y desalojo LRU"""
+
+    def __init__(self, ttl: int = 900, max_entries: int = 100, enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, credenciales: dict) -> Optional[List[dict]]:
+        """Retorna las cookies vigentes de la credencial o None"""
+        if not self.enabled:
+            return None
+
+        clave = clave_credenciales(credenciales)
+        with self._lock:
+            entry = self._entries.get(clave)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            guardado, cookies = entry
+            if time.time() - guardado > self.ttl:
+                del self._entries[clave]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(clave)
+            self.hits += 1
+            return cookies
+
+    def guardar(self, credenciales: dict, cookies: List[dict]) -> None:
+        """Guarda las cookies de una sesión recién iniciada"""
+        if not self.enabled or not cookies:
+            return
+
+        clave = clave_credenciales(credenciales)
+        with self._lock:
+            self._entries[clave] = (time.time(), limpiar_cookies(cookies))
+            self._entries.move_to_end(clave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidar(self, credenciales: dict) -> None:
+        """Descarta la sesión de una credencial (expirada o rechazada)"""
+        with self._lock:
+            if self._entries.pop(clave_credenciales(credenciales), None) is not None:
+                logger.info(f"Sesión en caché invalidada para RUC {credenciales['ruc']}")
+
+    def estadisticas(self) -> dict:
+        """Resumen del estado de la caché"""
+        with self._lock:
+            return {
+                "habilitado": self.enabled,
+                "entradas": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+session_cache = SessionCache(
+    ttl=settings.session_cache_ttl,
+    max_entries=settings.session_cache_max_entries,
+    enabled=settings.session_cache_enabled
+)
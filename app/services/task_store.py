@@ -0,0 +1,813 @@
+"""Repositorio de tareas de emisión (memoria o SQLite)"""
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.config import settings
+from app.services.session_cache import clave_credenciales
+from app.utils.logger import logger
+
+
+ESTADOS_FINALES = ("completed", "failed", "timeout", "cancelled")
+
+# Una solicitud repetida reutiliza la tarea previa solo si esta no terminó en error
+ESTADOS_REUTILIZABLES = ("pending", "processing", "completed")
+
+# ...o si falló después de confirmar la emisión: reenviarla podría duplicar el comprobante
+ESTADOS_EMISION_INCIERTA = ("failed", "timeout")
+
+
+def _ahora() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def campos_indexados(data: dict) -> dict:
+    """Extrae de la solicitud los campos por los que se consultan las tareas"""
+    resumen = data.get("resumen") or {}
+    credenciales = data.get("credenciales") or {}
+    return {
+        "tipo_documento": data.get("tipo_documento", "NOTA_CREDITO"),
+        "id_remitente": data.get("id_remitente"),
+        "ruc": credenciales.get("ruc"),
+        "serie": resumen.get("serie"),
+        "numero": resumen.get("numero"),
+    }
+
+
+def tamano_tarea(task: dict) -> int:
+    """Tamaño aproximado en bytes de la solicitud y el resultado de una tarea"""
+    tamano = len(json.dumps(task["data"]))
+    if task.get("result") is not None:
+        tamano += len(json.dumps(task["result"]))
+    return tamano
+
+
+def redactar_credenciales(data: dict) -> dict:
+    """Copia de la solicitud sin la contraseña SOL, para conservarla tras finalizar"""
+    if not data.get("credenciales"):
+        return data
+    return {**data, "credenciales": {**data["credenciales"], "password": "***"}}
+
+
+def clave_idempotencia(data: dict, idempotency_key: Optional[str] = None) -> Optional[str]:
+    """Clave de deduplicación: el header Idempotency-Key o, si no viene, RUC + tipo + serie + número"""
+    ruc = (data.get("credenciales") or {}).get("ruc")
+    if idempotency_key:
+        return f"key:{ruc}:{idempotency_key}"
+
+    campos = campos_indexados(data)
+    if ruc and campos["serie"] and campos["numero"]:
+        return f"doc:{ruc}:{campos['tipo_documento']}:{campos['serie']}:{campos['numero']}"
+    return None
+
+
+def reutilizable(task: dict) -> bool:
+    """Si una solicitud repetida debe retornar esta tarea en lugar de crear otra"""
+    if task["status"] in ESTADOS_REUTILIZABLES:
+        return True
+    return task["status"] in ESTADOS_EMISION_INCIERTA and bool((task.get("result") or {}).get("emision_enviada"))
+
+
+def nueva_tarea(
+    task_id: str,
+    data: dict,
+    batch_id: Optional[str] = None,
+    batch_index: Optional[int] = None,
+    idempotency_key: Optional[str] = None
+) -> dict:
+    """Construye el registro inicial de una tarea pendiente"""
+    ahora = _ahora()
+    return {
+        "task_id": task_id,
+        "status": "pending",
+        "batch_id": batch_id,
+        "batch_index": batch_index,
+        "idempotency_key": idempotency_key,
+        "data": data,
+        "created_at": ahora,
+        "started_at": None,
+        "completed_at": None,
+        "updated_at": ahora,
+        "result": None
+    }
+
+
+class TaskRepository(ABC):
+    """Interfaz común de los repositorios de tareas"""
+
+    @abstractmethod
+    def crear(self, task: dict) -> dict:
+        ...
+
+    @abstractmethod
+    def crear_o_reutilizar(self, task: dict, ventana: int) -> Tuple[dict, bool]:
+        """Crea la tarea salvo que exista otra con su clave de idempotencia, reutilizable y creada
+        dentro de la ventana (segundos). Retorna (tarea, creada) de forma atómica"""
+
+    @abstractmethod
+    def obtener(self, task_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def transicionar(self, task_id: str, desde: Iterable[str], hacia: str, **campos) -> bool:
+        """Cambia el estado solo si el estado actual está en `desde` (operación atómica)"""
+
+    @abstractmethod
+    def listar(
+        self,
+        status: Optional[str] = None,
+        id_remitente: Optional[str] = None,
+        serie: Optional[str] = None,
+        numero: Optional[str] = None,
+        limit: int = 100
+    ) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def listar_lote(self, batch_id: str) -> List[dict]:
+        """Tareas de un lote en el orden en que fueron enviadas"""
+
+    @abstractmethod
+    def contar_por_estado(self) -> Dict[str, int]:
+        ...
+
+    @abstractmethod
+    def purgar(self, ttl: int, max_entries: int, max_bytes: int) -> List[str]:
+        """Elimina tareas finalizadas vencidas por TTL y, si se exceden los límites
+        de cantidad o bytes, las menos usadas recientemente. Retorna los task_id eliminados"""
+
+    @abstractmethod
+    def estadisticas(self) -> Dict[str, int]:
+        """Cantidad de tareas y bytes retenidos"""
+
+    def cerrar(self) -> None:
+        pass
+
+
+class ColaCompartida(ABC):
+    """Operaciones de la cola compartida con los workers de worker.py (EXECUTOR_MODE=queue).
+
+    Solo las implementa un repositorio visible desde varios procesos.
+    """
+
+    @abstractmethod
+    def tomar_siguiente(self, clase: Callable[[str], int], max_por_ruc: int) -> List[dict]:
+        """Pasa a processing el próximo trabajo pendiente: una tarea o los items de un lote con las
+        mismas credenciales. Retorna sus tareas (vacío si no hay trabajo elegible)"""
+
+    @abstractmethod
+    def posiciones_pendientes(self, clase: Callable[[str], int], max_por_ruc: int) -> Dict[str, int]:
+        """Posición estimada de cada tarea pendiente (1 = el próximo trabajo), simulando las tomas
+        de tomar_siguiente; los items de un lote que se toman juntos comparten posición"""
+
+    @abstractmethod
+    def registrar_fase(self, task_id: str, fase: str) -> None:
+        """Guarda la última fase completada por una tarea en proceso"""
+
+    @abstractmethod
+    def latido(self, task_ids: Iterable[str]) -> None:
+        """Renueva updated_at de tareas en proceso para indicar que su worker sigue vivo"""
+
+    @abstractmethod
+    def cambios_desde(self, desde: str) -> List[dict]:
+        """Tareas con updated_at posterior a desde, de la más antigua a la más reciente"""
+
+    @abstractmethod
+    def en_proceso_sin_cambios(self, antes_de: str) -> List[dict]:
+        """Tareas en proceso cuyo updated_at es anterior a antes_de (worker caído)"""
+
+    @abstractmethod
+    def publicar_worker(self, worker: str, estado: dict) -> None:
+        """Guarda el último estado reportado por un worker (circuito, tareas en curso)"""
+
+    @abstractmethod
+    def listar_workers(self, desde: str) -> List[dict]:
+        """Estado de los workers que reportaron después de desde"""
+
+
+class InMemoryTaskRepository(TaskRepository):
+    """Repositorio en memoria con índices secundarios, local al proceso"""
+
+    def __init__(self):
+        self._tasks: Dict[str, dict] = {}
+        self._por_estado: Dict[str, set] = {}
+        self._por_remitente: Dict[str, set] = {}
+        self._por_comprobante: Dict[tuple, set] = {}
+        self._por_lote: Dict[str, set] = {}
+        self._por_idempotencia: Dict[str, set] = {}
+        self._tamanos: Dict[str, int] = {}
+        self._bytes_total = 0
+        # Tareas finalizadas en orden LRU (la menos usada primero)
+        self._finalizadas: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _indexar(self, task: dict) -> None:
+        campos = campos_indexados(task["data"])
+        self._por_estado.setdefault(task["status"], set()).add(task["task_id"])
+        if campos["id_remitente"]:
+            self._por_remitente.setdefault(campos["id_remitente"], set()).add(task["task_id"])
+        if campos["serie"] and campos["numero"]:
+            clave = (campos["serie"], campos["numero"])
+            self._por_comprobante.setdefault(clave, set()).add(task["task_id"])
+        if task.get("batch_id"):
+            self._por_lote.setdefault(task["batch_id"], set()).add(task["task_id"])
+        if task.get("idempotency_key"):
+            self._por_idempotencia.setdefault(task["idempotency_key"], set()).add(task["task_id"])
+
+    def _desindexar(self, task: dict) -> None:
+        campos = campos_indexados(task["data"])
+        indices = [
+            (self._por_estado, task["status"]),
+            (self._por_remitente, campos["id_remitente"]),
+            (self._por_comprobante, (campos["serie"], campos["numero"])),
+            (self._por_lote, task.get("batch_id")),
+            (self._por_idempotencia, task.get("idempotency_key")),
+        ]
+        for indice, clave in indices:
+            ids = indice.get(clave)
+            if ids is not None:
+                ids.discard(task["task_id"])
+                if not ids:
+                    del indice[clave]
+
+    def _medir(self, task: dict) -> None:
+        tamano = tamano_tarea(task)
+        self._bytes_total += tamano - self._tamanos.get(task["task_id"], 0)
+        self._tamanos[task["task_id"]] = tamano
+
+    def _eliminar(self, task_id: str) -> None:
+        task = self._tasks.pop(task_id)
+        self._desindexar(task)
+        self._bytes_total -= self._tamanos.pop(task_id, 0)
+        self._finalizadas.pop(task_id, None)
+
+    def crear(self, task: dict) -> dict:
+        with self._lock:
+            if task["task_id"] in self._tasks:
+                raise ValueError(f"La tarea {task['task_id']} ya existe")
+            self._tasks[task["task_id"]] = dict(task)
+            self._indexar(task)
+            self._medir(task)
+            return dict(task)
+
+    def crear_o_reutilizar(self, task: dict, ventana: int) -> Tuple[dict, bool]:
+        clave = task.get("idempotency_key")
+        if not clave:
+            return self.crear(task), True
+
+        limite = (datetime.utcnow() - timedelta(seconds=ventana)).isoformat()
+        with self._lock:
+            candidatas = [
+                self._tasks[task_id] for task_id in self._por_idempotencia.get(clave, ())
+                if reutilizable(self._tasks[task_id])
+                and self._tasks[task_id]["created_at"] >= limite
+            ]
+            if candidatas:
+                return dict(max(candidatas, key=lambda t: t["created_at"])), False
+            return self.crear(task), True
+
+    def obtener(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            if task_id in self._finalizadas:
+                self._finalizadas.move_to_end(task_id)
+            return dict(task)
+
+    def transicionar(self, task_id: str, desde: Iterable[str], hacia: str, **campos) -> bool:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task["status"] not in tuple(desde):
+                return False
+
+            self._por_estado[task["status"]].discard(task_id)
+            self._por_estado.setdefault(hacia, set()).add(task_id)
+            task.update(campos)
+            task["status"] = hacia
+            task["updated_at"] = _ahora()
+            if "result" in campos or "data" in campos:
+                self._medir(task)
+            if hacia in ESTADOS_FINALES:
+                self._finalizadas[task_id] = None
+                self._finalizadas.move_to_end(task_id)
+            return True
+
+    def listar(self, status=None, id_remitente=None, serie=None, numero=None, limit=100) -> List[dict]:
+        with self._lock:
+            filtros = []
+            if status:
+                filtros.append(self._por_estado.get(status, set()))
+            if id_remitente:
+                filtros.append(self._por_remitente.get(id_remitente, set()))
+            if serie and numero:
+                filtros.append(self._por_comprobante.get((serie, numero), set()))
+
+            if filtros:
+                tasks = [self._tasks[t] for t in set.intersection(*filtros)]
+            else:
+                tasks = list(self._tasks.values())
+
+            if serie and not numero:
+                tasks = [t for t in tasks if campos_indexados(t["data"])["serie"] == serie]
+
+            tasks.sort(key=lambda t: t["created_at"], reverse=True)
+            return [dict(t) for t in tasks[:limit]]
+
+    def listar_lote(self, batch_id: str) -> List[dict]:
+        with self._lock:
+            tasks = [self._tasks[t] for t in self._por_lote.get(batch_id, set())]
+            tasks.sort(key=lambda t: t["batch_index"])
+            return [dict(t) for t in tasks]
+
+    def contar_por_estado(self) -> Dict[str, int]:
+        with self._lock:
+            return {estado: len(ids) for estado, ids in self._por_estado.items() if ids}
+
+    def purgar(self, ttl: int, max_entries: int, max_bytes: int) -> List[str]:
+        limite = (datetime.utcnow() - timedelta(seconds=ttl)).isoformat()
+        eliminadas = []
+        with self._lock:
+            for task_id in list(self._finalizadas):
+                completed_at = self._tasks[task_id].get("completed_at")
+                if completed_at and completed_at < limite:
+                    self._eliminar(task_id)
+                    eliminadas.append(task_id)
+
+            while self._finalizadas and (
+                len(self._tasks) > max_entries or self._bytes_total > max_bytes
+            ):
+                task_id = next(iter(self._finalizadas))
+                self._eliminar(task_id)
+                eliminadas.append(task_id)
+        return eliminadas
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entradas": len(self._tasks), "bytes": self._bytes_total}
+
+
+class SQLiteTaskRepository(TaskRepository, ColaCompartida):
+    """Repositorio persistente en SQLite (modo WAL), compartible entre procesos"""
+
+    COLUMNAS = (
+        "task_id", "status", "tipo_documento", "id_remitente", "ruc", "serie", "numero",
+        "data", "result", "created_at", "started_at", "completed_at", "updated_at",
+        "accessed_at", "size_bytes", "batch_id", "batch_index", "idempotency_key", "fase"
+    )
+
+    # Columnas agregadas después de la primera versión del esquema
+    MIGRACIONES = {
+        "accessed_at": "TEXT",
+        "size_bytes": "INTEGER NOT NULL DEFAULT 0",
+        "batch_id": "TEXT",
+        "batch_index": "INTEGER",
+        "idempotency_key": "TEXT",
+        "fase": "TEXT",
+    }
+
+    ESQUEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            tipo_documento TEXT,
+            id_remitente TEXT,
+            ruc TEXT,
+            serie TEXT,
+            numero TEXT,
+            data TEXT NOT NULL,
+            result TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            completed_at TEXT,
+            updated_at TEXT NOT NULL,
+            accessed_at TEXT,
+            size_bytes INTEGER NOT NULL DEFAULT 0,
+            batch_id TEXT,
+            batch_index INTEGER,
+            idempotency_key TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+        CREATE INDEX IF NOT EXISTS idx_tasks_remitente ON tasks(id_remitente);
+        CREATE INDEX IF NOT EXISTS idx_tasks_comprobante ON tasks(serie, numero);
+        CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks(updated_at);
+        CREATE TABLE IF NOT EXISTS workers (
+            worker TEXT PRIMARY KEY,
+            estado TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+    """
+
+    INDICES = """
+        CREATE INDEX IF NOT EXISTS idx_tasks_accessed ON tasks(accessed_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks(batch_id, batch_index);
+        CREATE INDEX IF NOT EXISTS idx_tasks_idempotencia ON tasks(idempotency_key, created_at);
+        CREATE INDEX IF NOT EXISTS idx_tasks_status_created ON tasks(status, created_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directorio = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directorio, exist_ok=True)
+        self._local = threading.local()
+
+        conn = self._conexion()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.ESQUEMA)
+        self._migrar(conn)
+        conn.executescript(self.INDICES)
+        logger.info(f"Repositorio de tareas SQLite: {path}")
+
+    def _migrar(self, conn: sqlite3.Connection) -> None:
+        """Agrega las columnas que falten en bases creadas con esquemas anteriores"""
+        existentes = {row["name"] for row in conn.execute("PRAGMA table_info(tasks)")}
+        for columna, tipo in self.MIGRACIONES.items():
+            if columna not in existentes:
+                conn.execute(f"ALTER TABLE tasks ADD COLUMN {columna} {tipo}")
+
+    def _conexion(self) -> sqlite3.Connection:
+        """Una conexión por hilo; SQLite serializa las escrituras entre procesos"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Las contraseñas SOL redactadas o purgadas se sobrescriben con ceros en el archivo
+            conn.execute("PRAGMA secure_delete=ON")
+            self._local.conn = conn
+        return conn
+
+    def _a_tarea(self, row: sqlite3.Row) -> dict:
+        return {
+            "task_id": row["task_id"],
+            "status": row["status"],
+            "batch_id": row["batch_id"],
+            "batch_index": row["batch_index"],
+            "idempotency_key": row["idempotency_key"],
+            "data": json.loads(row["data"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "completed_at": row["completed_at"],
+            "updated_at": row["updated_at"],
+            "fase": row["fase"],
+        }
+
+    def _a_fila(self, task: dict) -> dict:
+        fila = {
+            "task_id": task["task_id"],
+            "status": task["status"],
+            "data": json.dumps(task["data"]),
+            "result": json.dumps(task["result"]) if task.get("result") is not None else None,
+            "created_at": task["created_at"],
+            "started_at": task.get("started_at"),
+            "completed_at": task.get("completed_at"),
+            "updated_at": task.get("updated_at") or task["created_at"],
+            "accessed_at": task["created_at"],
+            "size_bytes": tamano_tarea(task),
+            "batch_id": task.get("batch_id"),
+            "batch_index": task.get("batch_index"),
+            "idempotency_key": task.get("idempotency_key"),
+            "fase": None,
+        }
+        fila.update(campos_indexados(task["data"]))
+        return fila
+
+    def crear(self, task: dict) -> dict:
+        fila = self._a_fila(task)
+        columnas = ", ".join(self.COLUMNAS)
+        marcadores = ", ".join(f":{c}" for c in self.COLUMNAS)
+        try:
+            self._conexion().execute(f"INSERT INTO tasks ({columnas}) VALUES ({marcadores})", fila)
+        except sqlite3.IntegrityError:
+            raise ValueError(f"La tarea {task['task_id']} ya existe")
+        return dict(task)
+
+    def crear_o_reutilizar(self, task: dict, ventana: int) -> Tuple[dict, bool]:
+        clave = task.get("idempotency_key")
+        if not clave:
+            return self.crear(task), True
+
+        limite = (datetime.utcnow() - timedelta(seconds=ventana)).isoformat()
+        estados = ", ".join("?" for _ in ESTADOS_REUTILIZABLES)
+        inciertos = ", ".join("?" for _ in ESTADOS_EMISION_INCIERTA)
+        conn = self._conexion()
+        # BEGIN IMMEDIATE serializa la consulta y la inserción también entre procesos
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT * FROM tasks WHERE idempotency_key = ? AND (status IN ({estados}) "
+                f"OR (status IN ({inciertos}) AND json_extract(result, '$.emision_enviada'))) "
+                f"AND created_at >= ? ORDER BY created_at DESC LIMIT 1",
+                (clave, *ESTADOS_REUTILIZABLES, *ESTADOS_EMISION_INCIERTA, limite)
+            ).fetchone()
+            if row is None:
+                self.crear(task)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row is not None:
+            return self._a_tarea(row), False
+        return dict(task), True
+
+    def obtener(self, task_id: str) -> Optional[dict]:
+        conn = self._conexion()
+        row = conn.execute(
+            "SELECT * FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row["status"] in ESTADOS_FINALES:
+            conn.execute("UPDATE tasks SET accessed_at = ? WHERE task_id = ?", (_ahora(), task_id))
+        return self._a_tarea(row)
+
+    def transicionar(self, task_id: str, desde: Iterable[str], hacia: str, **campos) -> bool:
+        desde = tuple(desde)
+        ahora = _ahora()
+        valores = {"status": hacia, "updated_at": ahora, "accessed_at": ahora}
+        for campo, valor in campos.items():
+            if campo not in ("data", "result", "started_at", "completed_at"):
+                raise ValueError(f"Campo no actualizable: {campo}")
+            if campo in ("data", "result") and valor is not None:
+                valor = json.dumps(valor)
+            valores[campo] = valor
+
+        asignaciones = ", ".join(f"{c} = ?" for c in valores)
+        marcadores = ", ".join("?" for _ in desde)
+        conn = self._conexion()
+        cursor = conn.execute(
+            f"UPDATE tasks SET {asignaciones} WHERE task_id = ? AND status IN ({marcadores})",
+            (*valores.values(), task_id, *desde)
+        )
+        if cursor.rowcount != 1:
+            return False
+
+        if "data" in campos or "result" in campos:
+            conn.execute(
+                "UPDATE tasks SET size_bytes = LENGTH(data) + COALESCE(LENGTH(result), 0) "
+                "WHERE task_id = ?",
+                (task_id,)
+            )
+        return True
+
+    def listar(self, status=None, id_remitente=None, serie=None, numero=None, limit=100) -> List[dict]:
+        condiciones = []
+        parametros = []
+        for columna, valor in (("status", status), ("id_remitente", id_remitente),
+                               ("serie", serie), ("numero", numero)):
+            if valor:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+
+        where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+        rows = self._conexion().execute(
+            f"SELECT * FROM tasks {where} ORDER BY created_at DESC LIMIT ?",
+            (*parametros, limit)
+        ).fetchall()
+        return [self._a_tarea(row) for row in rows]
+
+    def listar_lote(self, batch_id: str) -> List[dict]:
+        rows = self._conexion().execute(
+            "SELECT * FROM tasks WHERE batch_id = ? ORDER BY batch_index", (batch_id,)
+        ).fetchall()
+        return [self._a_tarea(row) for row in rows]
+
+    def contar_por_estado(self) -> Dict[str, int]:
+        rows = self._conexion().execute(
+            "SELECT status, COUNT(*) AS total FROM tasks GROUP BY status"
+        ).fetchall()
+        return {row["status"]: row["total"] for row in rows}
+
+    def purgar(self, ttl: int, max_entries: int, max_bytes: int) -> List[str]:
+        limite = (datetime.utcnow() - timedelta(seconds=ttl)).isoformat()
+        finales = ", ".join("?" for _ in ESTADOS_FINALES)
+        conn = self._conexion()
+        eliminadas = []
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({finales}) AND completed_at < ?",
+                (*ESTADOS_FINALES, limite)
+            ).fetchall()
+            eliminadas.extend(row["task_id"] for row in rows)
+            conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(t,) for t in eliminadas])
+
+            totales = conn.execute(
+                "SELECT COUNT(*) AS entradas, COALESCE(SUM(size_bytes), 0) AS bytes FROM tasks"
+            ).fetchone()
+            entradas, bytes_totales = totales["entradas"], totales["bytes"]
+
+            if entradas > max_entries or bytes_totales > max_bytes:
+                lru = []
+                cursor = conn.execute(
+                    f"SELECT task_id, size_bytes FROM tasks WHERE status IN ({finales}) "
+                    f"ORDER BY accessed_at",
+                    ESTADOS_FINALES
+                )
+                for row in cursor:
+                    if entradas <= max_entries and bytes_totales <= max_bytes:
+                        break
+                    lru.append(row["task_id"])
+                    entradas -= 1
+                    bytes_totales -= row["size_bytes"]
+                cursor.close()
+
+                conn.executemany("DELETE FROM tasks WHERE task_id = ?", [(t,) for t in lru])
+                eliminadas.extend(lru)
+
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        # El WAL conserva las versiones previas de las filas (con la contraseña aún sin redactar)
+        # hasta que se transfieren al archivo principal y se trunca
+        bloqueado = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+        if bloqueado:
+            logger.warning("No se pudo truncar el WAL del repositorio de tareas; se reintenta en el siguiente barrido")
+        return eliminadas
+
+    def estadisticas(self) -> Dict[str, int]:
+        row = self._conexion().execute(
+            "SELECT COUNT(*) AS entradas, COALESCE(SUM(size_bytes), 0) AS bytes FROM tasks"
+        ).fetchone()
+        return {"entradas": row["entradas"], "bytes": row["bytes"]}
+
+    # Trabajos pendientes que se evalúan en cada toma; los más nuevos esperan a que estos salgan
+    MAX_CANDIDATOS = 1000
+
+    @staticmethod
+    def _prioridad(row: sqlite3.Row, clase: Callable[[str], int], en_curso: Dict[str, int]) -> tuple:
+        """Prioridad por tipo; dentro de la clase, primero los RUC con menos trabajos en curso"""
+        return clase(row["tipo_documento"] or ""), en_curso.get(row["ruc"], 0), row["created_at"]
+
+    @staticmethod
+    def _en_curso_por_ruc(conn: sqlite3.Connection) -> Dict[str, int]:
+        return {
+            row["ruc"]: row["total"] for row in conn.execute(
+                "SELECT ruc, COUNT(*) AS total FROM tasks WHERE status = 'processing' GROUP BY ruc"
+            )
+        }
+
+    def tomar_siguiente(self, clase: Callable[[str], int], max_por_ruc: int) -> List[dict]:
+        conn = self._conexion()
+        # BEGIN IMMEDIATE: dos workers nunca toman la misma tarea
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            en_curso = self._en_curso_por_ruc(conn)
+            candidatos = [
+                row for row in conn.execute(
+                    "SELECT task_id, tipo_documento, ruc, batch_id, created_at FROM tasks "
+                    "WHERE status = 'pending' ORDER BY created_at LIMIT ?",
+                    (self.MAX_CANDIDATOS,)
+                )
+                if not max_por_ruc or en_curso.get(row["ruc"], 0) < max_por_ruc
+            ]
+            if not candidatos:
+                conn.execute("COMMIT")
+                return []
+
+            elegido = min(candidatos, key=lambda row: self._prioridad(row, clase, en_curso))
+            filas = [conn.execute("SELECT * FROM tasks WHERE task_id = ?", (elegido["task_id"],)).fetchone()]
+            if elegido["batch_id"]:
+                # Los items del lote con las mismas credenciales comparten la sesión
+                clave = clave_credenciales(json.loads(filas[0]["data"])["credenciales"])
+                filas = [
+                    row for row in conn.execute(
+                        "SELECT * FROM tasks WHERE batch_id = ? AND status = 'pending' ORDER BY batch_index",
+                        (elegido["batch_id"],)
+                    )
+                    if clave_credenciales(json.loads(row["data"])["credenciales"]) == clave
+                ]
+
+            ahora = _ahora()
+            conn.executemany(
+                "UPDATE tasks SET status = 'processing', started_at = ?, updated_at = ?, accessed_at = ? "
+                "WHERE task_id = ?",
+                [(ahora, ahora, ahora, row["task_id"]) for row in filas]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        tareas = []
+        for row in filas:
+            tarea = self._a_tarea(row)
+            tarea.update(status="processing", started_at=ahora, updated_at=ahora)
+            tareas.append(tarea)
+        return tareas
+
+    def posiciones_pendientes(self, clase: Callable[[str], int], max_por_ruc: int) -> Dict[str, int]:
+        conn = self._conexion()
+        en_curso = self._en_curso_por_ruc(conn)
+        filas = conn.execute(
+            "SELECT task_id, tipo_documento, ruc, batch_id, created_at, data FROM tasks "
+            "WHERE status = 'pending' ORDER BY created_at LIMIT ?",
+            (self.MAX_CANDIDATOS,)
+        ).fetchall()
+
+        # Una cola por (clase, RUC) en orden de llegada: su cabeza es la única candidata de ese par
+        colas: Dict[tuple, Deque[sqlite3.Row]] = {}
+        sesiones: Dict[tuple, List[str]] = {}
+        sesion_de: Dict[str, tuple] = {}
+        for row in filas:
+            colas.setdefault((clase(row["tipo_documento"] or ""), row["ruc"]), deque()).append(row)
+            if row["batch_id"]:
+                sesion = (row["batch_id"], clave_credenciales(json.loads(row["data"])["credenciales"]))
+                sesiones.setdefault(sesion, []).append(row["task_id"])
+                sesion_de[row["task_id"]] = sesion
+
+        posiciones: Dict[str, int] = {}
+        posicion = 0
+        while True:
+            for par in list(colas):
+                cola = colas[par]
+                while cola and cola[0]["task_id"] in posiciones:
+                    cola.popleft()
+                if not cola:
+                    del colas[par]
+            if not colas:
+                return posiciones
+
+            cabezas = [cola[0] for cola in colas.values()]
+            elegibles = [
+                row for row in cabezas if not max_por_ruc or en_curso.get(row["ruc"], 0) < max_por_ruc
+            ]
+            if not elegibles:
+                # Todos los RUC en espera están al tope: se asume que cada uno libera una sesión
+                for row in cabezas:
+                    en_curso[row["ruc"]] = max_por_ruc - 1
+                continue
+
+            elegido = min(elegibles, key=lambda row: self._prioridad(row, clase, en_curso))
+            posicion += 1
+            tomadas = sesiones.get(sesion_de.get(elegido["task_id"]), [elegido["task_id"]])
+            for task_id in tomadas:
+                posiciones[task_id] = posicion
+            # Como en tomar_siguiente, cada item en proceso cuenta para su RUC
+            en_curso[elegido["ruc"]] = en_curso.get(elegido["ruc"], 0) + len(tomadas)
+
+    def registrar_fase(self, task_id: str, fase: str) -> None:
+        self._conexion().execute(
+            "UPDATE tasks SET fase = ?, updated_at = ? WHERE task_id = ? AND status = 'processing'",
+            (fase, _ahora(), task_id)
+        )
+
+    def latido(self, task_ids: Iterable[str]) -> None:
+        ahora = _ahora()
+        self._conexion().executemany(
+            "UPDATE tasks SET updated_at = ? WHERE task_id = ? AND status = 'processing'",
+            [(ahora, task_id) for task_id in task_ids]
+        )
+
+    def cambios_desde(self, desde: str) -> List[dict]:
+        rows = self._conexion().execute(
+            "SELECT * FROM tasks WHERE updated_at > ? ORDER BY updated_at", (desde,)
+        ).fetchall()
+        return [self._a_tarea(row) for row in rows]
+
+    def en_proceso_sin_cambios(self, antes_de: str) -> List[dict]:
+        rows = self._conexion().execute(
+            "SELECT * FROM tasks WHERE status = 'processing' AND updated_at < ?", (antes_de,)
+        ).fetchall()
+        return [self._a_tarea(row) for row in rows]
+
+    def publicar_worker(self, worker: str, estado: dict) -> None:
+        self._conexion().execute(
+            "INSERT INTO workers (worker, estado, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(worker) DO UPDATE SET estado = excluded.estado, updated_at = excluded.updated_at",
+            (worker, json.dumps(estado), _ahora())
+        )
+
+    def listar_workers(self, desde: str) -> List[dict]:
+        rows = self._conexion().execute(
+            "SELECT worker, estado, updated_at FROM workers WHERE updated_at > ? ORDER BY worker", (desde,)
+        ).fetchall()
+        return [{**json.loads(row["estado"]), "worker": row["worker"], "updated_at": row["updated_at"]} for row in rows]
+
+    def cerrar(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def crear_task_store(backend: str, path: str) -> TaskRepository:
+    """Crea el repositorio de tareas configurado"""
+    if backend == "sqlite":
+        return SQLiteTaskRepository(path)
+    if backend == "memory":
+        return InMemoryTaskRepository()
+    raise ValueError(f"Backend de tareas no soportado: {backend}")
+
+
+task_store = crear_task_store(settings.task_store_backend, settings.task_store_path)
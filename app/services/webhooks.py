@@ -0,0 +1,272 @@
+"""Notificación del resultado de las tareas a la callback_url del cliente"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from app.config import settings
+from app.utils.logger import logger
+
+
+# Respuestas que indican un error transitorio del receptor
+ESTADOS_REINTENTABLES = (408, 425, 429)
+
+# Tope del intervalo entre reintentos (segundos)
+MAX_ESPERA = 300
+
+
+def firmar(secreto: str, timestamp: str, cuerpo: bytes) -> str:
+    """Firma HMAC-SHA256 de "{timestamp}.{cuerpo}" en hexadecimal"""
+    mensaje = timestamp.encode() + b"." + cuerpo
+    return hmac.new(secreto.encode(), mensaje, hashlib.sha256).hexdigest()
+
+
+def verificar_firma(secreto: str, timestamp: str, cuerpo: bytes, firma: str, tolerancia: int = 300) -> bool:
+    """Valida el header X-Webhook-Signature en el receptor; rechaza timestamps fuera de tolerancia"""
+    try:
+        if abs(time.time() - int(timestamp)) > tolerancia:
+            return False
+    except ValueError:
+        return False
+    esperada = f"sha256={firmar(secreto, timestamp, cuerpo)}"
+    return hmac.compare_digest(esperada, firma)
+
+
+def direccion_interna(direccion: str) -> bool:
+    """True si la IP no es pública: loopback, privada, link-local, reservada o multicast"""
+    ip = ipaddress.ip_address(direccion.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return not ip.is_global or ip.is_multicast
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    """Una redirección podría llevar la notificación a un destino interno: se trata como respuesta final"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+@dataclass
+class Entrega:
+    """Notificación pendiente de entregar"""
+    url: str
+    evento: str
+    payload: dict
+    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    intentos: int = 0
+
+
+class WebhookDispatcher:
+    """Cola acotada de notificaciones con workers asíncronos, reintentos con backoff y firma HMAC"""
+
+    def __init__(
+        self,
+        secreto: str = "",
+        workers: int = 2,
+        max_cola: int = 1000,
+        max_intentos: int = 5,
+        backoff: float = 2.0,
+        timeout: float = 10,
+        permitir_privadas: bool = False
+    ):
+        self.secreto = secreto
+        self.workers = workers
+        self.max_cola = max_cola
+        self.max_intentos = max_intentos
+        self.backoff = backoff
+        self.timeout = timeout
+        self.permitir_privadas = permitir_privadas
+        self._opener = urllib.request.build_opener(_SinRedirecciones)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cola: Optional[asyncio.Queue] = None
+        self._tareas: List[asyncio.Task] = []
+        self._lock = threading.Lock()
+        self.entregadas = 0
+        self.fallidas = 0
+        self.descartadas = 0
+        self.reintentos = 0
+        self.esperando_reintento = 0
+
+    def validar_destino(self, url: str) -> None:
+        """Lanza ValueError si el host de la URL resuelve a una dirección interna
+        (u OSError si no se puede resolver); es bloqueante por la consulta DNS"""
+        if self.permitir_privadas:
+            return
+        host = urllib.parse.urlsplit(url).hostname
+        if not host:
+            raise ValueError("La callback_url no tiene host")
+        for *_, direccion in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP):
+            if direccion_interna(direccion[0]):
+                raise ValueError(f"La callback_url apunta a una dirección no pública ({direccion[0]})")
+
+    def encolar(self, url: str, evento: str, payload: dict) -> None:
+        """Agrega una notificación a la cola; se puede llamar desde cualquier hilo"""
+        if self._loop is None:
+            logger.warning(f"Webhooks detenidos, se descarta la notificación a {url}")
+            self._contar("descartadas")
+            return
+
+        entrega = Entrega(url, evento, payload)
+        try:
+            en_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            en_loop = False
+
+        if en_loop:
+            self._poner(entrega)
+        else:
+            self._loop.call_soon_threadsafe(self._poner, entrega)
+
+    def _poner(self, entrega: Entrega) -> None:
+        try:
+            self._cola.put_nowait(entrega)
+        except asyncio.QueueFull:
+            logger.error(f"Cola de webhooks llena ({self.max_cola}), se descarta la notificación a {entrega.url}")
+            self._contar("descartadas")
+
+    def _reencolar(self, entrega: Entrega) -> None:
+        self._contar("esperando_reintento", -1)
+        if self._cola is not None:
+            self._poner(entrega)
+
+    def _contar(self, atributo: str, cantidad: int = 1) -> None:
+        with self._lock:
+            setattr(self, atributo, getattr(self, atributo) + cantidad)
+
+    def _enviar(self, entrega: Entrega) -> int:
+        """POST bloqueante de la notificación; retorna el código HTTP (0 si no hubo respuesta)"""
+        cuerpo = json.dumps(entrega.payload, default=str).encode("utf-8")
+        timestamp = str(int(time.time()))
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": f"{settings.app_name}/{settings.version}",
+            "X-Webhook-Id": entrega.id,
+            "X-Webhook-Event": entrega.evento,
+            "X-Webhook-Timestamp": timestamp,
+            "X-Webhook-Attempt": str(entrega.intentos),
+        }
+        if self.secreto:
+            headers["X-Webhook-Signature"] = f"sha256={firmar(self.secreto, timestamp, cuerpo)}"
+
+        request = urllib.request.Request(entrega.url, data=cuerpo, headers=headers, method="POST")
+        try:
+            with self._opener.open(request, timeout=self.timeout) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except Exception as e:
+            logger.warning(f"Webhook {entrega.id} a {entrega.url} sin respuesta: {e}")
+            return 0
+
+    def _entregar(self, entrega: Entrega) -> Optional[int]:
+        """Verifica de nuevo el destino (el DNS pudo cambiar desde la solicitud) y envía;
+        retorna None si el destino quedó prohibido y la notificación se descarta"""
+        try:
+            self.validar_destino(entrega.url)
+        except ValueError as e:
+            self._contar("fallidas")
+            logger.error(f"Webhook {entrega.evento} a {entrega.url} descartado: {e}")
+            return None
+        except OSError as e:
+            # Error de resolución: se reintenta como una falta de respuesta
+            logger.warning(f"Webhook {entrega.id} a {entrega.url} sin resolver: {e}")
+            return 0
+        return self._enviar(entrega)
+
+    def _espera(self, intentos: int) -> float:
+        """Backoff exponencial con jitter"""
+        base = min(self.backoff * 2 ** (intentos - 1), MAX_ESPERA)
+        return base * random.uniform(0.5, 1.0)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            entrega = await self._cola.get()
+            try:
+                entrega.intentos += 1
+                codigo = await loop.run_in_executor(None, self._entregar, entrega)
+                if codigo is not None:
+                    self._resultado(entrega, codigo)
+            except Exception as e:
+                logger.error(f"Error entregando webhook {entrega.id}: {e}")
+            finally:
+                self._cola.task_done()
+
+    def _resultado(self, entrega: Entrega, codigo: int) -> None:
+        """Registra la entrega o programa su reintento"""
+        if 200 <= codigo < 300:
+            self._contar("entregadas")
+            logger.info(f"Webhook {entrega.evento} entregado a {entrega.url} (intento {entrega.intentos})")
+            return
+
+        reintentable = codigo == 0 or codigo >= 500 or codigo in ESTADOS_REINTENTABLES
+        if not reintentable or entrega.intentos >= self.max_intentos:
+            self._contar("fallidas")
+            logger.error(
+                f"Webhook {entrega.evento} a {entrega.url} falló tras {entrega.intentos} intentos "
+                f"(HTTP {codigo or 'sin respuesta'})"
+            )
+            return
+
+        espera = self._espera(entrega.intentos)
+        self._contar("reintentos")
+        self._contar("esperando_reintento")
+        logger.warning(f"Webhook a {entrega.url} respondió {codigo or 'sin respuesta'}, reintento en {espera:.1f}s")
+        self._loop.call_later(espera, self._reencolar, entrega)
+
+    def start(self) -> None:
+        """Inicia los workers de entrega en el event loop actual"""
+        if self._loop is not None:
+            return
+        if not self.secreto:
+            logger.warning("WEBHOOK_SECRET no configurado: las notificaciones se envían sin firma")
+        self._loop = asyncio.get_running_loop()
+        self._cola = asyncio.Queue(maxsize=self.max_cola)
+        self._tareas = [self._loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5) -> None:
+        """Espera brevemente a que se vacíe la cola y detiene los workers"""
+        if self._loop is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Se detienen los webhooks con {self._cola.qsize()} notificaciones en cola")
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._loop, self._cola, self._tareas = None, None, []
+
+    def estadisticas(self) -> dict:
+        """Contadores de entrega y tamaño actual de la cola"""
+        return {
+            "en_cola": self._cola.qsize() if self._cola is not None else 0,
+            "esperando_reintento": self.esperando_reintento,
+            "entregadas": self.entregadas,
+            "fallidas": self.fallidas,
+            "descartadas": self.descartadas,
+            "reintentos": self.reintentos,
+        }
+
+
+webhook_dispatcher = WebhookDispatcher(
+    secreto=settings.webhook_secret,
+    workers=settings.webhook_workers,
+    max_cola=settings.webhook_queue_size,
+    max_intentos=settings.webhook_max_attempts,
+    backoff=settings.webhook_backoff,
+    timeout=settings.webhook_timeout,
+    permitir_privadas=settings.webhook_allow_private
+)
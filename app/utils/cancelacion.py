@@ -0,0 +1,275 @@
+"""Timeouts y cancelación de trabajos de scraping en curso"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.config import settings
+from app.services.eventos import eventos_tareas
+from app.utils.logger import logger
+from app.utils.selenium_utils import matar_driver
+
+
+MOTIVOS = ("timeout", "cancelled")
+
+# Cancelaciones de trabajos que aún esperan un worker libre en este proceso
+MAX_CANCELACIONES_PREVIAS = 1000
+
+# Fase publicada al confirmar la emisión; desde ella (y en las siguientes) ya no se puede cancelar
+FASE_EMISION_ENVIADA = "emision_enviada"
+FASES_EMITIDAS = (FASE_EMISION_ENVIADA, "emision", "pdf")
+
+
+class TrabajoCancelado(Exception):
+    """El trabajo fue cancelado o superó su tiempo límite"""
+    pass
+
+
+class ControlTrabajo:
+    """Plazo, fase actual y drivers de un trabajo, para poder interrumpirlo desde otro hilo"""
+
+    def __init__(self, task_ids: List[str], timeout: float, timeout_fase: float):
+        self.task_ids = list(task_ids)
+        self.timeout = timeout
+        self.limite = time.monotonic() + timeout
+        self.timeout_fase = timeout_fase
+        self.motivo: Optional[str] = None
+        self.detalle: Optional[str] = None
+        self.fase: Optional[str] = None
+        self.fase_interrumpida: Optional[str] = None
+        self.inicio_fase = time.monotonic()
+        # Índice del comprobante en curso cuando el trabajo es un lote
+        self.item: Optional[int] = None
+        # Tareas cuya emisión ya se confirmó y tareas de un lote canceladas antes de empezar
+        self._emitidas: Set[str] = set()
+        self._omitidas: Set[str] = set()
+        self._drivers: list = []
+        self._interrumpido = threading.Event()
+        self._lock = threading.Lock()
+
+    def registrar_driver(self, driver) -> None:
+        with self._lock:
+            self._drivers.append(driver)
+            cancelado = self.motivo is not None
+        if cancelado:
+            matar_driver(driver)
+
+    def liberar_driver(self, driver) -> None:
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+
+    def entrar_fase(self, nombre: str) -> tuple:
+        """Marca el inicio de una fase; retorna la fase anterior para restaurarla"""
+        self.verificar()
+        anterior = (self.fase, self.inicio_fase)
+        self.fase, self.inicio_fase = nombre, time.monotonic()
+        return anterior
+
+    def salir_fase(self, anterior: tuple) -> None:
+        self.fase, self.inicio_fase = anterior
+
+    def tareas_en_curso(self) -> List[str]:
+        """Tareas a las que corresponde la fase actual: el item en curso de un lote o todas"""
+        if self.item is not None and self.item < len(self.task_ids):
+            return [self.task_ids[self.item]]
+        return self.task_ids
+
+    def iniciar_item(self, index: int) -> bool:
+        """Pasa al comprobante indicado de un lote; False si se canceló antes de empezar"""
+        with self._lock:
+            if self.task_ids[index] in self._omitidas:
+                return False
+            self.item = index
+            return True
+
+    def confirmar_emision(self) -> None:
+        """Se llama justo antes de confirmar la emisión; desde entonces el cliente ya no puede cancelarla"""
+        with self._lock:
+            if self.motivo is not None:
+                raise TrabajoCancelado(self.detalle)
+            tareas = self.tareas_en_curso()
+            self._emitidas.update(tareas)
+        eventos_tareas.publicar_fase(tareas, FASE_EMISION_ENVIADA)
+
+    def cancelar_tarea(self, task_id: str, detalle: str) -> Optional[str]:
+        """Cancelación pedida por el cliente; retorna por qué no se puede o None si se aplicó"""
+        with self._lock:
+            if task_id in self._emitidas:
+                return "la emisión ya se confirmó en SUNAT"
+            if len(self.task_ids) > 1:
+                # En un lote solo se omiten los comprobantes que aún no empiezan; la sesión sigue
+                if self.item is not None and self.task_ids.index(task_id) <= self.item:
+                    return "el comprobante ya está en proceso dentro de su lote"
+                self._omitidas.add(task_id)
+                return None
+        self.cancelar("cancelled", detalle)
+        return None
+
+    def verificar(self) -> None:
+        """Lanza TrabajoCancelado si el trabajo ya fue interrumpido"""
+        if self.motivo is not None:
+            raise TrabajoCancelado(self.detalle)
+
+    def esperar(self, segundos: float) -> None:
+        """Espera los segundos indicados; lanza TrabajoCancelado apenas el trabajo se interrumpe"""
+        self._interrumpido.wait(segundos)
+        self.verificar()
+
+    def cancelar(self, motivo: str, detalle: str) -> None:
+        """Interrumpe el trabajo matando sus navegadores para que Selenium falle de inmediato"""
+        with self._lock:
+            if self.motivo is not None:
+                return
+            self.motivo, self.detalle = motivo, detalle
+            self.fase_interrumpida = self.fase
+            drivers = list(self._drivers)
+        self._interrumpido.set()
+
+        logger.warning(f"Trabajo {', '.join(self.task_ids)} interrumpido: {detalle}")
+        for driver in drivers:
+            terminados = matar_driver(driver)
+            logger.info(f"Navegador terminado ({terminados} procesos)")
+
+
+_local = threading.local()
+_activos: Dict[str, ControlTrabajo] = {}
+_previas: "OrderedDict[str, tuple]" = OrderedDict()
+# Tareas cuyo trabajo ya terminó pero cuyo resultado aún no se registra
+_terminadas: "OrderedDict[str, None]" = OrderedDict()
+_lock = threading.Lock()
+_vigilante: Optional[threading.Thread] = None
+
+
+def actual() -> Optional[ControlTrabajo]:
+    """Control del trabajo que se ejecuta en este hilo"""
+    return getattr(_local, "control", None)
+
+
+def _vigilar() -> None:
+    """Interrumpe los trabajos de este proceso que superan su plazo total o el de su fase"""
+    while True:
+        time.sleep(1)
+        ahora = time.monotonic()
+        with _lock:
+            controles = set(_activos.values())
+
+        for control in controles:
+            if control.motivo is not None:
+                continue
+            if ahora > control.limite:
+                control.cancelar("timeout", f"Tiempo límite de la tarea excedido ({control.timeout:g}s)")
+            elif control.fase and ahora - control.inicio_fase > control.timeout_fase:
+                control.cancelar(
+                    "timeout",
+                    f"Tiempo límite de la fase '{control.fase}' excedido ({control.timeout_fase}s)"
+                )
+
+
+def esperar(segundos: float) -> None:
+    """Pausa interrumpible del trabajo de este hilo (fuera de un trabajo controlado, un sleep)"""
+    control = actual()
+    if control is None:
+        time.sleep(segundos)
+    else:
+        control.esperar(segundos)
+
+
+def confirmar_emision() -> None:
+    """Marca que el trabajo de este hilo va a confirmar la emisión (sin efecto fuera de un trabajo controlado)"""
+    control = actual()
+    if control is not None:
+        control.confirmar_emision()
+
+
+def _iniciar_vigilante() -> None:
+    global _vigilante
+    with _lock:
+        if _vigilante is None or not _vigilante.is_alive():
+            _vigilante = threading.Thread(target=_vigilar, name="vigilante-timeouts", daemon=True)
+            _vigilante.start()
+
+
+def ejecutar_controlado(task_ids: List[str], timeout: float, func: Callable[..., Any], *args: Any) -> Any:
+    """Ejecuta func(*args) con plazo total y por fase; se usa dentro del worker (hilo o proceso)"""
+    with _lock:
+        previas = {task_id: _previas.pop(task_id) for task_id in task_ids if task_id in _previas}
+    # Una tarea cancelada mientras esperaba un worker no llega a lanzar el navegador
+    if previas and len(task_ids) == 1:
+        return resultado_interrumpido(*previas[task_ids[0]])
+
+    control = ControlTrabajo(task_ids, timeout, settings.phase_timeout)
+    control._omitidas.update(previas)
+    _iniciar_vigilante()
+
+    with _lock:
+        for task_id in control.task_ids:
+            _activos[task_id] = control
+    _local.control = control
+    try:
+        resultado = func(*args)
+        if control.motivo is not None:
+            resultado = _marcar_interrumpido(resultado, control)
+        return resultado
+    finally:
+        _local.control = None
+        with _lock:
+            for task_id in control.task_ids:
+                if _activos.get(task_id) is control:
+                    del _activos[task_id]
+                _terminadas[task_id] = None
+            while len(_terminadas) > MAX_CANCELACIONES_PREVIAS:
+                _terminadas.popitem(last=False)
+
+
+def resultado_interrumpido(motivo: str, detalle: str, fase: Optional[str] = None) -> dict:
+    """Resultado de una tarea cancelada o vencida"""
+    return {
+        "success": False,
+        "error": detalle,
+        "interrumpida": motivo,
+        "fase": fase
+    }
+
+
+def _marcar_interrumpido(resultado: Any, control: ControlTrabajo) -> Any:
+    """Reemplaza los resultados fallidos por la causa real de la interrupción"""
+    if isinstance(resultado, list):
+        return [_marcar_interrumpido(r, control) for r in resultado]
+    if isinstance(resultado, dict) and resultado.get("emision_enviada"):
+        # El comprobante pudo quedar registrado en SUNAT: se conserva el resultado real
+        return {**resultado, "interrumpida": control.motivo, "fase": control.fase_interrumpida or resultado.get("fase")}
+    if isinstance(resultado, dict) and not resultado.get("success"):
+        interrumpido = resultado_interrumpido(control.motivo, control.detalle, control.fase_interrumpida)
+        if "tiempos" in resultado:
+            interrumpido["tiempos"] = resultado["tiempos"]
+        return interrumpido
+    return resultado
+
+
+def cancelar(task_id: str, motivo: str, detalle: str) -> bool:
+    """Interrumpe el trabajo de una tarea; si aún no empieza, se omitirá al tomar un worker"""
+    with _lock:
+        control = _activos.get(task_id)
+        if control is None:
+            _previas[task_id] = (motivo, detalle)
+            while len(_previas) > MAX_CANCELACIONES_PREVIAS:
+                _previas.popitem(last=False)
+            return False
+    control.cancelar(motivo, detalle)
+    return True
+
+
+def cancelar_tarea(task_id: str, detalle: str) -> Optional[str]:
+    """Cancelación pedida por el cliente para una tarea de este proceso; retorna por qué no
+    se puede aplicar o None si se aplicó (si aún no empieza, se omitirá al tomar un worker)"""
+    with _lock:
+        control = _activos.get(task_id)
+        if control is None:
+            if task_id in _terminadas:
+                return "la tarea ya terminó y se está registrando su resultado"
+            _previas[task_id] = ("cancelled", detalle)
+            while len(_previas) > MAX_CANCELACIONES_PREVIAS:
+                _previas.popitem(last=False)
+            return None
+    return control.cancelar_tarea(task_id, detalle)
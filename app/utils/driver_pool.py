@@ -0,0 +1,317 @@
+"""Pool de instancias reutilizables de Chrome WebDriver"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import psutil
+
+from app.config import settings
+from app.utils import cancelacion
+from app.utils.logger import logger
+from app.utils.selenium_utils import cerrar_driver, configurar_driver, limpiar_directorio
+from app.utils.tiempos import fase
+
+
+class DriverPoolError(Exception):
+    """Error al obtener un driver del pool"""
+    pass
+
+
+class _DriverEntry:
+    """Driver administrado por el pool junto con su contador de usos"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.usos = 0
+        self.creado = time.time()
+
+
+def _origen(url: str) -> Optional[str]:
+    """Obtiene el origen (esquema + host) de una URL"""
+    parsed = urlparse(url or "")
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def rss_driver_mb(driver) -> float:
+    """Memoria residente (MB) de chromedriver y todos sus procesos de Chrome"""
+    try:
+        proceso = psutil.Process(driver.service.process.pid)
+        procesos = [proceso] + proceso.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return 0.0
+
+    total = 0
+    for p in procesos:
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / (1024 * 1024)
+
+
+class DriverPool:
+    """Mantiene drivers de Chrome calientes para evitar el arranque en cada emisión"""
+
+    def __init__(
+        self,
+        min_size: int = 1,
+        max_size: int = 2,
+        max_uses: int = 20,
+        max_rss_mb: int = 1024,
+        acquire_timeout: int = 60,
+        enabled: bool = True
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Tamaño de pool inválido")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_uses = max_uses
+        self.max_rss_mb = max_rss_mb
+        self.acquire_timeout = acquire_timeout
+        self.enabled = enabled
+
+        self._libres: List[_DriverEntry] = []
+        self._en_uso: Dict[int, _DriverEntry] = {}
+        self._creando = 0
+        self._cerrado = False
+        self._cond = threading.Condition()
+        self._creados = 0
+        self._reciclados = 0
+
+    @property
+    def total(self) -> int:
+        """Drivers vivos (libres + en uso + en creación)"""
+        return len(self._libres) + len(self._en_uso) + self._creando
+
+    def _crear_driver(self):
+        """Lanza una nueva instancia de Chrome"""
+        return configurar_driver(
+            headless=settings.chrome_headless,
+            perfil=settings.browser_profile,
+            bloqueados=[p.strip() for p in settings.browser_blocked_urls.split(",") if p.strip()]
+        )
+
+    def calentar(self) -> None:
+        """Crea drivers hasta alcanzar el tamaño mínimo del pool"""
+        if not self.enabled:
+            return
+
+        while True:
+            with self._cond:
+                if self._cerrado or self.total >= self.min_size:
+                    return
+                self._creando += 1
+
+            entry = None
+            try:
+                entry = _DriverEntry(self._crear_driver())
+            except Exception as e:
+                logger.error(f"No se pudo precalentar driver: {e}")
+            finally:
+                with self._cond:
+                    self._creando -= 1
+                    if entry is not None:
+                        self._creados += 1
+                        self._libres.append(entry)
+                    self._cond.notify()
+
+            if entry is None:
+                return
+
+    @fase("driver")
+    def adquirir(self):
+        """Obtiene un driver saludable del pool, creando uno si hay capacidad"""
+        if not self.enabled:
+            return self._crear_driver()
+
+        limite = time.monotonic() + self.acquire_timeout
+        while True:
+            entry = None
+            crear = False
+            with self._cond:
+                if self._cerrado:
+                    raise DriverPoolError("El pool de drivers está cerrado")
+
+                if self._libres:
+                    entry = self._libres.pop()
+                elif self.total < self.max_size:
+                    self._creando += 1
+                    crear = True
+                else:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise DriverPoolError(
+                            f"No hay drivers disponibles tras {self.acquire_timeout}s"
+                        )
+                    self._cond.wait(restante)
+                    continue
+
+            if crear:
+                try:
+                    entry = _DriverEntry(self._crear_driver())
+                finally:
+                    with self._cond:
+                        self._creando -= 1
+                        if entry is not None:
+                            self._creados += 1
+                        self._cond.notify()
+            elif not self._saludable(entry.driver):
+                logger.warning("Driver del pool no responde, se descarta")
+                self._cerrar_driver(entry.driver)
+                continue
+
+            with self._cond:
+                entry.usos += 1
+                self._en_uso[id(entry.driver)] = entry
+            return entry.driver
+
+    def liberar(self, driver, descartar: bool = False) -> None:
+        """Devuelve un driver al pool, reseteándolo o reciclándolo según corresponda"""
+        if not self.enabled:
+            self._cerrar_driver(driver)
+            return
+
+        with self._cond:
+            entry = self._en_uso.pop(id(driver), None)
+
+        if entry is None:
+            self._cerrar_driver(driver)
+            return
+
+        motivo = None
+        if descartar:
+            motivo = "descartado por el trabajo"
+        elif self._cerrado:
+            motivo = "pool cerrado"
+        elif entry.usos >= self.max_uses:
+            motivo = f"alcanzó {entry.usos} usos"
+        elif self.max_rss_mb and rss_driver_mb(driver) > self.max_rss_mb:
+            motivo = f"supera {self.max_rss_mb} MB de RSS"
+        elif not self._resetear(driver):
+            motivo = "no se pudo resetear"
+
+        if motivo:
+            logger.info(f"Reciclando driver: {motivo}")
+            self._cerrar_driver(driver)
+            with self._cond:
+                self._reciclados += 1
+                reponer = not self._cerrado and self.total < self.min_size
+                self._cond.notify()
+
+            if reponer:
+                threading.Thread(target=self.calentar, daemon=True).start()
+            return
+
+        with self._cond:
+            self._libres.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def driver(self):
+        """Context manager que adquiere y libera un driver del pool"""
+        driver = self.adquirir()
+        control = cancelacion.actual()
+        if control is not None:
+            control.registrar_driver(driver)
+        try:
+            yield driver
+        finally:
+            descartar = False
+            if control is not None:
+                control.liberar_driver(driver)
+                # Un driver de un trabajo interrumpido puede haber sido terminado
+                descartar = control.motivo is not None
+            self.liberar(driver, descartar=descartar)
+
+    def _saludable(self, driver) -> bool:
+        """Verifica que el navegador siga respondiendo"""
+        try:
+            driver.current_url
+            return len(driver.window_handles) > 0
+        except Exception:
+            return False
+
+    def _resetear(self, driver) -> bool:
+        """Limpia cookies, almacenamiento y descargas y vuelve a una página en blanco"""
+        try:
+            driver.switch_to.default_content()
+
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+
+            origenes = {_origen(driver.current_url), _origen(settings.sunat_url)}
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except Exception:
+                pass
+
+            driver.delete_all_cookies()
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            for origen in filter(None, origenes):
+                driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin",
+                    {"origin": origen, "storageTypes": "all"}
+                )
+
+            # Sin sesión no hay formulario que reutilizar: el modo continuo solo aplica dentro de un lote
+            driver.get("about:blank")
+            driver.formulario_actual = None
+            limpiar_directorio(getattr(driver, "download_dir", None))
+            return True
+        except Exception as e:
+            logger.warning(f"Error al resetear driver: {e}")
+            return False
+
+    def _cerrar_driver(self, driver) -> None:
+        """Cierra un driver ignorando errores"""
+        try:
+            cerrar_driver(driver)
+            logger.info("Driver cerrado")
+        except Exception as e:
+            logger.warning(f"Error al cerrar driver: {e}")
+
+    def drivers(self) -> list:
+        """Drivers vivos administrados por el pool"""
+        with self._cond:
+            return [e.driver for e in self._libres] + [e.driver for e in self._en_uso.values()]
+
+    def estadisticas(self) -> dict:
+        """Resumen del estado del pool"""
+        with self._cond:
+            return {
+                "habilitado": self.enabled,
+                "min": self.min_size,
+                "max": self.max_size,
+                "libres": len(self._libres),
+                "en_uso": len(self._en_uso),
+                "creados": self._creados,
+                "reciclados": self._reciclados,
+            }
+
+    def cerrar(self) -> None:
+        """Cierra todos los drivers libres; los que estén en uso se cierran al liberarse"""
+        with self._cond:
+            self._cerrado = True
+            libres, self._libres = self._libres, []
+            self._cond.notify_all()
+
+        for entry in libres:
+            self._cerrar_driver(entry.driver)
+
+
+driver_pool = DriverPool(
+    min_size=settings.driver_pool_min,
+    max_size=settings.driver_pool_max,
+    max_uses=settings.driver_max_uses,
+    max_rss_mb=settings.driver_max_rss_mb,
+    acquire_timeout=settings.driver_pool_timeout,
+    enabled=settings.driver_pool_enabled
+)
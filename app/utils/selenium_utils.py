@@ -4,48 +4,180 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 from app.utils.logger import logger
 import os
+import psutil
+import shutil
+import tempfile
+import time
+import weakref
 from pathlib import Path
+from typing import Callable, Sequence
 
-def configurar_driver(headless: bool = True, download_dir: str = None) -> webdriver.Chrome:
-    """Configura y retorna un WebDriver de Chrome"""
+PERFILES_NAVEGADOR = ("full", "lean")
+
+# Modo liviano: sin extensiones, imágenes ni servicios en segundo plano y con caché de disco reducida
+ARGUMENTOS_LIVIANOS = (
+    "--disable-extensions",
+    "--blink-settings=imagesEnabled=false",
+    "--disk-cache-size=33554432",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter,OptimizationHints",
+)
+
+PREFS_LIVIANAS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.default_content_setting_values.notifications": 2,
+}
+
+def limpiar_directorio(path: str) -> None:
+    """Elimina el contenido de un directorio sin borrar el directorio"""
+    if not path or not os.path.isdir(path):
+        return
+    for nombre in os.listdir(path):
+        ruta = os.path.join(path, nombre)
+        if os.path.isdir(ruta):
+            shutil.rmtree(ruta, ignore_errors=True)
+        else:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+def esperar_descarga(download_dir: str, filename: str, timeout: float = 30,
+                     intervalo_inicial: float = 0.05, intervalo_maximo: float = 0.5,
+                     esperar: Callable[[float], None] = time.sleep) -> bool:
+    """Espera a que Chrome termine de descargar filename (sin .crdownload pendiente).
+
+    esperar hace cada pausa; dentro de un trabajo se pasa cancelacion.esperar para que
+    una cancelación o timeout corte la espera.
+    """
+    destino = os.path.join(download_dir, filename)
+    parcial = destino + ".crdownload"
+    limite = time.monotonic() + timeout
+    intervalo = intervalo_inicial
+    
+    while True:
+        if os.path.exists(destino) and not os.path.exists(parcial):
+            return True
+        
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return False
+        
+        # Backoff exponencial acotado: responde rápido a descargas cortas
+        # sin hacer polling agresivo en descargas lentas
+        esperar(min(intervalo, restante))
+        intervalo = min(intervalo * 1.5, intervalo_maximo)
+
+def bloquear_recursos(driver, patrones: Sequence[str]) -> bool:
+    """Bloquea por CDP las URLs que coinciden con los patrones (comodín *); False si no se pudo"""
+    if not patrones:
+        return True
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patrones)})
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo activar el bloqueo de recursos: {e}")
+        return False
+
+def configurar_driver(headless: bool = True, download_dir: str = None, perfil: str = "full",
+                      bloqueados: Sequence[str] = ()) -> webdriver.Chrome:
+    """Configura y retorna un WebDriver de Chrome aislado (perfil y descargas propios)"""
+    if perfil not in PERFILES_NAVEGADOR:
+        raise ValueError(f"Perfil de navegador no soportado: {perfil}")
     chrome_options = Options()
     
     if headless:
         chrome_options.add_argument("--headless=new")
     
+    # Cada driver usa su propio directorio de trabajo temporal para poder
+    # ejecutar varios Chrome en paralelo sin compartir perfil ni descargas.
+    # Sin --remote-debugging-port fijo, chromedriver elige un puerto libre.
+    workspace_dir = tempfile.mkdtemp(prefix="sunat-chrome-")
+    user_data_dir = os.path.join(workspace_dir, "profile")
+    if not download_dir:
+        download_dir = os.path.join(workspace_dir, "downloads")
+    
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_argument("--remote-debugging-port=9222")
+    chrome_options.add_argument(f"--user-data-dir={user_data_dir}")
     chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
     chrome_options.add_experimental_option('useAutomationExtension', False)
+    if perfil == "lean":
+        for argumento in ARGUMENTOS_LIVIANOS:
+            chrome_options.add_argument(argumento)
     
-    # Configurar directorio de descarga si se proporciona
-    if download_dir:
-        os.makedirs(download_dir, exist_ok=True)
-        prefs = {
-            "download.default_directory": download_dir,
-            "download.prompt_for_download": False,
-            "download.directory_upgrade": True,
-            "plugins.always_open_pdf_externally": True
-        }
-        chrome_options.add_experimental_option("prefs", prefs)
-        logger.info(f"Directorio de descarga configurado: {download_dir}")
+    # Configurar directorio de descarga
+    os.makedirs(download_dir, exist_ok=True)
+    prefs = {
+        "download.default_directory": download_dir,
+        "download.prompt_for_download": False,
+        "download.directory_upgrade": True,
+        "plugins.always_open_pdf_externally": True
+    }
+    if perfil == "lean":
+        prefs.update(PREFS_LIVIANAS)
+    chrome_options.add_experimental_option("prefs", prefs)
+    logger.info(f"Directorio de descarga configurado: {download_dir}")
     
     # Buscar chromedriver.exe en el directorio del proyecto
     project_root = Path(__file__).parent.parent.parent
     chromedriver_path = project_root / "chromedriver.exe"
     
-    if chromedriver_path.exists():
-        logger.info(f"Usando ChromeDriver local: {chromedriver_path}")
-        service = Service(str(chromedriver_path))
-        driver = webdriver.Chrome(service=service, options=chrome_options)
-        logger.info("✓ WebDriver configurado correctamente")
-        return driver
-    else:
-        logger.info("ChromeDriver local no encontrado, usando PATH del sistema...")
-        driver = webdriver.Chrome(options=chrome_options)
-        logger.info("✓ WebDriver configurado correctamente")
-        return driver
+    try:
+        if chromedriver_path.exists():
+            logger.info(f"Usando ChromeDriver local: {chromedriver_path}")
+            service = Service(str(chromedriver_path))
+            driver = webdriver.Chrome(service=service, options=chrome_options)
+        else:
+            logger.info("ChromeDriver local no encontrado, usando PATH del sistema...")
+            driver = webdriver.Chrome(options=chrome_options)
+    except Exception:
+        shutil.rmtree(workspace_dir, ignore_errors=True)
+        raise
+    
+    if perfil == "lean":
+        bloquear_recursos(driver, bloqueados)
+    
+    driver.workspace_dir = workspace_dir
+    driver.download_dir = download_dir
+    # El directorio temporal se borra al cerrar el driver o al ser recolectado
+    driver.cleanup_workspace = weakref.finalize(driver, shutil.rmtree, workspace_dir, ignore_errors=True)
+    
+    logger.info("✓ WebDriver configurado correctamente")
+    return driver
+
+def matar_driver(driver) -> int:
+    """Termina a la fuerza chromedriver y todo su árbol de procesos de Chrome; retorna cuántos terminó"""
+    try:
+        proceso = psutil.Process(driver.service.process.pid)
+        procesos = proceso.children(recursive=True) + [proceso]
+    except (AttributeError, psutil.Error):
+        return 0
+    
+    terminados = 0
+    for p in procesos:
+        try:
+            p.kill()
+            terminados += 1
+        except psutil.Error:
+            continue
+    psutil.wait_procs(procesos, timeout=5)
+    return terminados
+
+def cerrar_driver(driver) -> None:
+    """Cierra el driver y elimina su directorio de trabajo temporal"""
+    try:
+        driver.quit()
+    finally:
+        cleanup = getattr(driver, "cleanup_workspace", None)
+        if cleanup is not None:
+            cleanup()
@@ -0,0 +1,137 @@
+"""Medición de la duración de cada fase de los trabajos de scraping"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence
+
+from app.config import settings
+from app.services.eventos import eventos_tareas
+from app.utils import cancelacion
+
+
+# Límites (segundos) de los buckets de los histogramas por fase
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+_local = threading.local()
+
+
+@contextmanager
+def medir_trabajo() -> Iterator[Optional[Dict[str, float]]]:
+    """Registra las fases ejecutadas en este hilo; entrega el dict de tiempos o None si está deshabilitado"""
+    if not settings.timing_enabled:
+        yield None
+        return
+
+    anterior = getattr(_local, "tiempos", None)
+    tiempos: Dict[str, float] = {}
+    _local.tiempos = tiempos
+    inicio = time.perf_counter()
+    try:
+        yield tiempos
+    finally:
+        tiempos["total"] = time.perf_counter() - inicio
+        for nombre in tiempos:
+            tiempos[nombre] = round(tiempos[nombre], 3)
+        _local.tiempos = anterior
+
+
+@contextmanager
+def fase(nombre: str) -> Iterator[None]:
+    """Suma la duración del bloque a la fase indicada del trabajo actual (también sirve como decorador)"""
+    # El control de cancelación vigila el plazo de cada fase aunque no se midan tiempos
+    control = cancelacion.actual()
+    anterior = control.entrar_fase(nombre) if control is not None else None
+    tiempos = getattr(_local, "tiempos", None)
+    inicio = time.perf_counter()
+    try:
+        yield
+        # Progreso visible para los clientes que esperan la tarea (solo en modo thread comparten proceso)
+        if control is not None:
+            eventos_tareas.publicar_fase(control.tareas_en_curso(), nombre)
+    except Exception as e:
+        # La fase más interna en que ocurrió el error queda en la excepción
+        if getattr(e, "fase", None) is None:
+            try:
+                e.fase = nombre
+            except AttributeError:
+                pass
+        raise
+    finally:
+        if tiempos is not None:
+            tiempos[nombre] = tiempos.get(nombre, 0.0) + time.perf_counter() - inicio
+        if control is not None:
+            control.salir_fase(anterior)
+
+
+def fase_fallida(error: BaseException) -> Optional[str]:
+    """Fase en que se originó una excepción, si ocurrió dentro de una"""
+    return getattr(error, "fase", None)
+
+
+class Histograma:
+    """Histograma acumulado con buckets fijos"""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self.conteos = [0] * (len(self.buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def acumulado(self) -> list:
+        """Pares (límite, conteo acumulado) incluyendo +Inf"""
+        resultado = []
+        acumulado = 0
+        for limite, conteo in zip(self.buckets + (float("inf"),), self.conteos):
+            acumulado += conteo
+            resultado.append((limite, acumulado))
+        return resultado
+
+
+class RegistroTiempos:
+    """Histogramas por tipo de trabajo y fase alimentados con los tiempos de cada resultado"""
+
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histogramas: Dict[tuple, Histograma] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, tipo: str, tiempos: Optional[Dict[str, float]]) -> None:
+        """Agrega los tiempos de un trabajo finalizado"""
+        if not tiempos:
+            return
+        with self._lock:
+            for nombre, duracion in tiempos.items():
+                clave = (tipo, nombre)
+                histograma = self._histogramas.get(clave)
+                if histograma is None:
+                    histograma = self._histogramas[clave] = Histograma(self.buckets)
+                histograma.observar(duracion)
+
+    def histogramas(self) -> Dict[tuple, Histograma]:
+        """Copia de los histogramas indexados por (tipo, fase)"""
+        with self._lock:
+            copia = {}
+            for clave, h in self._histogramas.items():
+                nuevo = Histograma(h.buckets)
+                nuevo.conteos, nuevo.suma, nuevo.total = list(h.conteos), h.suma, h.total
+                copia[clave] = nuevo
+            return copia
+
+    def estadisticas(self) -> dict:
+        """Cantidad y promedio por tipo y fase"""
+        resumen = {}
+        for (tipo, nombre), h in self.histogramas().items():
+            resumen.setdefault(tipo, {})[nombre] = {
+                "n": h.total,
+                "promedio": round(h.suma / h.total, 3) if h.total else 0.0
+            }
+        return resumen
+
+
+registro_tiempos = RegistroTiempos()
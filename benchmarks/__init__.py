@@ -0,0 +1 @@
+"""Benchmarks de emisión contra el portal SUNAT simulado"""
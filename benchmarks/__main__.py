@@ -0,0 +1,111 @@
+"""Benchmark de emisión: python -m benchmarks --tipos BOLETA,FACTURA --items 1,10,50 --concurrencia 1,2"""
+import argparse
+import itertools
+import json
+import sys
+
+from app.config import settings
+from app.services.circuito import circuito_portal
+from app.services.executor import scraper_executor
+from app.utils.driver_pool import driver_pool
+from app.utils.selenium_utils import PERFILES_NAVEGADOR
+from benchmarks import escenarios, reporte
+from mock_sunat import MockPortal, MockPortalConfig
+
+
+def _lista(tipo):
+    return lambda valor: [tipo(v) for v in valor.split(",") if v]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de emisión contra el portal SUNAT simulado")
+    parser.add_argument("--modos", type=_lista(str), default=["directo"],
+                        help=f"Modos separados por coma: {', '.join(escenarios.MODOS)}")
+    parser.add_argument("--tipos", type=_lista(str.upper), default=["BOLETA"],
+                        help="BOLETA, FACTURA y/o NOTA_CREDITO")
+    parser.add_argument("--items", type=_lista(int), default=[1, 10],
+                        help="Productos por comprobante (1-100)")
+    parser.add_argument("--concurrencia", type=_lista(int), default=[1, 2])
+    parser.add_argument("--trabajos", type=int, default=10, help="Comprobantes por escenario")
+    parser.add_argument("--portal", type=json.loads, default={},
+                        help='Configuración del portal simulado, p. ej. \'{"latencia_emision": 0.5}\'')
+    parser.add_argument("--navegador", choices=PERFILES_NAVEGADOR, default=settings.browser_profile,
+                        help="Perfil de Chrome: lean bloquea imágenes, fuentes y analytics")
+    parser.add_argument("--salida", default="benchmarks/resultados/ultimo.json")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--metrica", default="p95", choices=[f"p{p}" for p in reporte.PERCENTILES])
+    parser.add_argument("--tolerancia", type=float, default=0.10,
+                        help="Aumento relativo permitido antes de marcar regresión")
+    args = parser.parse_args()
+
+    for modo in args.modos:
+        if modo not in escenarios.MODOS:
+            parser.error(f"Modo no soportado: {modo}")
+    for items in args.items:
+        if not 1 <= items <= 100:
+            parser.error("--items debe estar entre 1 y 100")
+
+    # Los trabajos corren en hilos para que la API y el benchmark compartan el pool de drivers
+    scraper_executor.mode = "thread"
+    settings.timing_enabled = True
+    # Las fallas inyectadas en el portal se miden, no deben retener la cola
+    circuito_portal.enabled = False
+    settings.browser_profile = args.navegador
+
+    portal_config = MockPortalConfig(**args.portal)
+    resultado = {
+        "entorno": reporte.entorno(),
+        "navegador": args.navegador,
+        "portal": portal_config.model_dump(),
+        "escenarios": [],
+    }
+
+    with MockPortal(portal_config) as portal:
+        settings.sunat_url = portal.sunat_url
+        servidor = escenarios.ServidorApi().start() if "http" in args.modos else None
+
+        try:
+            numero = 1
+            combinaciones = itertools.product(args.modos, args.tipos, args.items, args.concurrencia)
+            vistos = set()
+            for modo, tipo, items, concurrencia in combinaciones:
+                escenario = escenarios.Escenario(modo, tipo, items, concurrencia, args.trabajos)
+                # Las notas de crédito no tienen items: se corre una vez por concurrencia
+                if escenario.nombre in vistos:
+                    continue
+                vistos.add(escenario.nombre)
+
+                resumen = escenarios.ejecutar(escenario, servidor, inicio_numero=numero)
+                numero += escenario.trabajos
+                resultado["escenarios"].append(resumen)
+                reporte.imprimir_escenario(resumen)
+        finally:
+            if servidor is not None:
+                servidor.stop()
+            scraper_executor.shutdown(wait=True)
+            driver_pool.cerrar()
+
+    resultado["portal_eventos"] = dict(portal.estado.contadores)
+    # Con el perfil lean, las fallas y estos recursos muestran si el bloqueo rompió algún selector o no aplicó
+    print(f"\nRecursos no esenciales servidos por el portal: {resultado['portal_eventos'].get('recurso', 0)}")
+    reporte.guardar(args.salida, resultado)
+    print(f"\nResultados guardados en {args.salida}")
+
+    codigo = 0
+    if args.comparar:
+        filas = reporte.comparar(resultado, reporte.cargar(args.comparar), args.metrica, args.tolerancia)
+        reporte.imprimir_comparacion(filas, args.metrica)
+        if any(f["regresion"] for f in filas):
+            codigo = 1
+
+    if args.navegador == "lean":
+        # El perfil lean solo es seguro si ningún selector dejó de funcionar con el bloqueo
+        fallidos = sum(e["trabajos"] - e["exitos"] for e in resultado["escenarios"])
+        if fallidos:
+            print(f"\n{fallidos} trabajos fallaron con el perfil lean: revisar los selectores afectados por el bloqueo")
+            codigo = 1
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
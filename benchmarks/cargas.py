@@ -0,0 +1,67 @@
+"""Generación de comprobantes de prueba para los benchmarks"""
+from datetime import datetime
+
+CREDENCIALES = {"ruc": "20000000001", "usuario": "BENCH", "password": "bench"}
+
+
+def productos(cantidad_items: int) -> list:
+    """Genera cantidad_items productos con IGV"""
+    return [
+        {
+            "cantidad": 1.0,
+            "unidad_medida": "UNIDAD",
+            "descripcion": f"PRODUCTO {i + 1}",
+            "precio_base": 10.0,
+            "igv": 18,
+            "precio_total": 11.8
+        }
+        for i in range(cantidad_items)
+    ]
+
+
+def comprobante(tipo_documento: str, cantidad_items: int, numero: int, credenciales: dict = None) -> dict:
+    """Payload de /api/v1/emitir para una boleta o factura"""
+    items = productos(cantidad_items)
+    total = round(sum(p["precio_total"] for p in items), 2)
+    sub_total = round(sum(p["precio_base"] * p["cantidad"] for p in items), 2)
+
+    if tipo_documento == "BOLETA":
+        cliente = {"dni": "12345678", "nombre": "CLIENTE BENCHMARK"}
+        serie = "EB01"
+    else:
+        cliente = {"ruc": "20100000002", "nombre": "EMPRESA BENCHMARK"}
+        serie = "E001"
+
+    return {
+        "tipo_documento": tipo_documento,
+        "cliente": cliente,
+        "productos": items,
+        "resumen": {
+            "serie": serie,
+            "numero": str(numero),
+            "sub_total": sub_total,
+            "igv_total": round(total - sub_total, 2),
+            "total": total
+        },
+        "fecha": datetime.now().strftime("%d/%m/%Y"),
+        "id_remitente": "benchmark",
+        "credenciales": dict(credenciales or CREDENCIALES)
+    }
+
+
+def nota_credito(numero: int, credenciales: dict = None) -> dict:
+    """Payload de /api/v1/nota-credito"""
+    return {
+        "fecha_emision": datetime.now().strftime("%d/%m/%Y"),
+        "tipo_nota": "01",
+        "numero_boleta": f"EB01-{numero}",
+        "sustento": "Benchmark",
+        "credenciales": dict(credenciales or CREDENCIALES)
+    }
+
+
+def carga(tipo_documento: str, cantidad_items: int, numero: int) -> dict:
+    """Payload según el tipo de documento (BOLETA, FACTURA o NOTA_CREDITO)"""
+    if tipo_documento == "NOTA_CREDITO":
+        return nota_credito(numero)
+    return comprobante(tipo_documento, cantidad_items, numero)
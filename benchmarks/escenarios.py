@@ -0,0 +1,191 @@
+"""Ejecución de escenarios de benchmark: llamadas directas al servicio o vía HTTP"""
+import json
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+import uvicorn
+
+from app.services import nota_credito, scraper_service
+from app.services.executor import scraper_executor
+from app.services.planificador import planificador
+from app.services.task_store import ESTADOS_FINALES
+from app.utils.driver_pool import driver_pool
+from benchmarks import cargas
+from benchmarks.reporte import resumir, resumir_fases
+
+
+MODOS = ("directo", "http")
+
+ENDPOINTS = {
+    "BOLETA": "/api/v1/emitir",
+    "FACTURA": "/api/v1/emitir",
+    "NOTA_CREDITO": "/api/v1/nota-credito",
+}
+
+
+class Escenario:
+    """Combinación de modo, tipo de documento, items por comprobante y concurrencia"""
+
+    def __init__(self, modo: str, tipo_documento: str, items: int, concurrencia: int, trabajos: int):
+        self.modo = modo
+        self.tipo_documento = tipo_documento
+        self.items = items if tipo_documento != "NOTA_CREDITO" else 0
+        self.concurrencia = concurrencia
+        self.trabajos = trabajos
+
+    @property
+    def nombre(self) -> str:
+        return f"{self.modo}/{self.tipo_documento.lower()}/items={self.items}/c={self.concurrencia}"
+
+
+class ServidorApi:
+    """Levanta la API en un hilo para medir los endpoints HTTP"""
+
+    def __init__(self, host: str = "127.0.0.1"):
+        from app.main import app
+        self.app = app
+        self.host = host
+        self.port = 0
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "ServidorApi":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((self.host, 0))
+        self.port = sock.getsockname()[1]
+
+        self._server = uvicorn.Server(uvicorn.Config(self.app, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self._thread.start()
+
+        limite = time.monotonic() + 30
+        while not self._server.started:
+            if time.monotonic() > limite:
+                raise RuntimeError("La API no inició")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=30)
+            self._server = None
+
+
+def _http_json(metodo: str, url: str, cuerpo: dict = None) -> dict:
+    datos = json.dumps(cuerpo).encode() if cuerpo is not None else None
+    request = urllib.request.Request(url, data=datos, method=metodo, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=60) as respuesta:
+        return json.loads(respuesta.read())
+
+
+def _configurar_concurrencia(concurrencia: int) -> None:
+    """Ajusta el pool de drivers y de workers al nivel de concurrencia del escenario"""
+    driver_pool.max_size = max(driver_pool.max_size, concurrencia)
+    # Todas las cargas usan el mismo RUC: el límite por RUC no debe reducir la concurrencia medida
+    planificador.max_por_ruc = concurrencia
+    if scraper_executor.max_workers != concurrencia:
+        scraper_executor.shutdown(wait=True)
+        scraper_executor.max_workers = concurrencia
+
+
+def _ejecutar_directo(escenario: Escenario, inicio_numero: int) -> List[dict]:
+    if escenario.tipo_documento == "NOTA_CREDITO":
+        func = nota_credito.send_nota_credito_sunat
+    else:
+        func = scraper_service.send_billing_sunat
+
+    cargas_trabajo = [
+        cargas.carga(escenario.tipo_documento, escenario.items, inicio_numero + i)
+        for i in range(escenario.trabajos)
+    ]
+    with ThreadPoolExecutor(max_workers=escenario.concurrencia) as pool:
+        resultados = list(pool.map(func, cargas_trabajo))
+
+    return [{"resultado": r} for r in resultados]
+
+
+def _ejecutar_http(escenario: Escenario, servidor: ServidorApi, inicio_numero: int, timeout: float) -> List[dict]:
+    url = servidor.base_url + ENDPOINTS[escenario.tipo_documento]
+
+    def trabajo(numero: int) -> dict:
+        data = cargas.carga(escenario.tipo_documento, escenario.items, numero)
+        enviado = time.perf_counter()
+        tarea = _http_json("POST", url, data)
+        task_id = tarea["task_id"]
+
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            estado = _http_json("GET", f"{servidor.base_url}/api/v1/status/{task_id}")
+            if estado["status"] in ESTADOS_FINALES:
+                return {
+                    "resultado": estado["result"] or {},
+                    "http_total": time.perf_counter() - enviado,
+                    "cola": _espera_cola(tarea["created_at"], estado["started_at"]),
+                }
+            time.sleep(0.1)
+        return {"resultado": {"success": False, "error": "timeout del benchmark"}}
+
+    # Los clientes HTTP pueden superar a los workers: la cola también se mide
+    with ThreadPoolExecutor(max_workers=escenario.concurrencia * 2) as pool:
+        return list(pool.map(trabajo, range(inicio_numero, inicio_numero + escenario.trabajos)))
+
+
+def _espera_cola(created_at: str, started_at: Optional[str]) -> Optional[float]:
+    """Tiempo que la tarea esperó en cola antes de tomar un worker"""
+    if not started_at:
+        return None
+    return (datetime.fromisoformat(started_at) - datetime.fromisoformat(created_at)).total_seconds()
+
+
+def ejecutar(
+    escenario: Escenario,
+    servidor: Optional[ServidorApi] = None,
+    inicio_numero: int = 1,
+    timeout: float = 600
+) -> dict:
+    """Corre un escenario y retorna su resumen por fase"""
+    _configurar_concurrencia(escenario.concurrencia)
+
+    inicio = time.perf_counter()
+    if escenario.modo == "http":
+        resultados = _ejecutar_http(escenario, servidor, inicio_numero, timeout)
+    else:
+        resultados = _ejecutar_directo(escenario, inicio_numero)
+    duracion = time.perf_counter() - inicio
+
+    exitos = sum(1 for r in resultados if r["resultado"].get("success"))
+    errores = {}
+    for r in resultados:
+        if not r["resultado"].get("success"):
+            error = str(r["resultado"].get("error", "desconocido"))[:120]
+            errores[error] = errores.get(error, 0) + 1
+
+    resumen = {
+        "nombre": escenario.nombre,
+        "modo": escenario.modo,
+        "tipo_documento": escenario.tipo_documento,
+        "items": escenario.items,
+        "concurrencia": escenario.concurrencia,
+        "trabajos": escenario.trabajos,
+        "exitos": exitos,
+        "errores": errores,
+        "duracion_s": round(duracion, 3),
+        "por_minuto": round(exitos * 60 / duracion, 2) if duracion else 0.0,
+        "fases": resumir_fases([r["resultado"].get("tiempos") or {} for r in resultados]),
+    }
+
+    if escenario.modo == "http":
+        resumen["fases"]["http_total"] = resumir([r["http_total"] for r in resultados if "http_total" in r])
+        resumen["fases"]["cola"] = resumir([r["cola"] for r in resultados if r.get("cola") is not None])
+
+    return resumen
@@ -0,0 +1,122 @@
+"""Agregación de resultados, persistencia en JSON y comparación con una línea base"""
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil p (0-100) con interpolación lineal entre rangos"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    fraccion = posicion - inferior
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * fraccion
+
+
+def resumir(valores: List[float]) -> dict:
+    """Cantidad, media, máximo y percentiles de una serie de duraciones (segundos)"""
+    resumen = {"n": len(valores)}
+    if valores:
+        resumen["media"] = round(sum(valores) / len(valores), 4)
+        resumen["max"] = round(max(valores), 4)
+        for p in PERCENTILES:
+            resumen[f"p{p}"] = round(percentil(valores, p), 4)
+    return resumen
+
+
+def resumir_fases(trabajos: List[Dict[str, float]]) -> dict:
+    """Resumen por fase a partir de los tiempos reportados en el resultado de cada trabajo"""
+    series: Dict[str, List[float]] = {}
+    for fases in trabajos:
+        for fase, duracion in fases.items():
+            series.setdefault(fase, []).append(duracion)
+    return {fase: resumir(valores) for fase, valores in series.items()}
+
+
+def _commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def entorno() -> dict:
+    """Datos de la máquina y del código con que se corrió el benchmark"""
+    return {
+        "fecha": datetime.utcnow().isoformat(),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def guardar(path: str, resultado: dict) -> None:
+    """Escribe el resultado del benchmark en JSON"""
+    directorio = os.path.dirname(path)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+def cargar(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def comparar(actual: dict, base: dict, metrica: str = "p95", tolerancia: float = 0.10) -> List[dict]:
+    """Compara escenario por escenario y fase por fase; marca regresiones sobre la tolerancia"""
+    base_por_nombre = {e["nombre"]: e for e in base.get("escenarios", [])}
+    filas = []
+
+    for escenario in actual.get("escenarios", []):
+        anterior = base_por_nombre.get(escenario["nombre"])
+        if anterior is None:
+            continue
+
+        for fase, resumen in escenario["fases"].items():
+            previo = anterior["fases"].get(fase, {}).get(metrica)
+            nuevo = resumen.get(metrica)
+            if not previo or nuevo is None:
+                continue
+            cambio = (nuevo - previo) / previo
+            filas.append({
+                "escenario": escenario["nombre"],
+                "fase": fase,
+                "base": previo,
+                "actual": nuevo,
+                "cambio": round(cambio, 4),
+                "regresion": cambio > tolerancia,
+            })
+
+    return filas
+
+
+def imprimir_escenario(escenario: dict) -> None:
+    print(f"\n{escenario['nombre']}: {escenario['exitos']}/{escenario['trabajos']} exitosos, "
+          f"{escenario['por_minuto']:.1f} comprobantes/min")
+    print(f"  {'fase':<12}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for fase, r in escenario["fases"].items():
+        if r["n"]:
+            print(f"  {fase:<12}{r['n']:>6}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}")
+
+
+def imprimir_comparacion(filas: List[dict], metrica: str) -> None:
+    print(f"\nComparación con línea base ({metrica}):")
+    for fila in filas:
+        marca = "  REGRESIÓN" if fila["regresion"] else ""
+        print(f"  {fila['escenario']:<32}{fila['fase']:<12}"
+              f"{fila['base']:>9.3f} -> {fila['actual']:>9.3f} ({fila['cambio']:+.1%}){marca}")
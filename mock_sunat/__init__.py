@@ -0,0 +1,4 @@
+"""Portal simulado de SUNAT para pruebas end-to-end y benchmarks"""
+from mock_sunat.server import MockPortal, MockPortalConfig, crear_app
+
+__all__ = ["MockPortal", "MockPortalConfig", "crear_app"]
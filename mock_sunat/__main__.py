@@ -0,0 +1,30 @@
+"""Inicia el portal simulado: python -m mock_sunat --port 9000 --latencia-emision 1.5"""
+import argparse
+
+import uvicorn
+
+from mock_sunat.server import MockPortalConfig, RUTA_MENU, crear_app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Portal simulado de SUNAT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    for nombre, campo in MockPortalConfig.model_fields.items():
+        opcion = f"--{nombre.replace('_', '-')}"
+        if campo.annotation is bool:
+            parser.add_argument(opcion, action=argparse.BooleanOptionalAction, default=campo.default)
+        elif nombre == "semilla":
+            parser.add_argument(opcion, type=int, default=None)
+        else:
+            parser.add_argument(opcion, type=campo.annotation, default=campo.default)
+
+    args = parser.parse_args()
+    config = MockPortalConfig(**{k: getattr(args, k) for k in MockPortalConfig.model_fields})
+
+    print(f"SUNAT_URL=http://{args.host}:{args.port}{RUTA_MENU}")
+    uvicorn.run(crear_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Plantillas HTML del portal simulado de SUNAT"""
+
+ESTILOS = """
+<style>
+  body { font-family: sans-serif; margin: 16px; }
+  .oculto { display: none !important; }
+  .boton { display: inline-block; padding: 4px 10px; border: 1px solid #888; cursor: pointer; }
+  #waitMessage_underlay { position: fixed; inset: 0; background: rgba(0, 0, 0, .2); }
+  .dialogo { border: 1px solid #444; padding: 12px; margin: 8px 0; background: #fff; }
+  .error { color: #b00; }
+</style>
+"""
+
+RECURSOS = """
+<link rel="stylesheet" href="/recursos/fuentes.css">
+<script src="/recursos/analytics.js"></script>
+"""
+
+LOGIN = """<!DOCTYPE html>
+<html>
+<head><title>SUNAT - Operaciones en Línea</title>{estilos}{recursos}</head>
+<body>
+  <img src="/recursos/logo.png" alt="SUNAT" width="120" height="40">
+  <form method="post" action="/cl-ti-itmenu/login">
+    <div class="error">{error}</div>
+    <input id="txtRuc" name="ruc" placeholder="RUC">
+    <input id="txtUsuario" name="usuario" placeholder="Usuario">
+    <input id="txtContrasena" name="password" type="password" placeholder="Contraseña">
+    <button id="btnAceptar" type="submit">Iniciar sesión</button>
+  </form>
+</body>
+</html>
+"""
+
+MENU = """<!DOCTYPE html>
+<html>
+<head><title>SUNAT - Menú</title>{estilos}{recursos}</head>
+<body>
+  <img src="/recursos/logo.png" alt="SUNAT" width="120" height="40">
+  <input id="txtBusca" placeholder="Buscar opción">
+  <ul id="menu">
+    <li><span class="opcion" data-app="boleta">Emitir Boleta de Venta</span></li>
+    <li><span class="opcion" data-app="factura">Emitir Factura</span></li>
+    <li id="nivel4_11_5_4_1_2"><span class="opcion" data-app="nota-credito">Emitir Nota de Crédito</span></li>
+  </ul>
+  <div id="contenedor"></div>
+  <script>
+    document.querySelectorAll(".opcion").forEach(function (opcion) {{
+      opcion.addEventListener("click", function () {{
+        var contenedor = document.getElementById("contenedor");
+        contenedor.innerHTML = "";
+        var iframe = document.createElement("iframe");
+        iframe.id = "iframeApplication";
+        iframe.width = "1200";
+        iframe.height = "800";
+        iframe.src = "/app/" + opcion.dataset.app;
+        contenedor.appendChild(iframe);
+      }});
+    }});
+  </script>
+</body>
+</html>
+"""
+
+APLICACION = """<!DOCTYPE html>
+<html>
+<head><title>Emisión</title>{estilos}{recursos}</head>
+<body>
+  <div id="waitMessage_underlay" class="oculto"></div>
+  <div id="mensajeError" class="error"></div>
+  {cuerpo}
+  <script>
+    var CONFIG = {config};
+    var TIPO = "{tipo}";
+    var BOTON_DESCARGA = "{boton_descarga}";
+
+    function $(id) {{ return document.getElementById(id); }}
+    function mostrar(id) {{ $(id).classList.remove("oculto"); }}
+    function ocultar(id) {{ $(id).classList.add("oculto"); }}
+
+    function esperar(segundos, callback) {{
+      mostrar("waitMessage_underlay");
+      setTimeout(function () {{ ocultar("waitMessage_underlay"); callback(); }}, segundos * 1000);
+    }}
+
+    function descargar(url) {{
+      var enlace = document.createElement("a");
+      enlace.href = url;
+      enlace.download = "";
+      document.body.appendChild(enlace);
+      enlace.click();
+      enlace.remove();
+    }}
+
+    function emitir(datos) {{
+      mostrar("waitMessage_underlay");
+      fetch("/app/api/emitir", {{
+        method: "POST",
+        headers: {{"Content-Type": "application/json"}},
+        body: JSON.stringify(datos)
+      }}).then(function (r) {{ return r.json(); }}).then(function (r) {{
+        ocultar("waitMessage_underlay");
+        ocultar("dlgConfirm");
+        if (!r.ok) {{ $("mensajeError").textContent = r.error; return; }}
+        // El número y el botón de descarga solo existen una vez emitido el comprobante
+        $("resultado").innerHTML = 'Comprobante emitido: <span id="numeroComprobante"></span> ' +
+          '<span id="' + BOTON_DESCARGA + '" class="boton">Descargar PDF</span>';
+        $("numeroComprobante").textContent = r.numero;
+        $(BOTON_DESCARGA).addEventListener("click", function () {{ descargar(r.pdf); }});
+      }});
+    }}
+  </script>
+  {script}
+</body>
+</html>
+"""
+
+DIALOGOS_EMISION = """
+  <div id="dlgConfirm" class="dialogo oculto">
+    ¿Confirma la emisión del comprobante?
+    <span id="dlgBtnAceptarConfirm_label" class="boton">Aceptar</span>
+  </div>
+  <div id="resultado"></div>
+"""
+
+CUERPO_COMPROBANTE = """
+  <div id="inicio">
+    <input id="inicio.tipoDocumento" value="{tipo_documento_inicial}">
+    <input id="inicio.numeroDocumento">
+    <input id="inicio.razonSocial">
+    <span id="inicio.botonGrabarDocumento_label" class="boton">Continuar</span>
+  </div>
+
+  <div id="documento" class="oculto">
+    <input id="{p}.fechaEmision">
+    <span id="{boton_agregar}" class="boton">Adicionar</span>
+    <table id="items"></table>
+    <input id="{p}.totalGeneral" value="S/ 0.00" readonly>
+    <span id="{p}.botonGrabarDocumento_label" class="boton">Grabar</span>
+  </div>
+
+  <div id="dlgItem" class="dialogo oculto">
+    <input type="radio" id="item.subTipoTI01" name="subTipo"> Bien
+    <input name="cantidad" id="item.cantidad">
+    <input id="item.unidadMedida">
+    <input id="item.descripcion">
+    <input id="item.precioUnitario">
+    <input type="checkbox" id="item.subTipoTB01"> Inafecto
+    <span id="item.botonAceptar_label" class="boton">Aceptar</span>
+  </div>
+
+  <div id="docsrel" class="dialogo oculto">
+    Documentos relacionados
+    <span id="docsrel.botonGrabarDocumento" class="boton"><span>Aceptar</span></span>
+  </div>
+
+  <div id="preliminar" class="oculto">
+    Vista preliminar: <span id="preliminarTotal"></span>
+    <span id="{p}-preliminar.botonGrabarDocumento_label" class="boton">Emitir</span>
+  </div>
+  {dialogos}
+"""
+
+SCRIPT_COMPROBANTE = """
+  <script>
+    var items = [];
+    var P = "{p}";
+
+    function total() {{
+      return items.reduce(function (s, i) {{ return s + i.total; }}, 0);
+    }}
+
+    $("inicio.tipoDocumento").addEventListener("keydown", function (e) {{
+      if (e.key === "Enter") {{ e.target.dataset.seleccionado = e.target.value; }}
+    }});
+
+    $("inicio.numeroDocumento").addEventListener("change", function (e) {{
+      var numero = e.target.value.trim();
+      $("inicio.razonSocial").value = "";
+      fetch("/app/api/cliente?numero=" + encodeURIComponent(numero))
+        .then(function (r) {{ return r.json(); }})
+        .then(function (r) {{ if (r.razon_social) {{ $("inicio.razonSocial").value = r.razon_social; }} }});
+    }});
+
+    $("inicio.botonGrabarDocumento_label").addEventListener("click", function () {{
+      esperar(CONFIG.latencia_formulario, function () {{ ocultar("inicio"); mostrar("documento"); }});
+    }});
+
+    $("{boton_agregar}").addEventListener("click", function () {{
+      esperar(CONFIG.latencia_item, function () {{
+        ["item.cantidad", "item.unidadMedida", "item.descripcion", "item.precioUnitario"].forEach(function (id) {{
+          $(id).value = "";
+        }});
+        $("item.subTipoTI01").checked = false;
+        $("item.subTipoTB01").checked = false;
+        mostrar("dlgItem");
+      }});
+    }});
+
+    $("item.botonAceptar_label").addEventListener("click", function () {{
+      var cantidad = parseFloat($("item.cantidad").value);
+      var precio = parseFloat($("item.precioUnitario").value);
+      if (!$("item.subTipoTI01").checked || isNaN(cantidad) || isNaN(precio) || !$("item.descripcion").value) {{
+        $("mensajeError").textContent = "Item incompleto";
+        return;
+      }}
+      var factor = $("item.subTipoTB01").checked ? 1 : 1.18;
+      var item = {{
+        cantidad: cantidad,
+        unidad: $("item.unidadMedida").value,
+        descripcion: $("item.descripcion").value,
+        precio: precio,
+        total: Math.round(cantidad * precio * factor * 100) / 100
+      }};
+      items.push(item);
+      var fila = $("items").insertRow();
+      fila.insertCell().textContent = item.descripcion;
+      fila.insertCell().textContent = item.total.toFixed(2);
+      ocultar("dlgItem");
+      esperar(CONFIG.latencia_item, function () {{
+        $(P + ".totalGeneral").value = "S/ " + total().toFixed(2);
+      }});
+    }});
+
+    $(P + ".botonGrabarDocumento_label").addEventListener("click", function () {{
+      $("preliminarTotal").textContent = total().toFixed(2);
+      if (CONFIG.docs_relacionados) {{ mostrar("docsrel"); }} else {{ mostrar("preliminar"); }}
+    }});
+
+    $("docsrel.botonGrabarDocumento").addEventListener("click", function () {{
+      ocultar("docsrel");
+      mostrar("preliminar");
+    }});
+
+    $(P + "-preliminar.botonGrabarDocumento_label").addEventListener("click", function () {{
+      ocultar("preliminar");
+      mostrar("dlgConfirm");
+    }});
+
+    $("dlgBtnAceptarConfirm_label").addEventListener("click", function () {{
+      emitir({{tipo: TIPO, fecha: $(P + ".fechaEmision").value, total: total(), items: items.length}});
+    }});
+  </script>
+"""
+
+CUERPO_NOTA_CREDITO = """
+  <div id="pantallaInicial">
+    <input id="pantallaInicial.fechaEmision">
+    <input id="pantallaInicial.tipoNotaCredito">
+    <input id="pantallaInicial.numeroBVE">
+    <input id="pantallaInicial.motivoEmisionNC">
+    <span id="pantallaInicial.btnContinuar_label" class="boton">Continuar</span>
+  </div>
+
+  <div id="preliminar" class="oculto">
+    Vista preliminar
+    <span id="notaCredito-preliminar.botonGrabarDocumento_label" class="boton">Emitir</span>
+  </div>
+  {dialogos}
+"""
+
+SCRIPT_NOTA_CREDITO = """
+  <script>
+    $("pantallaInicial.btnContinuar_label").addEventListener("click", function () {{
+      if (!$("pantallaInicial.numeroBVE").value || !$("pantallaInicial.motivoEmisionNC").value) {{
+        $("mensajeError").textContent = "Datos incompletos";
+        return;
+      }}
+      esperar(CONFIG.latencia_formulario, function () {{ ocultar("pantallaInicial"); mostrar("preliminar"); }});
+    }});
+
+    $("notaCredito-preliminar.botonGrabarDocumento_label").addEventListener("click", function () {{
+      esperar(CONFIG.latencia_formulario, function () {{ ocultar("preliminar"); mostrar("dlgConfirm"); }});
+    }});
+
+    $("dlgBtnAceptarConfirm_label").addEventListener("click", function () {{
+      emitir({{tipo: TIPO, fecha: $("pantallaInicial.fechaEmision").value, total: 0, items: 0}});
+    }});
+  </script>
+"""
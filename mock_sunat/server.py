@@ -0,0 +1,338 @@
+"""Portal simulado de SUNAT para pruebas end-to-end y benchmarks"""
+import asyncio
+import json
+import random
+import secrets
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+from pydantic import BaseModel, Field
+
+from app.services.scraper_service import construir_nombre_pdf
+from app.services.webhooks import verificar_firma
+from mock_sunat import paginas
+
+
+RUTA_MENU = "/cl-ti-itmenu/MenuInternet.htm"
+COOKIE_SESION = "MOCKSESSION"
+
+# PDF mínimo válido que se entrega en cada descarga
+PDF_BASE = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 200]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+TIPOS_APLICACION = {
+    "boleta": "BOLETA",
+    "factura": "FACTURA",
+    "nota-credito": "NOTA_CREDITO",
+}
+
+
+class MockPortalConfig(BaseModel):
+    """Latencias (segundos) y probabilidades de falla del portal simulado"""
+    latencia_login: float = Field(default=0.0, ge=0)
+    latencia_menu: float = Field(default=0.0, ge=0)
+    latencia_formulario: float = Field(default=0.0, ge=0)
+    latencia_cliente: float = Field(default=0.0, ge=0)
+    latencia_item: float = Field(default=0.0, ge=0)
+    latencia_emision: float = Field(default=0.0, ge=0)
+    latencia_pdf: float = Field(default=0.0, ge=0)
+    latencia_recursos: float = Field(default=0.0, ge=0)
+    fallo_login: float = Field(default=0.0, ge=0, le=1)
+    fallo_cliente: float = Field(default=0.0, ge=0, le=1)
+    fallo_emision: float = Field(default=0.0, ge=0, le=1)
+    fallo_pdf: float = Field(default=0.0, ge=0, le=1)
+    fallo_webhook: float = Field(default=0.0, ge=0, le=1)
+    webhook_secret: str = ""
+    sesion_ttl: int = Field(default=3600, ge=1)
+    docs_relacionados: bool = True
+    semilla: Optional[int] = None
+
+
+class _Estado:
+    """Estado mutable del portal: sesiones, correlativos y contadores"""
+
+    def __init__(self, config: MockPortalConfig):
+        self.config = config
+        self.random = random.Random(config.semilla)
+        self.sesiones: Dict[str, tuple] = {}
+        self.correlativos: Dict[tuple, int] = {}
+        self.pdfs: Dict[str, bytes] = {}
+        self.webhooks: List[dict] = []
+        self.contadores: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def contar(self, evento: str) -> None:
+        with self.lock:
+            self.contadores[evento] = self.contadores.get(evento, 0) + 1
+
+    def falla(self, probabilidad: float) -> bool:
+        with self.lock:
+            return probabilidad > 0 and self.random.random() < probabilidad
+
+    def ruc_sesion(self, request: Request) -> Optional[str]:
+        token = request.cookies.get(COOKIE_SESION)
+        sesion = self.sesiones.get(token) if token else None
+        if sesion is None or sesion[1] < time.time():
+            return None
+        return sesion[0]
+
+
+def crear_app(config: Optional[MockPortalConfig] = None) -> FastAPI:
+    """Crea la aplicación del portal simulado"""
+    estado = _Estado(config or MockPortalConfig())
+    app = FastAPI(title="Mock SUNAT", docs_url=None, redoc_url=None)
+    app.state.portal = estado
+
+    def html(plantilla: str, **kwargs) -> HTMLResponse:
+        return HTMLResponse(plantilla.format(
+            estilos=paginas.ESTILOS, recursos=paginas.RECURSOS, **kwargs
+        ))
+
+    @app.get(RUTA_MENU)
+    async def menu(request: Request):
+        await asyncio.sleep(estado.config.latencia_menu)
+        if estado.ruc_sesion(request) is None:
+            return html(paginas.LOGIN, error="")
+        estado.contar("menu")
+        return html(paginas.MENU)
+
+    @app.post("/cl-ti-itmenu/login")
+    async def login(request: Request):
+        formulario = parse_qs((await request.body()).decode())
+        ruc, usuario, password = (formulario.get(c, [""])[0] for c in ("ruc", "usuario", "password"))
+
+        await asyncio.sleep(estado.config.latencia_login)
+        estado.contar("login")
+
+        if not (ruc and usuario and password):
+            estado.contar("login_rechazado")
+            return html(paginas.LOGIN, error="Usuario o clave incorrectos")
+        if estado.falla(estado.config.fallo_login):
+            # Falla del portal, no de las credenciales
+            estado.contar("login_fallido")
+            return html(paginas.LOGIN, error="Servicio no disponible, intente nuevamente")
+
+        token = secrets.token_hex(16)
+        estado.sesiones[token] = (ruc, time.time() + estado.config.sesion_ttl)
+        respuesta = RedirectResponse(RUTA_MENU, status_code=303)
+        respuesta.set_cookie(COOKIE_SESION, token, httponly=True)
+        return respuesta
+
+    @app.get("/app/{aplicacion}")
+    async def aplicacion(aplicacion: str, request: Request):
+        tipo = TIPOS_APLICACION.get(aplicacion)
+        if tipo is None:
+            return Response(status_code=404)
+        if estado.ruc_sesion(request) is None:
+            return Response("Sesión expirada", status_code=401)
+
+        await asyncio.sleep(estado.config.latencia_formulario)
+        estado.contar(f"formulario_{aplicacion}")
+
+        config = json.dumps({
+            "latencia_formulario": estado.config.latencia_formulario,
+            "latencia_item": estado.config.latencia_item,
+            "docs_relacionados": estado.config.docs_relacionados,
+        })
+
+        if tipo == "NOTA_CREDITO":
+            cuerpo = paginas.CUERPO_NOTA_CREDITO.format(dialogos=paginas.DIALOGOS_EMISION)
+            script = paginas.SCRIPT_NOTA_CREDITO.format()
+            boton_descarga = "dijit_form_Button_3_label"
+        else:
+            p = tipo.lower()
+            cuerpo = paginas.CUERPO_COMPROBANTE.format(
+                p=p,
+                tipo_documento_inicial="" if tipo == "BOLETA" else "REG. UNICO DE CONTRIBUYENTES",
+                boton_agregar="boleta.addItemButton" if tipo == "BOLETA" else "factura.addItemButton_label",
+                dialogos=paginas.DIALOGOS_EMISION
+            )
+            script = paginas.SCRIPT_COMPROBANTE.format(
+                p=p,
+                boton_agregar="boleta.addItemButton" if tipo == "BOLETA" else "factura.addItemButton_label"
+            )
+            boton_descarga = "dijit_form_Button_2_label"
+
+        return HTMLResponse(paginas.APLICACION.format(
+            estilos=paginas.ESTILOS,
+            recursos=paginas.RECURSOS,
+            cuerpo=cuerpo,
+            script=script,
+            config=config,
+            tipo=tipo,
+            boton_descarga=boton_descarga
+        ))
+
+    @app.get("/app/api/cliente")
+    async def cliente(numero: str, request: Request):
+        await asyncio.sleep(estado.config.latencia_cliente)
+        estado.contar("consulta_cliente")
+        if estado.ruc_sesion(request) is None or estado.falla(estado.config.fallo_cliente):
+            return JSONResponse({"razon_social": ""})
+        return JSONResponse({"razon_social": f"CLIENTE {numero}"})
+
+    @app.post("/app/api/emitir")
+    async def emitir(request: Request):
+        ruc = estado.ruc_sesion(request)
+        datos = await request.json()
+        await asyncio.sleep(estado.config.latencia_emision)
+
+        if ruc is None:
+            return JSONResponse({"ok": False, "error": "Sesión expirada"})
+        if estado.falla(estado.config.fallo_emision):
+            estado.contar("emision_fallida")
+            return JSONResponse({"ok": False, "error": "Error al emitir el comprobante"})
+
+        tipo = datos.get("tipo", "BOLETA")
+        with estado.lock:
+            clave = (ruc, tipo)
+            estado.correlativos[clave] = estado.correlativos.get(clave, 0) + 1
+            numero = str(estado.correlativos[clave])
+
+        nombre = construir_nombre_pdf(tipo, numero, ruc)
+        estado.pdfs[nombre] = PDF_BASE + f"% {tipo} {numero} {ruc}\n".encode()
+        estado.contar(f"emision_{tipo.lower()}")
+        return JSONResponse({"ok": True, "numero": numero, "pdf": f"/app/pdf/{nombre}"})
+
+    @app.get("/app/pdf/{nombre}")
+    async def pdf(nombre: str):
+        await asyncio.sleep(estado.config.latencia_pdf)
+        contenido = estado.pdfs.get(nombre)
+        if contenido is None or estado.falla(estado.config.fallo_pdf):
+            return Response(status_code=500)
+        estado.contar("descarga_pdf")
+        return Response(
+            contenido,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
+        )
+
+    @app.get("/recursos/{nombre}")
+    async def recurso(nombre: str):
+        """Recursos no esenciales (imágenes, fuentes, analytics) con su propia latencia"""
+        await asyncio.sleep(estado.config.latencia_recursos)
+        estado.contar("recurso")
+        tipos = {".png": "image/png", ".css": "text/css", ".js": "application/javascript"}
+        extension = nombre[nombre.rfind("."):]
+        return Response(b"", media_type=tipos.get(extension, "application/octet-stream"))
+
+    @app.get("/mock/estado")
+    async def ver_estado():
+        return {"config": estado.config.model_dump(), "contadores": estado.contadores}
+
+    @app.put("/mock/config")
+    async def cambiar_config(config: MockPortalConfig):
+        estado.config = config
+        estado.random = random.Random(config.semilla)
+        return config
+
+    @app.post("/mock/webhooks")
+    async def recibir_webhook(request: Request):
+        """Receptor de notificaciones de la API (callback_url) para pruebas locales"""
+        cuerpo = await request.body()
+        if estado.falla(estado.config.fallo_webhook):
+            estado.contar("webhook_fallido")
+            return Response(status_code=503)
+
+        firma_valida = None
+        if estado.config.webhook_secret:
+            firma_valida = verificar_firma(
+                estado.config.webhook_secret,
+                request.headers.get("X-Webhook-Timestamp", ""),
+                cuerpo,
+                request.headers.get("X-Webhook-Signature", "")
+            )
+            if not firma_valida:
+                estado.contar("webhook_firma_invalida")
+                return Response(status_code=401)
+
+        estado.contar("webhook")
+        with estado.lock:
+            estado.webhooks.append({
+                "id": request.headers.get("X-Webhook-Id"),
+                "evento": request.headers.get("X-Webhook-Event"),
+                "intento": int(request.headers.get("X-Webhook-Attempt", "1")),
+                "firma_valida": firma_valida,
+                "payload": json.loads(cuerpo),
+            })
+        return {"ok": True}
+
+    @app.get("/mock/webhooks")
+    async def ver_webhooks():
+        return estado.webhooks
+
+    @app.delete("/mock/webhooks")
+    async def limpiar_webhooks():
+        estado.webhooks.clear()
+        return {"ok": True}
+
+    @app.delete("/mock/sesiones")
+    async def expirar_sesiones():
+        """Invalida todas las sesiones para simular su expiración"""
+        estado.sesiones.clear()
+        return {"ok": True}
+
+    return app
+
+
+class MockPortal:
+    """Ejecuta el portal simulado en un hilo, en un puerto libre de localhost"""
+
+    def __init__(self, config: Optional[MockPortalConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.app = crear_app(config)
+        self.host = host
+        self.port = port
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def estado(self) -> _Estado:
+        return self.app.state.portal
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def sunat_url(self) -> str:
+        """Valor a usar en settings.sunat_url"""
+        return f"{self.base_url}{RUTA_MENU}"
+
+    def start(self) -> "MockPortal":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+
+        self._server = uvicorn.Server(uvicorn.Config(self.app, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, daemon=True)
+        self._thread.start()
+
+        limite = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > limite:
+                raise RuntimeError("El portal simulado no inició")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(timeout=10)
+            self._server = None
+
+    def __enter__(self) -> "MockPortal":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
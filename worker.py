@@ -0,0 +1,13 @@
+"""Script de inicio de los workers de la cola (EXECUTOR_MODE=queue)"""
+import argparse
+
+from app.config import settings
+from app.services.cola_trabajos import calcular_workers, supervisar
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workers que ejecutan los trabajos encolados por la API")
+    parser.add_argument("--workers", type=int, default=settings.queue_workers,
+                        help="Cantidad de procesos (0 = según núcleos y memoria disponible)")
+    args = parser.parse_args()
+
+    supervisar(calcular_workers(args.workers))